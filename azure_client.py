@@ -1,21 +1,364 @@
+'''
+Azure AI inference client module. Shares one sync and one async ChatCompletionsClient (and with them
+one HTTP connection pool each) between all the generation modules, and rate limits every call per model.
+The generation modules call these through generation/model_calls (`call_model`, `call_model_async`).
+'''
+
 import os
+import time
+import random
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+from azure.core.exceptions import HttpResponseError
+
+ENDPOINT = "https://models.inference.ai.azure.com"
+
+# Clients are created on first use (not on import), so importing the generation modules needs neither
+# credentials nor client construction. Providers can be swapped out (e.g. for utils.mock_inference).
+_client = None
+_client_provider: Optional[Callable] = None
+_client_lock = threading.Lock()
+_async_client = None
+_async_client_provider: Optional[Callable] = None
+_async_client_lock = threading.Lock()
+
+
+def _get_github_token() -> str:
+    github_token = os.getenv("GITHUB_TOKEN")
+    if github_token is None:
+        raise ValueError(
+        '''
+        [azure_client] API key is not set.
+        Please set the GITHUB_TOKEN environment variable.
+        '''
+        )
+    return github_token
+
+
+def create_client():
+    """
+    ### Default provider: a ChatCompletionsClient for the GitHub Models endpoint.
+    """
+    from azure.ai.inference import ChatCompletionsClient
+    from azure.core.credentials import AzureKeyCredential
+    return ChatCompletionsClient(
+        endpoint=ENDPOINT,
+        credential=AzureKeyCredential(_get_github_token()),
+        model="model-should-be-specified-with-each-call")
+
+
+def get_client():
+    """
+    ### Returns the shared sync client, created by the client provider on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = (_client_provider or create_client)()
+        return _client
+
+
+def set_client(client):
+    """
+    ### Replaces the shared sync client (e.g. with a local stand-in such as utils.mock_inference).
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def set_client_provider(provider: Optional[Callable]):
+    """
+    ### Sets the function used to create the shared sync client on first use (None restores the default).
+    The current client is dropped, so the next call creates a new one.
+    """
+    global _client, _client_provider
+    with _client_lock:
+        _client_provider = provider
+        _client = None
+
+
+def create_async_client():
+    """
+    ### Default provider: an async ChatCompletionsClient for the GitHub Models endpoint.
+    """
+    from azure.ai.inference.aio import ChatCompletionsClient as AsyncChatCompletionsClient
+    from azure.core.credentials import AzureKeyCredential
+    return AsyncChatCompletionsClient(
+        endpoint=ENDPOINT,
+        credential=AzureKeyCredential(_get_github_token()),
+        model="model-should-be-specified-with-each-call")
+
+
+def get_async_client():
+    """
+    ### Returns the shared async client, created by the async client provider on first use.
+    All async calls go through this one client so they share its HTTP connection pool.
+    """
+    global _async_client
+    with _async_client_lock:
+        if _async_client is None:
+            _async_client = (_async_client_provider or create_async_client)()
+        return _async_client
+
+
+def set_async_client(client):
+    """
+    ### Replaces the shared async client (e.g. with utils.mock_inference.MockAsyncChatCompletionsClient).
+    """
+    global _async_client
+    with _async_client_lock:
+        _async_client = client
+
+
+def set_async_client_provider(provider: Optional[Callable]):
+    """
+    ### Sets the function used to create the shared async client on first use (None restores the default).
+    The current client is dropped (not closed, see close_async_client), so the next call creates a new one.
+    """
+    global _async_client, _async_client_provider
+    with _async_client_lock:
+        _async_client_provider = provider
+        _async_client = None
+
+
+async def close_async_client():
+    """
+    ### Closes the shared async client and its connection pool.
+    """
+    global _async_client
+    with _async_client_lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.close()
+
+
+# ------------------------------
+# Rate limiting
+# ------------------------------
+
+# Default limits applied to every model without an explicit entry in MODEL_RATE_LIMITS
+DEFAULT_REQUESTS_PER_MINUTE = 15
+DEFAULT_TOKENS_PER_MINUTE = 150000
+
+# Per model limits: {model: (requests per minute, tokens per minute)}
+MODEL_RATE_LIMITS: Dict[str, tuple] = {}
+
+# How many times a call is retried after the endpoint answered with 429
+RATE_LIMIT_MAX_RETRIES = 5
+# Backoff used when a 429 response does not carry a Retry-After header
+RATE_LIMIT_BASE_BACKOFF_SECONDS = 2.0
+RATE_LIMIT_MAX_BACKOFF_SECONDS = 60.0
+
+# Completion budget assumed for a call when max_tokens isn't passed
+DEFAULT_COMPLETION_TOKENS_ESTIMATE = 512
+
+
+class TokenBucket:
+    """
+    ### Thread-safe token bucket.
+    Tokens refill continuously up to {capacity}. Reserving more tokens than are available
+    puts the bucket in debt, and the returned wait time tells the caller how long to sleep.
+    """
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_second)
+        self._updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        ### Takes {amount} tokens from the bucket.
+        #### Returns:
+        - float: Seconds to wait before the reserved tokens are actually available.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_second
+
+    def adjust(self, amount: float):
+        """
+        ### Gives back (positive) or takes (negative) tokens after a call's real cost is known.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class ModelRateLimiter:
+    """
+    ### Requests/min and tokens/min limiter for a single model.
+    Also holds back every call for the model after the endpoint returned a Retry-After.
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        with self._lock:
+            blocked_for = self._blocked_until - time.monotonic()
+        return max(wait, blocked_for)
+
+    def acquire(self, estimated_tokens: int):
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens: int):
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """
+        ### Reconciles the tokens/min bucket with the usage reported by the endpoint.
+        """
+        if actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def block_for(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def headroom(self) -> float:
+        """
+        ### Fraction (0 - 1) of the requests/min budget currently available.
+        """
+        with self._lock:
+            if self._blocked_until > time.monotonic():
+                return 0.0
+        return max(0.0, self.requests.available()) / self.requests.capacity
+
+
+_rate_limiters: Dict[str, ModelRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def set_rate_limit(model: str, requests_per_minute: int, tokens_per_minute: int):
+    """
+    ### Sets (or replaces) the rate limits used for {model}.
+    """
+    with _rate_limiters_lock:
+        MODEL_RATE_LIMITS[model] = (requests_per_minute, tokens_per_minute)
+        _rate_limiters.pop(model, None)
+
+
+def get_rate_limiter(model: str) -> ModelRateLimiter:
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model)
+        if limiter is None:
+            requests_per_minute, tokens_per_minute = MODEL_RATE_LIMITS.get(
+                model, (DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE))
+            limiter = ModelRateLimiter(requests_per_minute, tokens_per_minute)
+            _rate_limiters[model] = limiter
+        return limiter
+
+
+def estimate_tokens(messages, max_tokens: Optional[int] = None) -> int:
+    """
+    ### Rough token estimate (~4 characters per token) for a call, including its completion budget.
+    """
+    prompt_characters = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_characters // 4 + (max_tokens or DEFAULT_COMPLETION_TOKENS_ESTIMATE)
+
+
+def _usage_total_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def is_rate_limited_error(error: Exception) -> bool:
+    return isinstance(error, HttpResponseError) and getattr(error, "status_code", None) == 429
+
 
-from azure.ai.inference import ChatCompletionsClient
-from azure.core.credentials import AzureKeyCredential
+def retry_after_seconds(error: Exception, attempt: int) -> float:
+    """
+    ### Seconds to wait after a 429. Uses the Retry-After headers if the endpoint sent them,
+    ### jittered exponential backoff otherwise.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("x-ms-retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value) * scale
+        except ValueError:
+            continue
+    backoff = min(RATE_LIMIT_MAX_BACKOFF_SECONDS, RATE_LIMIT_BASE_BACKOFF_SECONDS * (2 ** attempt))
+    return random.uniform(backoff / 2, backoff)
 
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 
-if GITHUB_TOKEN is None:
-    raise ValueError(
-    '''
-    [headline_generation] API key is not set. 
-    Please set the GITHUB_TOKEN environment variable.
-    '''
-    )
+def complete(model: str, messages, **kwargs):
+    """
+    ### Rate limited `ChatCompletionsClient.complete` call.
+    Waits for the model's requests/min and tokens/min budget and backs off on 429 responses,
+    honouring Retry-After.
+    #### Args:
+    - model (str): The model to call
+    - messages (list): Chat messages
+    - kwargs: Any other `complete` parameters
+    #### Returns:
+    - ChatCompletions response
+    """
+    limiter = get_rate_limiter(model)
+    estimated_tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+    attempt = 0
+    while True:
+        limiter.acquire(estimated_tokens)
+        try:
+            response = get_client().complete(model=model, messages=messages, **kwargs)
+        except HttpResponseError as error:
+            if not is_rate_limited_error(error) or attempt >= RATE_LIMIT_MAX_RETRIES:
+                raise
+            wait = retry_after_seconds(error, attempt)
+            print(f"[azure_client] {model} rate limited (429). Retrying in {wait:.1f}s.")
+            limiter.block_for(wait)
+            attempt += 1
+            continue
+        limiter.record_usage(estimated_tokens, _usage_total_tokens(response))
+        return response
 
-_client = ChatCompletionsClient(
-    endpoint="https://models.inference.ai.azure.com",
-    credential=AzureKeyCredential(GITHUB_TOKEN),
-    model="model-should-be-specified-with-each-call")
 
-def get_client(): return _client;
\ No newline at end of file
+async def complete_async(model: str, messages, **kwargs):
+    """
+    ### Async variant of `complete` using the shared async client.
+    Only rate limited: go through `model_calls.call_model_async` for timeouts, retries, caching and metrics.
+    """
+    limiter = get_rate_limiter(model)
+    estimated_tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+    attempt = 0
+    while True:
+        await limiter.acquire_async(estimated_tokens)
+        try:
+            response = await get_async_client().complete(model=model, messages=messages, **kwargs)
+        except HttpResponseError as error:
+            if not is_rate_limited_error(error) or attempt >= RATE_LIMIT_MAX_RETRIES:
+                raise
+            wait = retry_after_seconds(error, attempt)
+            print(f"[azure_client] {model} rate limited (429). Retrying in {wait:.1f}s.")
+            limiter.block_for(wait)
+            attempt += 1
+            continue
+        limiter.record_usage(estimated_tokens, _usage_total_tokens(response))
+        return response
@@ -0,0 +1,147 @@
+'''
+End-to-end throughput benchmark. Runs the batch generation pipeline against the local mock inference
+client (and mongomock, if installed) at different concurrency levels and headline history sizes, and
+reports articles/minute, model calls per article and peak memory.
+
+No network access or credentials are needed.
+
+Usage (from the repository root):
+    python -m benchmarks.throughput --articles 20 --concurrency 1 4 8 --history 0 1000 10000 --latency-ms 200
+'''
+
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+from time import perf_counter
+
+import azure_client
+from generation import article_generation, batch_generation, content_generation, headline_generation, translations
+from utils import database, journal, metrics, translation_memory
+from utils.mock_inference import MockChatCompletionsClient, VOCABULARY, make_mock_mongo_client
+
+BENCHMARK_MODELS = ["mock-model-a", "mock-model-b"]
+
+
+def write_history(directory: str, history_size: int, seed: int):
+    """
+    ### Seeds a data directory with {history_size} synthetic past headlines.
+    """
+    rng = random.Random(f"history-{seed}")
+    headlines = [" ".join(rng.choice(VOCABULARY) for _ in range(10)).capitalize() for _ in range(history_size)]
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    with open(os.path.join(directory, article_generation.HEADLINE_FILE_PATH), "w") as file:
+        json.dump({"headlines": headlines}, file)
+
+
+def run_benchmark(articles: int, concurrency: int, history_size: int, args) -> dict:
+    """
+    ### Runs one benchmark configuration in a fresh temporary data directory.
+    """
+    client = MockChatCompletionsClient(
+        latency_mean_seconds=args.latency_ms / 1000,
+        latency_distribution=args.latency_distribution,
+        rate_limit_probability=args.rate_limit_probability,
+        retry_after_seconds=args.retry_after_seconds,
+        seed=args.seed
+    )
+    azure_client.set_client(client)
+    models = BENCHMARK_MODELS[:args.models]
+    for model in models:
+        azure_client.set_rate_limit(model, requests_per_minute=args.requests_per_minute, tokens_per_minute=10 ** 9)
+
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        write_history(directory, history_size, args.seed)
+        os.chdir(directory)
+        run_metrics = metrics.reset_metrics()
+        try:
+            tracemalloc.start()
+            started_at = perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                generated = batch_generation.generate_articles(
+                    n=max(1, articles // len(models)),
+                    models=models,
+                    concurrency=concurrency
+                )
+                pushed = 0
+                if _mongomock_available():
+                    database.set_mongo_client(make_mock_mongo_client())
+                    pushed = database.push_articles_to_db("testing", journal.read_records(article_generation.ARTICLES_JOURNAL_PATH))
+                    database.clear_push_checkpoint()
+            elapsed = perf_counter() - started_at
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            # The translation memory lives in the temporary directory
+            translation_memory.close_translation_memory()
+            os.chdir(original_directory)
+
+    summary = run_metrics.summary()
+    return {
+        "concurrency": concurrency,
+        "history_size": history_size,
+        "articles": len(generated),
+        "pushed_to_db": pushed,
+        "seconds": elapsed,
+        "articles_per_minute": len(generated) / elapsed * 60 if elapsed > 0 else 0.0,
+        "model_calls_per_article": summary["model_calls_per_article"],
+        "tokens_per_article": summary["tokens_per_article"],
+        "rate_limited_calls": client.rate_limited_count,
+        "peak_memory_mb": peak_memory / (1024 * 1024),
+    }
+
+
+def _mongomock_available() -> bool:
+    try:
+        make_mock_mongo_client()
+        return True
+    except ImportError:
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end throughput benchmark")
+    parser.add_argument("--articles", type=int, default=20, help="Articles per configuration")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 1000, 10000], help="Past headline counts")
+    parser.add_argument("--models", type=int, default=1, choices=range(1, len(BENCHMARK_MODELS) + 1))
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Mean mock call latency")
+    parser.add_argument("--latency-distribution", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="Share of calls failing with 429")
+    parser.add_argument("--retry-after-seconds", type=float, default=0.5)
+    parser.add_argument("--requests-per-minute", type=int, default=100000, help="Client-side rate limit per model")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    # Measure real (mock) calls rather than cache or translation memory hits
+    headline_generation.CACHE_ENABLED = False
+    content_generation.CACHE_ENABLED = False
+    translations.CACHE_ENABLED = False
+    translations.TRANSLATION_MEMORY_ENABLED = False
+
+    results = []
+    print(f"{'concurrency':>11} {'history':>8} {'articles':>8} {'art/min':>9} {'calls/art':>9} {'tokens/art':>10} {'429s':>5} {'peak MB':>8}")
+    for history_size in args.history:
+        for concurrency in args.concurrency:
+            result = run_benchmark(args.articles, concurrency, history_size, args)
+            results.append(result)
+            print(
+                f"{result['concurrency']:>11} {result['history_size']:>8} {result['articles']:>8} "
+                f"{result['articles_per_minute']:>9.1f} {result['model_calls_per_article']:>9.1f} "
+                f"{result['tokens_per_article']:>10.0f} {result['rate_limited_calls']:>5} {result['peak_memory_mb']:>8.1f}"
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+        print(f"Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,18 +1,45 @@
 '''
-Aricle dataclass to store information about a news article. 
+Aricle class to store information about a news article.
 '''
 
 import random
 import string
-import json
-from dataclasses import dataclass, field, asdict
 from datetime import datetime
+from typing import Dict, Optional
+
+from utils import serialization
+from utils.locales import supported_locales
+
+LOCALIZED_FIELDS = ("headline", "detail", "content")
+
+
+class LocalizedText:
+    '''
+    ### Headline, detail and content of an article in a single locale.
+    '''
+    __slots__ = ("headline", "detail", "content")
+
+    def __init__(self, headline: str = "", detail: str = "", content: str = ""):
+        self.headline = headline
+        self.detail = detail
+        self.content = content
+
+    def __eq__(self, other):
+        return isinstance(other, LocalizedText) and all(getattr(self, name) == getattr(other, name) for name in LOCALIZED_FIELDS)
+
+    def __repr__(self):
+        return f"LocalizedText(headline={self.headline!r}, detail={self.detail!r}, content={self.content!r})"
+
+
+def _random_uid() -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=10))
 
 
-@dataclass
 class Article:
     '''
-    ### Article dataclass to store information about a news article.
+    ### Article class to store information about a news article.
+    Localized texts are kept in a locale -> LocalizedText mapping, but the article still reads, writes and
+    serializes the flat `localized_{headline,detail,content}_{locale}` fields of the Mongo documents.
     #### Attributes:
     - uid: str - Unique identifier for the article
     - created_at: datetime - Date and time when the article was created
@@ -25,45 +52,148 @@ class Article:
     - headline_model_used: str - Model used for headline generation
     - content_model_used: str - Model used for content generation
     - translation_model_used: str - Model used for content translation
-    - localized_headline_en: str - Localized headline in English
-    - localized_detail_en: str - Localized detail in English
-    - localized_content_en: str - Localized content in English
-    - localized_headline_es: str - Localized headline in Spanish
-    - localized_detail_es: str - Localized detail in Spanish
-    - localized_content_es: str - Localized content in Spanish
-    - localized_headline_fr: str - Localized headline in French
-    - localized_detail_fr: str - Localized detail in French
-    - localized_content_fr: str - Localized content in French
-    - localized_headline_de: str - Localized headline in German
-    - localized_detail_de: str - Localized detail in German
-    - localized_content_de: str - Localized content in German
+    - localized: Dict[str, LocalizedText] - Localized headline, detail and content by locale (en, es, fr, de)
+    - localized_{headline,detail,content}_{locale}: str - Flat accessors for the localized texts
     '''
-    uid: str = field(default_factory=lambda: ''.join(random.choices(string.ascii_letters + string.digits, k=10)))
-    created_at: datetime = field(default_factory=datetime.now)
-    headline: str = ""
-    detail: str = ""
-    content: str = ""
-    is_fake: bool = False
-    style_or_source: str = ""
-    origin_locale: str = ""
-    headline_model_used: str = ""
-    content_model_used: str = ""
-    translation_model_used: str = ""
-    localized_headline_en: str = ""
-    localized_detail_en: str = ""
-    localized_content_en: str = ""
-    localized_headline_es: str = ""
-    localized_detail_es: str = ""
-    localized_content_es: str = ""
-    localized_headline_fr: str = ""
-    localized_detail_fr: str = ""
-    localized_content_fr: str = ""
-    localized_headline_de: str = ""
-    localized_detail_de: str = ""
-    localized_content_de: str = ""
-    
-    def to_dict(self):
-      return asdict(self)
-
-    def to_json(self):
-      return json.dumps(self.to_dict(), indent=4)
\ No newline at end of file
+    __slots__ = (
+        "uid",
+        "created_at",
+        "headline",
+        "detail",
+        "content",
+        "is_fake",
+        "style_or_source",
+        "origin_locale",
+        "headline_model_used",
+        "content_model_used",
+        "translation_model_used",
+        "localized",
+    )
+
+    def __init__(
+        self,
+        uid: Optional[str] = None,
+        created_at: Optional[datetime] = None,
+        headline: str = "",
+        detail: str = "",
+        content: str = "",
+        is_fake: bool = False,
+        style_or_source: str = "",
+        origin_locale: str = "",
+        headline_model_used: str = "",
+        content_model_used: str = "",
+        translation_model_used: str = "",
+        localized: Optional[Dict[str, LocalizedText]] = None,
+        **localized_fields
+        ):
+        self.uid = uid if uid is not None else _random_uid()
+        self.created_at = created_at if created_at is not None else datetime.now()
+        self.headline = headline
+        self.detail = detail
+        self.content = content
+        self.is_fake = is_fake
+        self.style_or_source = style_or_source
+        self.origin_locale = origin_locale
+        self.headline_model_used = headline_model_used
+        self.content_model_used = content_model_used
+        self.translation_model_used = translation_model_used
+        self.localized = {locale: LocalizedText() for locale in supported_locales}
+        for locale, texts in (localized or {}).items():
+            self.localized[locale] = texts
+        for name, value in localized_fields.items():
+            if name not in _LOCALIZED_FIELD_NAMES:
+                raise TypeError(f"Article got an unexpected keyword argument '{name}'")
+            setattr(self, name, value)
+
+    def set_localized(self, locale: str, headline: str, detail: str, content: str):
+        self.localized[locale] = LocalizedText(headline, detail, content)
+
+    def to_dict(self) -> dict:
+        """
+        ### Flat Mongo document shape (created_at as an isoformat string).
+        """
+        document = {
+            "uid": self.uid,
+            "created_at": self.created_at.isoformat() if isinstance(self.created_at, datetime) else self.created_at,
+            "headline": self.headline,
+            "detail": self.detail,
+            "content": self.content,
+            "is_fake": self.is_fake,
+            "style_or_source": self.style_or_source,
+            "origin_locale": self.origin_locale,
+            "headline_model_used": self.headline_model_used,
+            "content_model_used": self.content_model_used,
+            "translation_model_used": self.translation_model_used,
+        }
+        for locale in supported_locales:
+            texts = self.localized.get(locale) or LocalizedText()
+            document[f"localized_headline_{locale}"] = texts.headline
+            document[f"localized_detail_{locale}"] = texts.detail
+            document[f"localized_content_{locale}"] = texts.content
+        return document
+
+    @classmethod
+    def from_dict(cls, document: dict) -> "Article":
+        """
+        ### Builds an article from a flat document (as produced by to_dict). Unknown keys (e.g. `_id`) are ignored.
+        """
+        created_at = document.get("created_at")
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        localized = {
+            locale: LocalizedText(
+                document.get(f"localized_headline_{locale}", ""),
+                document.get(f"localized_detail_{locale}", ""),
+                document.get(f"localized_content_{locale}", ""),
+            )
+            for locale in supported_locales
+        }
+        return cls(
+            uid=document.get("uid"),
+            created_at=created_at,
+            headline=document.get("headline", ""),
+            detail=document.get("detail", ""),
+            content=document.get("content", ""),
+            is_fake=document.get("is_fake", False),
+            style_or_source=document.get("style_or_source", ""),
+            origin_locale=document.get("origin_locale", ""),
+            headline_model_used=document.get("headline_model_used", ""),
+            content_model_used=document.get("content_model_used", ""),
+            translation_model_used=document.get("translation_model_used", ""),
+            localized=localized,
+        )
+
+    def to_json(self) -> str:
+        return serialization.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, text) -> "Article":
+        return cls.from_dict(serialization.loads(text))
+
+    def __eq__(self, other):
+        return isinstance(other, Article) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Article(uid={self.uid!r}, origin_locale={self.origin_locale!r}, headline={self.headline!r})"
+
+
+def _localized_property(field: str, locale: str):
+    def getter(article: Article) -> str:
+        texts = article.localized.get(locale)
+        return getattr(texts, field) if texts is not None else ""
+
+    def setter(article: Article, value: str):
+        texts = article.localized.get(locale)
+        if texts is None:
+            texts = article.localized[locale] = LocalizedText()
+        setattr(texts, field, value)
+
+    return property(getter, setter, doc=f"Localized {field} in `{locale}`")
+
+
+# Flat localized_{field}_{locale} accessors, e.g. article.localized_headline_en
+_LOCALIZED_FIELD_NAMES = set()
+for _locale in supported_locales:
+    for _field in LOCALIZED_FIELDS:
+        setattr(Article, f"localized_{_field}_{_locale}", _localized_property(_field, _locale))
+        _LOCALIZED_FIELD_NAMES.add(f"localized_{_field}_{_locale}")
@@ -1,37 +1,282 @@
 import random
-import json
+import threading
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional
 
 from classes.article import Article
 from utils.locales import news_outlets_map, supported_locales
 from utils.misc import generate_unique_id
+from utils.headline_index import HeadlineIndex
+from utils.stage_checkpoints import StageCheckpoints
+from utils.database import PULLED_HEADLINES_JOURNAL_PATH, read_legacy_headlines
+from utils import journal
 from generation import content_generation
 from generation import headline_generation
 from generation import translations
+from generation.model_router import ModelRouter
+from generation.stage_scheduler import StageScheduler, StageSkippedError
 
-ARTICLES_FILE_PATH = "data/generated_articles.json"
+# Headlines pulled from the database by the legacy full pull (still read). Incremental pulls go to the
+# PULLED_HEADLINES_JOURNAL_PATH journal (see database.pull_generated_headlines_from_db).
 HEADLINE_FILE_PATH = "data/generated_headlines.json"
+# Append-only journals of freshly generated articles (pending push) and their headlines
+ARTICLES_JOURNAL_PATH = "data/generated_articles.jsonl"
+HEADLINE_JOURNAL_PATH = "data/generated_headlines.jsonl"
+
+
+def _step_of(stage_name: str) -> str:
+    '''
+    #### The step kind (headline, content, translation) a stage picks its model for.
+    '''
+    return "translation" if stage_name.startswith("translate_") else stage_name
+
+
+def _is_complete(result) -> bool:
+    '''
+    #### Whether a stage output has no empty text in it.
+    '''
+    if isinstance(result, str):
+        return result.strip() != ""
+    if isinstance(result, dict):
+        return all(_is_complete(value) for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return all(_is_complete(value) for value in result)
+    return result is not None
+
+
+def add_article_stages(
+    scheduler: StageScheduler,
+    key: str,
+    locale_choices: List[str],
+    make_fake_choices: List[bool],
+    headline_index: HeadlineIndex,
+    model: str,
+    limiters: Optional[Dict[str, threading.Semaphore]] = None,
+    priority: Optional[int] = None,
+    router: Optional[ModelRouter] = None,
+    locale: Optional[str] = None,
+    style: Optional[str] = None,
+    is_fake: Optional[bool] = None,
+    uid: Optional[str] = None,
+    checkpoints: Optional[StageCheckpoints] = None
+    ) -> str:
+    '''
+    ### Adds the stages of a single article pipeline to {scheduler}.
+    - headline: generates the headline and detail.
+    - content: generates the content (needs the headline).
+    - translate_headline: translates headline and detail into every other locale in one request
+        (needs the headline only, so it runs while the content is being generated).
+    - translate_content:{locale}: translates the content into one locale (needs the content).
+    - article: assembles the Article once everything else is done.
+    With a {router}, the model of each stage (headline, content, translation) is picked from the
+    router's pool for that stage when the stage is about to start. All translations of an article
+    use the same model.
+    With {checkpoints}, the output of every finished stage is saved under the article uid, and the stages
+    already saved for {uid} (by an earlier, interrupted run) are restored instead of being run again.
+    #### Args:
+        scheduler (StageScheduler): Scheduler to add the stages to
+        key (str): Prefix for the stage names, unique per article within the scheduler
+        locale_choices (list): List of locales to generate articles for
+        make_fake_choices (list): [True, False] choices for generating fake articles or not
+        headline_index (HeadlineIndex): Index of past headlines to avoid repeating
+        model (str): Model used for the steps the router has no pool for (every step without a router)
+        limiters (dict): Optional {model: Semaphore} limits on the concurrent model calls of each model
+        priority (int): Scheduling priority of the stages (lower runs first)
+        router (ModelRouter): Optional router picking the model of each step
+        locale (str): Origin locale to use (picked at random from {locale_choices} if not given)
+        style (str): News outlet style to emulate (picked at random from the locale's outlets if not given)
+        is_fake (bool): Whether to make a fake article (picked at random from {make_fake_choices} if not given)
+        uid (str): Unique id of the article (generated if not given)
+        checkpoints (StageCheckpoints): Optional store of finished stage outputs to save to and resume from
+    #### Returns:
+        Name of the stage whose result is the generated Article
+    '''
+    article_uid = uid if uid is not None else generate_unique_id()
+    saved = checkpoints.get(article_uid) if checkpoints is not None else {}
+    # A resumed article keeps the choices its saved stages were generated with
+    plan = saved.get("headline", {}).get("plan", {})
+    locale = plan.get("locale", locale)
+    style = plan.get("style", style)
+    is_fake = plan.get("is_fake", is_fake)
+    locale_to_use = locale if locale is not None else random.choice(locale_choices)
+    style_to_use = style if style is not None else random.choice(news_outlets_map[locale_to_use])
+    make_fake = is_fake if is_fake is not None else random.choice(make_fake_choices)
+    languages_to_translate_into = [lang for lang in locale_choices if lang != locale_to_use]
+    
+    def stage(name):
+        return f"{key}:{name}"
+    
+    # Models are picked once per article and step kind, as late as possible
+    chosen_models: Dict[str, str] = {}
+    chosen_models_lock = threading.Lock()
+    
+    def model_for(step):
+        with chosen_models_lock:
+            if step not in chosen_models:
+                chosen_models[step] = router.pick(step, default=model) if router is not None else model
+            return chosen_models[step]
+    
+    def limiter_for(name, step):
+        if not limiters or name in saved:
+            return None
+        return lambda: limiters.get(model_for(step))
+    
+    # Restored stages keep the models they were generated with
+    for name, record in saved.items():
+        if record.get("model") is not None:
+            chosen_models[_step_of(name)] = record["model"]
+    if "headline" in saved:
+        headline_index.add(saved["headline"]["result"][0])
+    
+    def checkpointed(name, step, fn):
+        if checkpoints is None:
+            return fn
+        def run(results):
+            if name in saved:
+                return saved[name]["result"]
+            result = fn(results)
+            # Outputs with empty fields (failed generations) are not worth keeping
+            if _is_complete(result):
+                checkpoints.save(
+                    article_uid,
+                    name,
+                    result,
+                    model=model_for(step),
+                    plan={"locale": locale_to_use, "style": style_to_use, "is_fake": make_fake} if name == "headline" else None
+                )
+            return result
+        return run
+    
+    def add_stage(name, fn, dependencies=()):
+        step = _step_of(name)
+        return scheduler.add(
+            stage(name),
+            checkpointed(name, step, fn),
+            list(dependencies),
+            limiter=limiter_for(name, step),
+            priority=priority
+        )
+    
+    # Generate article headline
+    headline_stage = add_stage(
+        "headline",
+        lambda results: headline_generation.generate_headline(
+            news_outlet=style_to_use,
+            locale=locale_to_use,
+            make_fake=make_fake,
+            headline_index=headline_index,
+            model=model_for("headline")
+        )
+    )
+    
+    # Generate article content
+    def generate_content(results):
+        headline, detail = results[headline_stage]
+        return content_generation.generate_content(
+            origin_locale=locale_to_use,
+            style=style_to_use,
+            headline=headline,
+            detail=detail,
+            is_fake=make_fake,
+            fake_detail=detail,
+            model=model_for("content")
+        )
+    content_stage = add_stage("content", generate_content, [headline_stage])
+    
+    # Translate headline and detail into the rest of the supported locales (one request)
+    def translate_headline(results):
+        headline, detail = results[headline_stage]
+        return translations.translate_all(
+            texts={"headline": headline, "detail": detail},
+            source_locale=locale_to_use,
+            target_locales=languages_to_translate_into,
+            news_outlet_style=style_to_use,
+            model=model_for("translation"),
+            mode="combined"
+        )
+    translation_stages = [add_stage("translate_headline", translate_headline, [headline_stage])]
+    
+    # Translate content into each of the rest of the supported locales
+    def make_translate_content(lang):
+        def translate_content(results):
+            return translations.translate_all(
+                texts={"content": results[content_stage]},
+                source_locale=locale_to_use,
+                target_locales=[lang],
+                news_outlet_style=style_to_use,
+                model=model_for("translation")
+            )
+        return translate_content
+    for lang in languages_to_translate_into:
+        translation_stages.append(add_stage(f"translate_content:{lang}", make_translate_content(lang), [content_stage]))
+    
+    # Assemble the article
+    def assemble(results):
+        headline, detail = results[headline_stage]
+        content = results[content_stage]
+        new_article: Article = Article()
+        new_article.uid = article_uid
+        new_article.created_at = datetime.now()
+        new_article.origin_locale = locale_to_use
+        new_article.style_or_source = style_to_use
+        new_article.is_fake = make_fake
+        new_article.detail = detail
+        new_article.headline = headline
+        new_article.headline_model_used = model_for("headline")
+        new_article.content = content
+        new_article.content_model_used = model_for("content")
+        new_article.translation_model_used = model_for("translation")
+        # First, fill out the current locale's translations
+        new_article.set_localized(locale_to_use, headline, detail, content)
+        # Now, the rest
+        translated = {lang: {} for lang in languages_to_translate_into}
+        for translation_stage in translation_stages:
+            for lang, fields in results[translation_stage].items():
+                translated[lang].update(fields)
+        for lang in languages_to_translate_into:
+            new_article.set_localized(
+                lang,
+                headline=translated[lang]["headline"],
+                detail=translated[lang]["detail"],
+                content=translated[lang]["content"]
+            )
+        return new_article
+    
+    return scheduler.add(stage("article"), assemble, [headline_stage, content_stage] + translation_stages, priority=priority)
 
 
 def generate_single_article(
     locale_choices: List[str],
     make_fake_choices: List[bool],
-    used_prompts_list: List[str],
-    model: str
+    headline_index: HeadlineIndex,
+    model: str,
+    translation_max_workers: int = translations.TRANSLATION_MAX_WORKERS,
+    router: Optional[ModelRouter] = None,
+    locale: Optional[str] = None,
+    style: Optional[str] = None,
+    is_fake: Optional[bool] = None,
+    uid: Optional[str] = None,
+    checkpoints: Optional[StageCheckpoints] = None
     ):
     '''
     ### Pipeline for generating a single article. Does not store the generated article.
     1. Picks a random locale to use from the passed in options as well as a corresponding
-        news outlet style to emulate.
+        news outlet style to emulate (unless they are given).
     2. Uses {model} to generate a headline and a detail in the locale.
-    3. Picks a random content model to use for generating the article.
+    3. Picks the content and translation models from the {router}'s pools (or uses {model} without one).
     4. Generated headline and content are then translated into the rest of the supported locales.
+    Steps run as a dependency graph (see add_article_stages): the headline and detail are translated
+    while the content is still being generated.
     
     #### Args:
         locale_choices (list): List of locales to generate articles for
         make_fake_choices (list): [True, False] choices for generating fake articles or not
-        used_prompts_list (list): List of used prompts to avoid repeating headlines
+        headline_index (HeadlineIndex): Index of past headlines to avoid repeating
+        model (str): Model used for every generation step the router has no pool for
+        translation_max_workers (int): Maximum number of concurrent stages (model calls)
+        router (ModelRouter): Optional router picking the content and translation models
+        locale, style, is_fake, uid: Optional fixed choices for the article (e.g. from a planned job)
+        checkpoints (StageCheckpoints): Optional store of finished stage outputs (resumes the stages saved for {uid})
     #### Returns:
         Article object
     '''
@@ -43,155 +288,95 @@ def generate_single_article(
         Fake: {make_fake_choices}
         '''
     )    
-    new_article: Article = Article()
-    
-    locale_to_use = random.choice(locale_choices)
-    style_to_use = random.choice(news_outlets_map[locale_to_use])
-    make_fake = random.choice(make_fake_choices)
-    
-    # Generate article headline
-    headline, detail = headline_generation.generate_headline(
-        news_outlet=style_to_use,
-        locale=locale_to_use,
-        make_fake=make_fake,
-        used_prompts_list=used_prompts_list,
-        model=model
+    scheduler = StageScheduler(max_workers=translation_max_workers)
+    article_stage = add_article_stages(
+        scheduler,
+        "article",
+        locale_choices,
+        make_fake_choices,
+        headline_index,
+        model,
+        router=router,
+        locale=locale,
+        style=style,
+        is_fake=is_fake,
+        uid=uid,
+        checkpoints=checkpoints
     )
-    new_article.uid = generate_unique_id()
-    new_article.created_at = datetime.now().isoformat()
-    new_article.origin_locale = locale_to_use
-    new_article.style_or_source = style_to_use
-    new_article.is_fake = make_fake
-    new_article.detail = detail
-    new_article.headline = headline
-    new_article.headline_model_used = model
+    scheduler.run()
     
-    # Generate article content
-    # -- TODO: Based on the content model choice, pick the appropriate model
-    content = content_generation.generate_content(
-        origin_locale=locale_to_use,
-        style=style_to_use,
-        headline=headline,
-        detail=detail,
-        is_fake=make_fake,
-        fake_detail=detail,
-        model=model
-    )
-    new_article.content = content
-    new_article.content_model_used = model
-    
-    # Translate headline and content into the rest of the supported locales
-    new_article.translation_model_used = model
-    # First, fill out the current locale's translations
-    if locale_to_use == "en":
-        new_article.localized_headline_en = headline
-        new_article.localized_detail_en = detail
-        new_article.localized_content_en = content
-    elif locale_to_use == "es":
-        new_article.localized_headline_es = headline
-        new_article.localized_detail_es = detail
-        new_article.localized_content_es = content
-    elif locale_to_use == "fr":
-        new_article.localized_headline_fr = headline
-        new_article.localized_detail_fr = detail
-        new_article.localized_content_fr = content
-    elif locale_to_use == "de":
-        new_article.localized_headline_de = headline
-        new_article.localized_detail_de = detail
-        new_article.localized_content_de = content
-    # Now, the rest  
-    languages_to_translate_into = [lang for lang in locale_choices if lang != locale_to_use]
-    for lang in languages_to_translate_into:
-        translated_headline = translations.translate(
-            text=headline, 
-            text_type="headline", 
-            source_locale=locale_to_use, 
-            target_locale=lang, 
-            news_outlet_style=style_to_use,
-            model=model
-        )
-        translated_detail = translations.translate(
-            text=detail, 
-            text_type="detail", 
-            source_locale=locale_to_use, 
-            target_locale=lang, 
-            news_outlet_style=style_to_use,
-            model=model
-        )
-        translated_content = translations.translate(
-            text=content, 
-            text_type="content", 
-            source_locale=locale_to_use, 
-            target_locale=lang, 
-            news_outlet_style=style_to_use,
-            model=model
-        )
-        if lang == "en":
-            new_article.localized_headline_en = translated_headline
-            new_article.localized_detail_en = translated_detail
-            new_article.localized_content_en = translated_content
-        elif lang == "es":
-            new_article.localized_headline_es = translated_headline
-            new_article.localized_detail_es = translated_detail
-            new_article.localized_content_es = translated_content
-        elif lang == "fr":
-            new_article.localized_headline_fr = translated_headline
-            new_article.localized_detail_fr = translated_detail
-            new_article.localized_content_fr = translated_content
-        elif lang == "de":
-            new_article.localized_headline_de = translated_headline
-            new_article.localized_detail_de = translated_detail
-            new_article.localized_content_de = translated_content
+    if article_stage in scheduler.errors:
+        # Raise the root cause rather than the skipped stages
+        raise next(error for error in scheduler.errors.values() if not isinstance(error, StageSkippedError))
     
     # Return the generated article object
-    return new_article
+    return scheduler.results[article_stage]
 
 
-def generate_and_store_single_article(model):
+def load_used_headlines() -> List[str]:
     '''
-    #### Generates a single article and stores it in the generated_articles.json file.
+    #### Reads previously generated headlines from the DB fetched headlines (legacy file and pull journal),
+    #### the headline journal and the pending articles journal.
+    #### Returns:
+        List of used headlines
     '''
-    
-    fetched_articles = []
     current_headlines:List[str] = []
-    articles_to_add:List[Article] = []
     
     # Read in previously generated headlines via DB fetched headlines
-    with open (HEADLINE_FILE_PATH, 'r') as read_file:
-        data = json.load(read_file)
-        fetched_headlines = data["headlines"]
-        print(f"Retrieved {len(fetched_headlines)} headlines from file.")
-        for i in range(len(fetched_headlines)):
-            current_headlines.append(fetched_headlines[i])
-        read_file.close()
+    fetched_headlines = read_legacy_headlines(HEADLINE_FILE_PATH)
+    print(f"Retrieved {len(fetched_headlines)} headlines from file.")
+    current_headlines.extend(fetched_headlines)
+    
+    pulled_headline_count = 0
+    for record in journal.read_records(PULLED_HEADLINES_JOURNAL_PATH):
+        current_headlines.append(record["headline"])
+        pulled_headline_count += 1
+    print(f"Retrieved {pulled_headline_count} headlines pulled from the database.")
+    
+    # Read in headlines generated since the last pull
+    journal_headline_count = 0
+    for record in journal.read_records(HEADLINE_JOURNAL_PATH):
+        current_headlines.append(record["headline"])
+        journal_headline_count += 1
+    print(f"Retrieved {journal_headline_count} headlines from journal.")
     
     # Read in previously generated headlines via fresh articles 
-    with open (ARTICLES_FILE_PATH, 'r') as read_file:
-        data = json.load(read_file)
-        fetched_articles = data["articles"]
-        print(f"Retrieved {len(fetched_articles)} articles from file.")
-        if(len(fetched_articles) > 0):
-            for i in range(len(fetched_articles)):
-                current_headlines.append(fetched_articles[i]["headline"])
-        read_file.close()
+    journal_article_count = 0
+    for record in journal.read_records(ARTICLES_JOURNAL_PATH):
+        current_headlines.append(record["headline"])
+        journal_article_count += 1
+    print(f"Retrieved {journal_article_count} articles from journal.")
+    
+    return current_headlines
+
+
+def store_headlines(articles_to_add: List[Article]):
+    '''
+    #### Appends the english headlines of new articles to the headline journal.
+    '''
+    journal.append_records(HEADLINE_JOURNAL_PATH, [{"headline": article.localized_headline_en} for article in articles_to_add])
+
+
+def store_articles(articles_to_add: List[Article]):
+    '''
+    #### Appends new articles (and their english headlines) to the article and headline journals.
+    '''
+    store_headlines(articles_to_add)
+    journal.append_records(ARTICLES_JOURNAL_PATH, [article.to_dict() for article in articles_to_add])
+
+
+def generate_and_store_single_article(model):
+    '''
+    #### Generates a single article and appends it to the generated articles journal.
+    '''
+    headline_index = HeadlineIndex(load_used_headlines())
         
     # Generate a single article
     new_article = generate_single_article(
         locale_choices=supported_locales,
         make_fake_choices=[True, False],
-        used_prompts_list=current_headlines,
+        headline_index=headline_index,
         model=model
     )
-    articles_to_add.append(new_article)
-    
-    # Update generated_headlines.json file with the new headline
-    headline_to_add = new_article.localized_headline_en
-    with open(HEADLINE_FILE_PATH, 'w') as write_file:
-        fetched_headlines.append(headline_to_add)
-        json.dump({"headlines": fetched_headlines}, write_file, indent=4)
-    
-    # Write out to file
-    with open(ARTICLES_FILE_PATH, 'w') as write_file:
-        for article in articles_to_add:
-            fetched_articles.append(article.to_dict())
-        json.dump({"articles": fetched_articles}, write_file, indent=4)    
+    
+    store_articles([new_article])
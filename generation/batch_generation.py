@@ -0,0 +1,180 @@
+'''
+This is the batch generation module. It runs many article pipelines at once on a bounded
+worker pool and writes all of the results to disk in a single pass at the end.
+'''
+
+import threading
+from typing import Dict, List, Optional, Union
+
+from classes.article import Article
+from utils.headline_index import HeadlineIndex
+from utils import metrics
+from utils.database import ArticleSink
+from utils.stage_checkpoints import StageCheckpoints
+from utils.locales import supported_locales
+from generation import article_generation
+from generation.model_router import ModelRouter
+from generation.stage_scheduler import StageScheduler, StageSkippedError
+
+# Default number of pipeline stages (model calls) running at the same time
+DEFAULT_CONCURRENCY = 8
+
+
+def _build_model_semaphores(models: List[str], concurrency: int, per_model_concurrency) -> Dict[str, threading.Semaphore]:
+    '''
+    #### Builds one semaphore per model, limiting how many of its pipelines can run at once.
+    '''
+    semaphores = {}
+    for model in models:
+        if isinstance(per_model_concurrency, dict):
+            limit = per_model_concurrency.get(model, concurrency)
+        elif per_model_concurrency is not None:
+            limit = per_model_concurrency
+        else:
+            limit = concurrency
+        semaphores[model] = threading.Semaphore(max(1, limit))
+    return semaphores
+
+
+def generate_articles(
+    n: int,
+    models: List[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    per_model_concurrency: Optional[Union[int, Dict[str, int]]] = None,
+    store: bool = True,
+    router: Optional[ModelRouter] = None,
+    jobs: Optional[List[dict]] = None,
+    sink: Optional[ArticleSink] = None,
+    checkpoints: Optional[StageCheckpoints] = None
+    ) -> List[Article]:
+    '''
+    ### Generates {n} articles for each of the given models (or the planned {jobs}) on a bounded worker pool.
+    - The stages of all the articles run on one StageScheduler, so a stage starts as soon as its inputs
+      are ready and the pool stays full. Earlier articles' stages go first.
+    - Previously used headlines are read once before the run starts.
+    - Headlines generated during the run go into a shared headline index so that they are not repeated.
+    - Results are collected in memory and appended to the journals once at the end (if {store} is set).
+      With a {sink}, every article is handed to the sink (written to the database in the background)
+      as soon as it is done, and only the headlines are appended to the journal.
+    - With a {router}, the content and translation models of each article are picked from the router's
+      pools, so work shifts away from models that slow down, fail or run out of rate limit budget.
+    - With {checkpoints}, every finished stage is checkpointed, and the articles an earlier run left
+      unfinished are resumed first (only their missing stages run, and at most MAX_RESUME_ATTEMPTS times
+      per article, see StageCheckpoints.resume). Articles appended to the journal here
+      are marked as finished. With a {sink}, the caller marks them once the sink is closed.
+    #### Args:
+        n (int): Number of articles to generate per model
+        models (list): Models to generate articles (headlines) with
+        concurrency (int): Total number of stages (model calls) running at the same time
+        per_model_concurrency (int | dict): Maximum number of stages running at the same time for
+            each model. Either a single limit for every model or a {model: limit} mapping.
+            Defaults to {concurrency}.
+        store (bool): Append the generated articles to the journals once the run is done
+        router (ModelRouter): Optional router picking the model of each stage
+        jobs (list): Planned jobs (see quota_planner) to run instead of {n} random articles per model.
+            Each job fixes the locale, outlet style, fake/real choice and headline model of its article.
+        sink (ArticleSink): Optional started write-behind sink to hand the articles to
+        checkpoints (StageCheckpoints): Optional store of finished stage outputs
+    #### Returns:
+        List of generated Article objects
+    '''
+    headline_index = HeadlineIndex(article_generation.load_used_headlines())
+    if jobs is None:
+        jobs = [{"model": model} for _ in range(n) for model in models]
+        description = f"{n} per model"
+    else:
+        models = sorted({job["model"] for job in jobs})
+        description = "planned"
+    if checkpoints is not None:
+        planned_uids = {job.get("uid") for job in jobs}
+        resumed_jobs = [job for job in checkpoints.resume() if job["uid"] not in planned_uids]
+        if resumed_jobs:
+            print(f"Resuming {len(resumed_jobs)} partially generated articles.")
+            jobs = resumed_jobs + jobs
+            models = sorted(set(models) | {job["model"] for job in resumed_jobs})
+    all_models = sorted(set(models) | set(router.models() if router is not None else []))
+    model_semaphores = _build_model_semaphores(all_models, concurrency, per_model_concurrency)
+    
+    total = len(jobs)
+    print(
+        f'''
+        ================================================================================
+        ->>> Generating {total} articles ({description}) with concurrency {concurrency}.
+        - Models: {models}
+        - Routed stages: {router.stage_pools if router is not None else {}}
+        ================================================================================
+        '''
+    )
+    
+    scheduler = StageScheduler(max_workers=concurrency)
+    generated_articles: List[Article] = []
+    generated_articles_lock = threading.Lock()
+    
+    def collect(article_stage):
+        def collect_article(results):
+            new_article = results[article_stage]
+            headline_index.add(new_article.localized_headline_en)
+            metrics.get_metrics().record_article()
+            if sink is not None:
+                sink.put(new_article)
+            with generated_articles_lock:
+                generated_articles.append(new_article)
+                print(f"->>> Generated article {len(generated_articles)} of {total}.")
+        return collect_article
+    
+    article_stages = {}
+    for i, job in enumerate(jobs):
+        article_stage = article_generation.add_article_stages(
+            scheduler,
+            key=str(i),
+            locale_choices=supported_locales,
+            make_fake_choices=[True, False],
+            headline_index=headline_index,
+            model=job["model"],
+            limiters=model_semaphores,
+            priority=i,
+            router=router,
+            locale=job.get("locale"),
+            style=job.get("style"),
+            is_fake=job.get("is_fake"),
+            uid=job.get("uid"),
+            checkpoints=checkpoints
+        )
+        scheduler.add(f"{i}:collect", collect(article_stage), [article_stage], priority=i)
+        article_stages[article_stage] = job["model"]
+    
+    scheduler.run()
+    
+    failed_count = 0
+    for article_stage, model in article_stages.items():
+        if article_stage not in scheduler.errors:
+            continue
+        failed_count += 1
+        root_errors = [
+            f"{name}: {type(error).__name__}: {error}"
+            for name, error in scheduler.errors.items()
+            if name.startswith(article_stage.rsplit(":", 1)[0] + ":") and not isinstance(error, StageSkippedError)
+        ]
+        print(f"Article pipeline failed for model {model}: {root_errors}")
+    
+    if store and len(generated_articles) > 0:
+        if sink is not None:
+            article_generation.store_headlines(generated_articles)
+        else:
+            article_generation.store_articles(generated_articles)
+            if checkpoints is not None:
+                checkpoints.finish([article.uid for article in generated_articles])
+    if checkpoints is not None:
+        checkpoints.compact()
+    
+    print(
+        f'''
+        -----------------------------------
+        ->>> Batch generation
+        - Generated: {len(generated_articles)} of {total}
+        - Failed: {failed_count}
+        -----------------------------------
+        '''
+    )
+    
+    return generated_articles
@@ -3,9 +3,18 @@ This is the article content generation module. It generates news headlines using
 '''
 
 from utils.locales import locale_codes_to_names_map
-import azure_client
+from generation import model_calls
 
-_client = azure_client.get_client()
+# Serve identical content prompts from the response cache
+CACHE_ENABLED = True
+
+# Stream the content and stop reading as soon as it is long enough, instead of waiting for
+# (and paying for) the whole completion. None disables the limit.
+STREAMING_ENABLED = True
+CONTENT_MAX_WORDS = 75
+CONTENT_MAX_SENTENCES = None
+# A word cut only ends on a sentence boundary that keeps at least this many words
+CONTENT_MIN_WORDS = 50
 
 
 # Generic prompts for content generation
@@ -31,13 +40,22 @@ def generate_content(origin_locale, style, headline, detail, is_fake, fake_detai
   - is_fake (bool): Flag indicating if the generated headline is fake
   - fake_detail (str): Detail about what makes the headline fake / real
   - model (str): The model to use for generating the content
+  With STREAMING_ENABLED, the content is streamed and cut off at CONTENT_MAX_WORDS words or
+  CONTENT_MAX_SENTENCES sentences (on a sentence boundary that keeps CONTENT_MIN_WORDS words, when possible).
   #### Returns:
   - Generated content: [str]
+  #### Raises:
+  - ModelCallError: If no usable content could be generated
   """
   print(f"Generating content with {model} model. For `{origin_locale}` in `{style}` style. Is fake: `{is_fake}`")
   locale_name = locale_codes_to_names_map[origin_locale]
-  response = _client.complete(
+  content = model_calls.call_model(
+    stage="content",
     model=model,
+    parse=model_calls.response_text,
+    use_cache=CACHE_ENABLED,
+    locale=origin_locale,
+    stream_cutoff=model_calls.StreamCutoff(CONTENT_MAX_WORDS, CONTENT_MAX_SENTENCES, CONTENT_MIN_WORDS) if STREAMING_ENABLED else None,
     messages=[
       # Primary prompt
       {"role": "system", "content": 
@@ -56,13 +74,7 @@ def generate_content(origin_locale, style, headline, detail, is_fake, fake_detai
       {"role": "user", "content": f"Write this article in {locale_name} language."},
     ]
   )
-  
-  content = ""
-  try:
-    content = response.choices[0].message.content
-  except:
-      print(f"Failed to extract content from the response: {response}")
-    
+
   print(f"""
   -----------------------------------
   ->>> Content generation
@@ -2,23 +2,110 @@
 This is the headline generation module. It generates news headlines using the specified model.
 '''
 
+import random
+
 from utils.locales import locale_codes_to_names_map
+from utils.headline_index import HeadlineIndex
+
+from generation import model_calls
+
+# Off by default: re-running the same headline prompt should give a new headline
+CACHE_ENABLED = False
+
+# Number of past headlines (most similar to the chosen topic) sent to the model to avoid
+USED_HEADLINES_SAMPLE_SIZE = 20
+# Number of extra attempts when every headline the model returned was rejected (near-duplicate or invalid)
+MAX_NEAR_DUPLICATE_RETRIES = 2
+
+# How generate_headline asks for headlines:
+# - "text": one headline and detail per request, on separate lines
+# - "structured": several JSON candidates per request, checked locally (first valid one wins)
+HEADLINE_MODE = "structured"
+HEADLINE_MODES = ["text", "structured"]
+# Number of candidates asked for in a structured request
+HEADLINE_CANDIDATES = 4
+# Accepted headline length (words)
+HEADLINE_MIN_WORDS = 8
+HEADLINE_MAX_WORDS = 14
+# Quote characters a headline must not contain
+HEADLINE_QUOTE_CHARACTERS = "\"“”„‟«»"
+
+
+def parse_headline_response(response):
+    """
+    ### Splits a headline response into (headline, detail).
+    Blank lines are ignored. Raises ModelCallError if the headline or the detail is missing.
+    """
+    lines = [line.strip() for line in model_calls.response_text(response).split("\n") if line.strip() != ""]
+    if len(lines) < 2:
+        raise model_calls.ModelCallError(f"Expected a headline and a detail line, got: {lines}")
+    return lines[0], lines[1]
+
+
+def parse_headline_candidates(response):
+    """
+    ### Reads the (headline, detail) candidates of a structured headline response.
+    Raises ModelCallError if the response has no candidates.
+    """
+    parsed = model_calls.parse_json_object(model_calls.response_text(response))
+    candidates = []
+    for candidate in parsed.get("candidates") or []:
+        if isinstance(candidate, dict) and isinstance(candidate.get("headline"), str) and isinstance(candidate.get("detail"), str):
+            candidates.append((candidate["headline"].strip(), candidate["detail"].strip()))
+    if len(candidates) == 0:
+        raise model_calls.ModelCallError(f"Expected a list of headline candidates, got: {parsed}")
+    return candidates
+
+
+def check_headline(headline, detail):
+    """
+    ### Local checks of a structured headline candidate.
+    #### Returns:
+    - str: Why the candidate is rejected, or None if it is valid
+    """
+    word_count = len(headline.split())
+    if word_count < HEADLINE_MIN_WORDS or word_count > HEADLINE_MAX_WORDS:
+        return f"{word_count} words"
+    if any(character in headline for character in HEADLINE_QUOTE_CHARACTERS):
+        return "contains quotes"
+    if detail == "":
+        return "empty detail"
+    return None
 
-import azure_client
 
-_client = azure_client.get_client()
+def sample_used_headlines(headline_index: HeadlineIndex, topic: str, k: int = USED_HEADLINES_SAMPLE_SIZE):
+    """
+    ### Picks the past headlines to show the model: the ones most similar to {topic}, topped up with the most recent ones.
+    """
+    sample = headline_index.most_similar(topic, k)
+    for headline in reversed(headline_index.recent(k)):
+        if len(sample) >= k:
+            break
+        if headline not in sample:
+            sample.append(headline)
+    return sample
+
 
-def generate_headline(news_outlet, locale, make_fake, used_prompts_list, model):
+def generate_headline(news_outlet, locale, make_fake, headline_index: HeadlineIndex, model, mode=None):
     """ 
     ### Generate a news headline using the specified model.
+    - A topic is picked at random and only a small sample of related past headlines is sent to the model,
+      so the prompt size doesn't grow with the number of generated headlines.
+    - In "structured" mode, a single request returns several candidates. The first one that passes the local
+      checks (see check_headline) and isn't a near-duplicate is used.
+    - Near-duplicates of past headlines are rejected. The model is only called again if every candidate was
+      rejected. The accepted headline is added to the index.
     #### Args:
     - news_outlet (str): The news outlet to emulate
     - locale (str): The locale to write the headline in
     - make_fake (bool): Flag indicating if the headline should be fake
-    - used_prompts_list (list): List of prompts to avoid repeating
+    - headline_index (HeadlineIndex): Index of past headlines to avoid repeating
     - model (str): The model to use for generating the headline
+    - mode (str): One of HEADLINE_MODES (defaults to HEADLINE_MODE)
     #### Returns:
     - headline, detail
+    #### Raises:
+    - ModelCallError: If no usable (non-duplicate) headline could be generated
     """
 
     print(f"Generating headline with {model} model. For `{news_outlet}` in `{locale}` language. Is fake: `{make_fake}`")
@@ -67,58 +154,56 @@ def generate_headline(news_outlet, locale, make_fake, used_prompts_list, model):
         "adult content",
     ]
     
+    mode = mode or HEADLINE_MODE
+    if mode not in HEADLINE_MODES:
+        raise ValueError(f"Unknown headline mode `{mode}`. Expected one of {HEADLINE_MODES}.")
+    structured = mode == "structured"
+
     locale_name = locale_codes_to_names_map[locale]
+    topic = random.choice(topics_to_use)
+    used_prompts_list = sample_used_headlines(headline_index, topic)
 
-    
+    accepted = None
+    for attempt in range(MAX_NEAR_DUPLICATE_RETRIES + 1):
+        messages = build_headline_messages(
+            additional_prompt, topic, topics_to_avoid, locale_name, news_outlet, used_prompts_list,
+            candidates=HEADLINE_CANDIDATES if structured else None
+        )
+        response = model_calls.call_model(
+            stage="headline",
+            model=model,
+            parse=parse_headline_candidates if structured else parse_headline_response,
+            use_cache=CACHE_ENABLED,
+            locale=locale,
+            messages=messages
+        )
+        candidates = response if structured else [response]
 
+        rejections = []
+        for headline, detail in candidates:
+            problem = check_headline(headline, detail) if structured else None
+            if problem is None:
+                duplicate_of = headline_index.find_near_duplicate(headline)
+                if duplicate_of is None:
+                    if headline_index.add(headline):
+                        accepted = (headline, detail)
+                        break
+                    # Taken in the meantime (by another thread, or another worker with a shared index)
+                    duplicate_of = headline
+                used_prompts_list.append(duplicate_of)
+                problem = f"near-duplicate of `{duplicate_of}`"
+            rejections.append(f"`{headline}` ({problem})")
+        if accepted is not None:
+            break
+        print(f"Rejected every headline candidate: {rejections}. (attempt {attempt + 1} of {MAX_NEAR_DUPLICATE_RETRIES + 1})")
+    else:
+        raise model_calls.ModelCallError(f"[headline] {model} kept generating invalid or near-duplicate headlines.")
+    headline, detail = accepted
 
-    response = _client.complete(
-        model=model,
-        messages=[
-            # Primary prompt
-            {"role": "system", "content": 
-                '''
-                    You are a journalist writing a news article's headline.
-                    Just the headline, and a line of detail used to generate it is needed.
-                    The headline should be 8-14 words long.
-                    Don't include double quotes in the headline.
-                    Write the headline one 1 line and the detail on the next line.
-                    Don't repeat the headline in the detail.
-                    Don't say "headline" or "detail" in the response.
-                    Avoid leaving trailing white spaces.
-                    Make the detail 1 short sentence. It should be a nuanced detail.
-                    Make the topics relevant to the news outlet provided.
-                    Pick topics that are usually attention-grabbing and try to avoid mundane ones.
-                '''
-            },
-            # Topics to use
-            {"role": "system", "content": f"Topics to use: {topics_to_use}"},
-            # Topics to avoid
-            {"role": "system", "content": f"Topics to avoid: {topics_to_avoid}"},
-            # Fake or real news conditional prompt
-            {"role": "system", "content": additional_prompt},
-            # News outlet to emulate
-            {"role": "system", "content": f"Emulate the style of the {locale_name} news outlet: {news_outlet}."},
-            # Locale to write in
-            {"role": "system", "content": f"Write the article in {locale_name} language. Add in some nuanced details."},
-            # Avoid repeating prompts
-            {"role": "system", "content": f"Don't repeat from these prompts: {used_prompts_list}"},
-            # Additional prompt
-            {"role": "system", "content": 
-                '''
-                Avoid using slang or idiomatic expressions.
-                Make sure the headline and detail and are all included in the response (on separate lines).
-                '''
-            }            
-        ]
-    )
-    
-    content = response.choices[0].message.content
-    headline = content.split("\n")[0]
-    detail = content.split("\n")[1]        
     print(f"""
     -----------------------------------
     ->>> Headline generation
+    - Topic: {topic}
     - Headline: {headline}
     - Detail: {detail}
     -----------------------------------
@@ -126,5 +211,60 @@ def generate_headline(news_outlet, locale, make_fake, used_prompts_list, model):
     )
 
     return headline, detail
-     
-    
\ No newline at end of file
+
+
+def build_headline_messages(additional_prompt, topic, topics_to_avoid, locale_name, news_outlet, used_prompts_list, candidates=None):
+    """
+    ### Builds the chat messages for a headline generation call.
+    With {candidates}, asks for that many headline candidates as JSON instead of a single headline in plain text.
+    """
+    if candidates is None:
+        scope = "Just the headline, and a line of detail used to generate it is needed."
+        layout = "Write the headline one 1 line and the detail on the next line."
+        wording = 'Don\'t say "headline" or "detail" in the response.'
+        completeness = "Make sure the headline and detail and are all included in the response (on separate lines)."
+    else:
+        scope = f"{candidates} alternative headlines are needed, each with a line of detail used to generate it."
+        layout = f"Write {candidates} different headlines, each with its own detail."
+        wording = 'Don\'t say "headline" or "detail" in the headlines or details.'
+        completeness = (
+            'Respond with JSON only, in exactly this shape: {"candidates": [{"headline": "...", "detail": "..."}]}'
+            f" with {candidates} candidates."
+        )
+    return [
+        # Primary prompt
+        {"role": "system", "content": 
+            f'''
+                You are a journalist writing a news article's headline.
+                {scope}
+                The headline should be {HEADLINE_MIN_WORDS}-{HEADLINE_MAX_WORDS} words long.
+                Don't include double quotes in the headline.
+                {layout}
+                Don't repeat the headline in the detail.
+                {wording}
+                Avoid leaving trailing white spaces.
+                Make the detail 1 short sentence. It should be a nuanced detail.
+                Make the topics relevant to the news outlet provided.
+                Pick topics that are usually attention-grabbing and try to avoid mundane ones.
+            '''
+        },
+        # Topic to use
+        {"role": "system", "content": f"Topic to use: {topic}"},
+        # Topics to avoid
+        {"role": "system", "content": f"Topics to avoid: {topics_to_avoid}"},
+        # Fake or real news conditional prompt
+        {"role": "system", "content": additional_prompt},
+        # News outlet to emulate
+        {"role": "system", "content": f"Emulate the style of the {locale_name} news outlet: {news_outlet}."},
+        # Locale to write in
+        {"role": "system", "content": f"Write the article in {locale_name} language. Add in some nuanced details."},
+        # Avoid repeating prompts
+        {"role": "system", "content": f"Don't repeat from these prompts: {used_prompts_list}"},
+        # Additional prompt
+        {"role": "system", "content": 
+            f'''
+            Avoid using slang or idiomatic expressions.
+            {completeness}
+            '''
+        }            
+    ]
@@ -0,0 +1,416 @@
+'''
+This is the model call execution module. Every generation module runs its model calls through
+`call_model`, which adds per-call timeouts, jittered exponential retries on transient errors and
+a circuit breaker per model. `call_model_async` is the same for the async client (without streaming).
+'''
+
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+import azure_client
+from utils import response_cache
+from utils import metrics
+
+# Per-call timeouts (seconds)
+CONNECTION_TIMEOUT_SECONDS = 10
+READ_TIMEOUT_SECONDS = 60
+
+# Retries
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY_SECONDS = 1.0
+RETRY_MAX_DELAY_SECONDS = 30.0
+# 429 isn't in here: azure_client.complete already retries throttled calls, honouring Retry-After
+TRANSIENT_STATUS_CODES = {408, 409, 500, 502, 503, 504}
+
+# Circuit breaker
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT_SECONDS = 60.0
+
+_CACHE_MISS = object()
+
+
+class ModelCallError(Exception):
+    '''
+    Raised when a model call doesn't produce a usable response (e.g. empty or malformed output),
+    or when it still fails after all of its retries.
+    '''
+
+
+class CircuitOpenError(ModelCallError):
+    '''
+    Raised without calling the model while its circuit breaker is open.
+    '''
+
+
+class CircuitBreaker:
+    """
+    ### Circuit breaker for a single model.
+    - closed: calls go through. {failure_threshold} consecutive failures open the circuit.
+    - open: calls fail fast until {reset_timeout} seconds have passed.
+    - half-open: a single trial call goes through. Success closes the circuit, failure re-opens it.
+    """
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                self._trial_in_flight = False
+            if self.state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half-open" or self._consecutive_failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model: str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        if model not in _circuit_breakers:
+            _circuit_breakers[model] = CircuitBreaker()
+        return _circuit_breakers[model]
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    ### Whether a failed call is worth retrying.
+    Timeouts, connection errors, server errors and unusable responses are transient. A 429 reaching
+    this point already ran out of the rate limit retries of azure_client.complete, so it isn't retried again.
+    """
+    if isinstance(error, CircuitOpenError) or azure_client.is_rate_limited_error(error):
+        return False
+    if isinstance(error, (ModelCallError, ServiceRequestError, ServiceResponseError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, HttpResponseError):
+        return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+    return False
+
+
+def retry_delay_seconds(attempt: int) -> float:
+    """
+    ### Exponential backoff with full jitter for the given (0-based) attempt.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+# Called with (model, stage, latency_seconds, outcome) after every model call attempt (see model_router)
+_call_observers: List[Callable] = []
+
+
+def add_call_observer(observer: Callable):
+    _call_observers.append(observer)
+
+
+def remove_call_observer(observer: Callable):
+    if observer in _call_observers:
+        _call_observers.remove(observer)
+
+
+def outcome_for_error(error: Exception) -> str:
+    if azure_client.is_rate_limited_error(error):
+        return "rate_limited"
+    if isinstance(error, (ServiceRequestError, ServiceResponseError, TimeoutError)):
+        return "timeout"
+    if isinstance(error, ModelCallError):
+        return "invalid_response"
+    return "error"
+
+
+def record_call_metric(stage: str, model: str, locale: str, response, latency_seconds: float, outcome: str):
+    """
+    ### Records a model call, with the token usage of its response (if there is one), and notifies the call observers.
+    """
+    usage = getattr(response, "usage", None)
+    metrics.get_metrics().record_call(
+        model=model,
+        stage=stage,
+        locale=locale,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        latency_seconds=latency_seconds,
+        outcome=outcome,
+        time_to_first_token_seconds=getattr(response, "time_to_first_token_seconds", None),
+    )
+    for observer in list(_call_observers):
+        observer(model, stage, latency_seconds, outcome)
+
+
+# Complete sentences: text up to sentence-ending punctuation (and closing quotes) followed by whitespace
+_sentence_end_pattern = re.compile(r"[.!?…][\"'”»)]*(?=\s)")
+
+
+class StreamCutoff:
+    """
+    ### Decides when to stop reading a streamed response.
+    Called with the text streamed so far. Once the text reaches {max_sentences} complete sentences or
+    {max_words} words, returns the text to keep. A word cut ends on the last complete sentence within the
+    limit that keeps at least {min_words} words, or else right after the {max_words}th word (whitespace and
+    line breaks are kept as streamed). Returns None to keep reading.
+    """
+    def __init__(self, max_words: Optional[int] = None, max_sentences: Optional[int] = None, min_words: int = 0):
+        self.max_words = max_words
+        self.max_sentences = max_sentences
+        self.min_words = min_words
+
+    def __call__(self, text: str) -> Optional[str]:
+        sentence_ends = [match.end() for match in _sentence_end_pattern.finditer(text)]
+        if self.max_sentences is not None and len(sentence_ends) >= self.max_sentences:
+            return text[:sentence_ends[self.max_sentences - 1]]
+        if self.max_words is not None:
+            word_ends = [match.end() for match in re.finditer(r"\S+", text)]
+            # The last word may still be streaming, so only cut once the limit is passed
+            if len(word_ends) > self.max_words:
+                word_limit_end = word_ends[self.max_words - 1]
+                min_words_end = word_ends[min(self.min_words, self.max_words) - 1] if self.min_words > 0 else 0
+                within_limit = [end for end in sentence_ends if min_words_end <= end <= word_limit_end]
+                if within_limit:
+                    return text[:within_limit[-1]]
+                return text[:word_limit_end]
+        return None
+
+    def __repr__(self):
+        return f"StreamCutoff(max_words={self.max_words}, max_sentences={self.max_sentences}, min_words={self.min_words})"
+
+
+def read_stream(stream, started_at: float, cutoff: Optional[StreamCutoff], messages):
+    """
+    ### Reads a streamed completion until it ends or {cutoff} says it is long enough, then closes the stream.
+    #### Returns:
+    - A response shaped like a non-streamed one (choices[0].message.content and usage), plus
+      `time_to_first_token_seconds` and `stopped_early`. Usage is estimated if the stream was cut off.
+    """
+    text = ""
+    usage = None
+    time_to_first_token_seconds = None
+    stopped_early = False
+    try:
+        for update in stream:
+            if getattr(update, "usage", None) is not None:
+                usage = update.usage
+            for choice in getattr(update, "choices", None) or []:
+                delta = getattr(getattr(choice, "delta", None), "content", None)
+                if delta:
+                    if time_to_first_token_seconds is None:
+                        time_to_first_token_seconds = time.perf_counter() - started_at
+                    text += delta
+            if cutoff is not None:
+                cut_text = cutoff(text)
+                if cut_text is not None:
+                    text = cut_text
+                    stopped_early = True
+                    break
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    if usage is None or stopped_early:
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+        completion_tokens = max(1, len(text) // 4)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=text))],
+        usage=usage,
+        time_to_first_token_seconds=time_to_first_token_seconds,
+        stopped_early=stopped_early,
+    )
+
+
+def call_model(
+    stage: str,
+    model: str,
+    messages,
+    parse: Callable,
+    max_attempts: int = MAX_ATTEMPTS,
+    use_cache: bool = False,
+    locale: str = "",
+    stream_cutoff: Optional[StreamCutoff] = None,
+    **params
+    ):
+    """
+    ### Runs a single model call (and the parsing of its response) with timeouts, retries and a circuit breaker.
+    Only this call is retried on failure, never the rest of the pipeline.
+    #### Args:
+    - stage (str): Pipeline stage the call belongs to (headline, content, translation)
+    - model (str): The model to call
+    - messages (list): Chat messages
+    - parse (callable): Turns the response into the call's result. Raises ModelCallError for unusable responses.
+    - max_attempts (int): Maximum number of attempts for transient errors
+    - use_cache (bool): Serve identical calls from the response cache (the parsed result is cached,
+        so it must be JSON serializable)
+    - locale (str): Locale the call works on, recorded in the call metrics
+    - stream_cutoff (StreamCutoff): Stream the response and stop reading it once the cutoff is reached.
+        {parse} gets the text read so far, and the time to first token is recorded.
+    - params: Any other `complete` parameters
+    #### Returns:
+    - Whatever {parse} returns
+    """
+    if stream_cutoff is not None:
+        params["stream"] = True
+    cache_key = None
+    if use_cache:
+        key_params = dict(params, stream_cutoff=repr(stream_cutoff)) if stream_cutoff is not None else params
+        cache_key = response_cache.make_key(stage, model, messages, key_params)
+        cached = response_cache.get_response_cache().get(cache_key, _CACHE_MISS)
+        if cached is not _CACHE_MISS:
+            metrics.get_metrics().record_call(model=model, stage=stage, locale=locale, outcome="cache_hit")
+            return cached
+
+    breaker = get_circuit_breaker(model)
+    params.setdefault("connection_timeout", CONNECTION_TIMEOUT_SECONDS)
+    params.setdefault("read_timeout", READ_TIMEOUT_SECONDS)
+
+    last_error = None
+    for attempt in range(max_attempts):
+        if not breaker.allow():
+            metrics.get_metrics().record_call(model=model, stage=stage, locale=locale, outcome="circuit_open")
+            raise CircuitOpenError(f"[{stage}] Circuit for {model} is open. Skipping call.")
+        started_at = time.perf_counter()
+        response = None
+        try:
+            response = azure_client.complete(model=model, messages=messages, **params)
+            if stream_cutoff is not None:
+                stream, response = response, None
+                response = read_stream(stream, started_at, stream_cutoff, messages)
+                azure_client.get_rate_limiter(model).record_usage(
+                    azure_client.estimate_tokens(messages, params.get("max_tokens")),
+                    response.usage.total_tokens
+                )
+            result = parse(response)
+        except Exception as error:
+            record_call_metric(stage, model, locale, response, time.perf_counter() - started_at, outcome_for_error(error))
+            breaker.record_failure()
+            if not is_transient_error(error):
+                raise
+            last_error = error
+            if attempt + 1 < max_attempts:
+                delay = retry_delay_seconds(attempt)
+                print(f"[{stage}] {model} call failed ({type(error).__name__}: {error}). Retrying in {delay:.1f}s ({attempt + 1}/{max_attempts}).")
+                time.sleep(delay)
+            continue
+        record_call_metric(stage, model, locale, response, time.perf_counter() - started_at, "success")
+        breaker.record_success()
+        if cache_key is not None:
+            response_cache.get_response_cache().set(cache_key, result)
+        return result
+
+    raise ModelCallError(f"[{stage}] {model} call failed after {max_attempts} attempts: {last_error}") from last_error
+
+
+async def call_model_async(
+    stage: str,
+    model: str,
+    messages,
+    parse: Callable,
+    max_attempts: int = MAX_ATTEMPTS,
+    use_cache: bool = False,
+    locale: str = "",
+    **params
+    ):
+    """
+    ### Async variant of `call_model`, running the call through `azure_client.complete_async`.
+    Same timeouts, retries, circuit breaker, response cache, metrics and call observers. Streaming isn't supported.
+    """
+    cache_key = None
+    if use_cache:
+        cache_key = response_cache.make_key(stage, model, messages, params)
+        cached = response_cache.get_response_cache().get(cache_key, _CACHE_MISS)
+        if cached is not _CACHE_MISS:
+            metrics.get_metrics().record_call(model=model, stage=stage, locale=locale, outcome="cache_hit")
+            return cached
+
+    breaker = get_circuit_breaker(model)
+    params.setdefault("connection_timeout", CONNECTION_TIMEOUT_SECONDS)
+    params.setdefault("read_timeout", READ_TIMEOUT_SECONDS)
+
+    last_error = None
+    for attempt in range(max_attempts):
+        if not breaker.allow():
+            metrics.get_metrics().record_call(model=model, stage=stage, locale=locale, outcome="circuit_open")
+            raise CircuitOpenError(f"[{stage}] Circuit for {model} is open. Skipping call.")
+        started_at = time.perf_counter()
+        response = None
+        try:
+            response = await azure_client.complete_async(model=model, messages=messages, **params)
+            result = parse(response)
+        except Exception as error:
+            record_call_metric(stage, model, locale, response, time.perf_counter() - started_at, outcome_for_error(error))
+            breaker.record_failure()
+            if not is_transient_error(error):
+                raise
+            last_error = error
+            if attempt + 1 < max_attempts:
+                delay = retry_delay_seconds(attempt)
+                print(f"[{stage}] {model} call failed ({type(error).__name__}: {error}). Retrying in {delay:.1f}s ({attempt + 1}/{max_attempts}).")
+                await asyncio.sleep(delay)
+            continue
+        record_call_metric(stage, model, locale, response, time.perf_counter() - started_at, "success")
+        breaker.record_success()
+        if cache_key is not None:
+            response_cache.get_response_cache().set(cache_key, result)
+        return result
+
+    raise ModelCallError(f"[{stage}] {model} call failed after {max_attempts} attempts: {last_error}") from last_error
+
+
+def response_text(response) -> str:
+    """
+    ### Extracts the (stripped) message text from a response. Raises ModelCallError if it's missing or empty.
+    """
+    try:
+        content = response.choices[0].message.content
+    except (AttributeError, IndexError, TypeError):
+        raise ModelCallError(f"Failed to extract content from the response: {response}")
+    if content is None or content.strip() == "":
+        raise ModelCallError(f"Model returned empty content: {response}")
+    return content.strip()
+
+
+def parse_json_object(text: str) -> dict:
+    """
+    ### Parses the JSON object in a model's text output (ignoring code fences and any text around it).
+    Raises ModelCallError if there is no valid JSON object.
+    """
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end < start:
+        raise ModelCallError(f"No JSON object found in the response: {text}")
+    try:
+        parsed = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as error:
+        raise ModelCallError(f"Invalid JSON in the response ({error}): {text}")
+    if not isinstance(parsed, dict):
+        raise ModelCallError(f"Expected a JSON object in the response: {text}")
+    return parsed
@@ -0,0 +1,125 @@
+'''
+This is the model router module. It assigns each pipeline stage (content, translation, ...) to one model
+out of a weighted pool, preferring the models that are currently fastest, healthiest and furthest from
+their rate limits.
+'''
+
+import random
+import threading
+from typing import Dict, List, Optional, Union
+
+import azure_client
+from generation import model_calls
+
+# Smoothing factor of the latency and error rate moving averages
+EWMA_ALPHA = 0.2
+# Latency assumed before any call finished (seconds). Once some models were observed, unobserved models
+# are assumed to be as fast as the fastest of them, so that they get tried.
+DEFAULT_LATENCY_SECONDS = 5.0
+# Score multiplier of a model whose rate limit budget is exhausted (it stays pickable as a last resort)
+NO_HEADROOM_PENALTY = 0.05
+
+
+class ModelHealth:
+    '''
+    ### Live statistics of a single model.
+    #### Attributes:
+    - latency_seconds: float - Moving average of successful call latency
+    - error_rate: float - Moving average of failed calls (0 - 1)
+    - calls: int - Number of observed calls
+    '''
+    __slots__ = ("latency_seconds", "error_rate", "calls")
+
+    def __init__(self):
+        self.latency_seconds = DEFAULT_LATENCY_SECONDS
+        self.error_rate = 0.0
+        self.calls = 0
+
+
+class ModelRouter:
+    """
+    ### Routes stages to models out of weighted pools.
+    #### Args:
+    - stage_pools (dict): {stage: [model, ...]} or {stage: {model: weight}}. Stages without a pool keep
+        the model they were given.
+    - seed (int): Optional seed for the weighted choice
+    """
+    def __init__(self, stage_pools: Dict[str, Union[List[str], Dict[str, float]]], seed: Optional[int] = None):
+        self.stage_pools: Dict[str, Dict[str, float]] = {}
+        for stage, pool in stage_pools.items():
+            self.stage_pools[stage] = dict(pool) if isinstance(pool, dict) else {model: 1.0 for model in pool}
+        self.health: Dict[str, ModelHealth] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        model_calls.add_call_observer(self.observe)
+
+    def observe(self, model: str, stage: str, latency_seconds: float, outcome: str):
+        """
+        ### Updates a model's statistics with the outcome of one of its calls (registered with model_calls).
+        """
+        if outcome in ("cache_hit", "circuit_open"):
+            return
+        with self._lock:
+            health = self.health.setdefault(model, ModelHealth())
+            failed = outcome != "success"
+            health.error_rate = (1 - EWMA_ALPHA) * health.error_rate + EWMA_ALPHA * (1.0 if failed else 0.0)
+            if not failed:
+                if health.calls == 0:
+                    health.latency_seconds = latency_seconds
+                else:
+                    health.latency_seconds = (1 - EWMA_ALPHA) * health.latency_seconds + EWMA_ALPHA * latency_seconds
+            health.calls += 1
+
+    def score(self, model: str, weight: float) -> float:
+        """
+        ### Higher is better: weight x success rate x rate limit headroom / latency.
+        """
+        with self._lock:
+            health = self.health.get(model)
+            if health is None or health.calls == 0:
+                observed = [other.latency_seconds for other in self.health.values() if other.calls > 0]
+                latency_seconds = min(observed, default=DEFAULT_LATENCY_SECONDS)
+                success_rate = 1.0
+            else:
+                latency_seconds = health.latency_seconds
+                success_rate = 1.0 - health.error_rate
+        latency_seconds = max(latency_seconds, 0.01)
+        success_rate = max(success_rate, 0.01)
+        headroom = azure_client.get_rate_limiter(model).headroom()
+        return weight * success_rate * max(headroom, NO_HEADROOM_PENALTY) / latency_seconds
+
+    def has_pool(self, stage: str) -> bool:
+        return stage in self.stage_pools
+
+    def pick(self, stage: str, default: Optional[str] = None) -> str:
+        """
+        ### Picks a model for {stage}, at random in proportion to each eligible model's score.
+        Models whose circuit breaker is open are only picked if every model of the pool is open.
+        """
+        pool = self.stage_pools.get(stage)
+        if not pool:
+            if default is None:
+                raise ValueError(f"No model pool for stage `{stage}`.")
+            return default
+        eligible = {model: weight for model, weight in pool.items() if model_calls.get_circuit_breaker(model).state != "open"}
+        candidates = eligible or pool
+        scores = {model: self.score(model, weight) for model, weight in candidates.items()}
+        total = sum(scores.values())
+        with self._lock:
+            if total <= 0:
+                return self._random.choice(list(candidates))
+            threshold = self._random.uniform(0, total)
+        for model, model_score in scores.items():
+            threshold -= model_score
+            if threshold <= 0:
+                return model
+        return model
+
+    def models(self) -> List[str]:
+        return sorted({model for pool in self.stage_pools.values() for model in pool})
+
+    def close(self):
+        """
+        ### Stops observing model calls.
+        """
+        model_calls.remove_call_observer(self.observe)
@@ -0,0 +1,232 @@
+'''
+This is the queue worker module. It runs the article jobs of a generation plan from the shared MongoDB
+job queue (see utils/job_queue), so any number of processes, on any number of machines, can work through
+the same plan without duplicate or lost jobs. Articles are written straight to the database.
+
+Usage (e.g. against a local mongod, with JUDGE_GPT_MONGODB_CONNECTION_STRING=mongodb://localhost:27017):
+    python -m generation.queue_worker enqueue --mode testing --plan-id run-1 --per-cell 2 --models Phi-3.5-mini-instruct
+    python -m generation.queue_worker work --mode testing --concurrency 4
+    python -m generation.queue_worker status --mode testing --plan-id run-1
+'''
+
+import argparse
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from utils import database
+from utils import job_queue
+from utils import metrics
+from utils.stage_checkpoints import StageCheckpoints
+from utils.locales import news_outlets_map, supported_locales
+from generation import article_generation
+from generation import quota_planner
+from generation.model_router import ModelRouter
+
+# Number of jobs a worker process runs at the same time
+DEFAULT_WORKER_CONCURRENCY = 4
+
+
+def plan_random_jobs(n: int, models: List[str], seed: Optional[int] = None) -> List[dict]:
+    '''
+    #### Plans {n} jobs per model with a random locale, outlet style and fake/real choice each.
+    '''
+    rng = random.Random(seed)
+    jobs = []
+    for _ in range(n):
+        for model in models:
+            locale = rng.choice(supported_locales)
+            jobs.append(job_queue.make_job(locale, rng.choice(news_outlets_map[locale]), rng.choice([True, False]), model))
+    return jobs
+
+
+def load_headlines_from_db(mode: str) -> List[str]:
+    '''
+    #### Reads the english headlines of the articles already in the database.
+    '''
+    cursor = database.get_collection(mode).find({}, {"localized_headline_en": 1}).batch_size(database.HEADLINE_SYNC_BATCH_SIZE)
+    return [document["localized_headline_en"] for document in cursor if document.get("localized_headline_en")]
+
+
+def run_job(
+    mode: str,
+    job: dict,
+    headline_index: job_queue.SharedHeadlineIndex,
+    router: Optional[ModelRouter] = None,
+    checkpoints: Optional[StageCheckpoints] = None
+    ):
+    '''
+    #### Generates the article of a single job and upserts it (by the job's uid) in the database.
+    #### Raises if the article couldn't be written, so the job isn't completed.
+    #### With {checkpoints}, a retried job only runs the stages its earlier attempts didn't finish.
+    '''
+    new_article = article_generation.generate_single_article(
+        locale_choices=supported_locales,
+        make_fake_choices=[True, False],
+        headline_index=headline_index,
+        model=job["model"],
+        router=router,
+        locale=job["locale"],
+        style=job["style"],
+        is_fake=job["is_fake"],
+        uid=job["uid"],
+        checkpoints=checkpoints
+    )
+    headline_index.add(new_article.localized_headline_en)
+    failed_documents = []
+    database.upsert_articles(mode, [new_article], failed_documents=failed_documents)
+    if len(failed_documents) > 0:
+        # Raised so the job goes back to the queue instead of being marked done
+        raise RuntimeError(f"Failed to write article `{new_article.uid}` to the database.")
+    if checkpoints is not None:
+        checkpoints.finish([new_article.uid])
+    return new_article
+
+
+def run_worker(
+    mode: str,
+    concurrency: int = DEFAULT_WORKER_CONCURRENCY,
+    plan_id: Optional[str] = None,
+    max_jobs: Optional[int] = None,
+    lease_seconds: float = job_queue.DEFAULT_LEASE_SECONDS,
+    heartbeat_interval_seconds: float = job_queue.HEARTBEAT_INTERVAL_SECONDS,
+    router: Optional[ModelRouter] = None,
+    worker_id: Optional[str] = None,
+    checkpoints: Optional[StageCheckpoints] = None
+    ) -> Dict[str, int]:
+    '''
+    ### Claims and runs jobs from the queue until it is empty (or {max_jobs} jobs were claimed).
+    - {concurrency} jobs run at the same time, each one holding a lease renewed by a single heartbeat thread.
+    - A failed job goes back to the queue (until it runs out of attempts).
+    #### Args:
+        mode (str): The mode to run the database in (dev, prod, testing)
+        concurrency (int): Number of jobs running at the same time
+        plan_id (str): Only run the jobs of this plan
+        max_jobs (int): Stop after claiming this many jobs
+        lease_seconds (float): Lease duration of a claimed job
+        heartbeat_interval_seconds (float): Time between lease renewals
+        router (ModelRouter): Optional router picking the content and translation models
+        worker_id (str): Id of this worker (defaults to host:pid:random)
+        checkpoints (StageCheckpoints): Optional local store of finished stage outputs, so a job retried
+            on this machine (e.g. after a crash) resumes where its last attempt stopped
+    #### Returns:
+        {"done": int, "failed": int} counts of this worker
+    '''
+    worker_id = worker_id or job_queue.make_worker_id()
+    database.ensure_article_indexes(mode)
+    job_queue.ensure_job_indexes(mode)
+    headline_index = job_queue.SharedHeadlineIndex(mode, load_headlines_from_db(mode))
+    print(f"[{worker_id}] Worker started with {len(headline_index)} known headlines.")
+
+    lease_keeper = job_queue.LeaseKeeper(mode, worker_id, lease_seconds, heartbeat_interval_seconds)
+    lease_keeper.start()
+    counts = {"done": 0, "failed": 0, "claimed": 0}
+    counts_lock = threading.Lock()
+
+    def claim():
+        with counts_lock:
+            if max_jobs is not None and counts["claimed"] >= max_jobs:
+                return None
+            job = job_queue.claim_job(mode, worker_id, lease_seconds, plan_id)
+            if job is not None:
+                counts["claimed"] += 1
+            return job
+
+    def work():
+        while True:
+            job = claim()
+            if job is None:
+                return
+            lease_keeper.hold(job["_id"])
+            try:
+                run_job(mode, job, headline_index, router, checkpoints)
+            except Exception as error:
+                status = job_queue.fail_job(mode, job, worker_id, f"{type(error).__name__}: {error}")
+                print(f"[{worker_id}] Job {job['_id']} failed ({type(error).__name__}: {error}). Now {status}.")
+                with counts_lock:
+                    counts["failed"] += 1
+                continue
+            finally:
+                lease_keeper.release(job["_id"])
+            job_queue.complete_job(mode, job, worker_id)
+            metrics.get_metrics().record_article()
+            with counts_lock:
+                counts["done"] += 1
+                print(f"[{worker_id}] Job {job['_id']} done ({counts['done']} done by this worker).")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for future in [executor.submit(work) for _ in range(max(1, concurrency))]:
+                future.result()
+    finally:
+        lease_keeper.stop()
+        if checkpoints is not None:
+            checkpoints.compact()
+
+    print(
+        f'''
+        -----------------------------------
+        ->>> Queue worker {worker_id}
+        - Done: {counts["done"]}
+        - Failed: {counts["failed"]}
+        - Queue: {job_queue.queue_stats(mode, plan_id)}
+        -----------------------------------
+        '''
+    )
+    return {"done": counts["done"], "failed": counts["failed"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared article job queue")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Plan jobs and add them to the queue")
+    enqueue_parser.add_argument("--mode", default="testing", choices=["dev", "prod", "testing"])
+    enqueue_parser.add_argument("--plan-id", required=True)
+    size_group = enqueue_parser.add_mutually_exclusive_group(required=True)
+    size_group.add_argument("--articles", type=int, help="Random articles per model")
+    size_group.add_argument("--per-cell", type=int, help="Target per (locale, outlet, is_fake, model), minus what the database already has")
+    enqueue_parser.add_argument("--models", nargs="+", required=True)
+    enqueue_parser.add_argument("--seed", type=int, default=0)
+
+    work_parser = subparsers.add_parser("work", help="Run jobs until the queue is empty")
+    work_parser.add_argument("--mode", default="testing", choices=["dev", "prod", "testing"])
+    work_parser.add_argument("--plan-id", default=None)
+    work_parser.add_argument("--concurrency", type=int, default=DEFAULT_WORKER_CONCURRENCY)
+    work_parser.add_argument("--max-jobs", type=int, default=None)
+    work_parser.add_argument("--lease-seconds", type=float, default=job_queue.DEFAULT_LEASE_SECONDS)
+
+    status_parser = subparsers.add_parser("status", help="Print the number of jobs by status")
+    status_parser.add_argument("--mode", default="testing", choices=["dev", "prod", "testing"])
+    status_parser.add_argument("--plan-id", default=None)
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "enqueue":
+            if args.per_cell is not None:
+                jobs = quota_planner.plan_missing_jobs(args.mode, quota_planner.uniform_targets(args.per_cell, args.models), args.seed)
+            else:
+                jobs = plan_random_jobs(args.articles, args.models, args.seed)
+            added_count = job_queue.enqueue_jobs(args.mode, args.plan_id, jobs)
+            print(f"Added {added_count} of {len(jobs)} jobs to plan `{args.plan_id}`.")
+        elif args.command == "work":
+            run_metrics = metrics.reset_metrics()
+            run_worker(
+                args.mode,
+                concurrency=args.concurrency,
+                plan_id=args.plan_id,
+                max_jobs=args.max_jobs,
+                lease_seconds=args.lease_seconds,
+                heartbeat_interval_seconds=min(job_queue.HEARTBEAT_INTERVAL_SECONDS, args.lease_seconds / 3),
+                checkpoints=StageCheckpoints()
+            )
+            run_metrics.export()
+        else:
+            print(job_queue.queue_stats(args.mode, args.plan_id))
+    finally:
+        database.close_mongo_client()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+'''
+This is the quota planner module. Instead of picking the locale, outlet style and fake/real choice of each
+article at random, it plans exactly the articles a balanced dataset is still missing.
+
+- Targets are article counts per (locale, outlet, is_fake, model) cell.
+- What already exists in the database is subtracted first (one aggregation), along with the articles
+  still on their way there (resumed from checkpoints, or waiting in the journal to be pushed).
+- The remaining articles are laid out as a seeded, deterministic schedule of jobs, interleaved across cells
+  so that a run stopped half way is still balanced. The jobs (see job_queue.make_job) can be run by
+  batch_generation.generate_articles or enqueued for the queue workers.
+'''
+
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils import database
+from utils import job_queue
+from utils.locales import news_outlets_map, supported_locales
+
+# (locale, outlet, is_fake, model)
+Cell = Tuple[str, str, bool, str]
+
+
+def uniform_targets(
+    per_cell: int,
+    models: List[str],
+    locales: Iterable[str] = supported_locales,
+    fake_choices: Iterable[bool] = (True, False)
+    ) -> Dict[Cell, int]:
+    """
+    ### The same target for every (locale, outlet of the locale, is_fake, model) cell.
+    """
+    return {
+        (locale, outlet, is_fake, model): per_cell
+        for locale in locales
+        for outlet in news_outlets_map[locale]
+        for is_fake in fake_choices
+        for model in models
+    }
+
+
+def count_existing(mode: str, targets: Dict[Cell, int]) -> Dict[Cell, int]:
+    """
+    ### Counts the articles already in the database for each cell of {targets}, in a single aggregation.
+    """
+    locales = sorted({cell[0] for cell in targets})
+    models = sorted({cell[3] for cell in targets})
+    pipeline = [
+        {"$match": {"origin_locale": {"$in": locales}, "headline_model_used": {"$in": models}}},
+        {"$group": {
+            "_id": {
+                "locale": "$origin_locale",
+                "outlet": "$style_or_source",
+                "is_fake": "$is_fake",
+                "model": "$headline_model_used",
+            },
+            "count": {"$sum": 1},
+        }},
+    ]
+    existing: Dict[Cell, int] = {}
+    for row in database.get_collection(mode).aggregate(pipeline):
+        cell = (row["_id"]["locale"], row["_id"]["outlet"], row["_id"]["is_fake"], row["_id"]["model"])
+        if cell in targets:
+            existing[cell] = row["count"]
+    return existing
+
+
+def job_cell(job: dict) -> Cell:
+    """
+    ### Cell of a job (see job_queue.make_job), or of a checkpointed article plan (see StageCheckpoints.unfinished).
+    """
+    return (job["locale"], job["style"], job["is_fake"], job["model"])
+
+
+def article_cell(document: dict) -> Cell:
+    """
+    ### Cell of an article document (see Article.to_dict).
+    """
+    return (document["origin_locale"], document["style_or_source"], document["is_fake"], document["headline_model_used"])
+
+
+def plan_jobs(targets: Dict[Cell, int], existing: Optional[Dict[Cell, int]] = None, seed: int = 0) -> List[dict]:
+    """
+    ### Lays out the missing articles of every cell as a deterministic job schedule.
+    Jobs are handed out in rounds (one per cell still short of its target, in a seeded order per round),
+    so every prefix of the schedule is as balanced as possible.
+    #### Args:
+    - targets (dict): {cell: target article count}
+    - existing (dict): {cell: articles already generated} (see count_existing)
+    - seed (int): Seed of the cell order. The same inputs and seed always give the same schedule.
+    #### Returns:
+    - List[dict]: Jobs (locale, style, is_fake, model), in the order they should run
+    """
+    existing = existing or {}
+    remaining = {cell: target - existing.get(cell, 0) for cell, target in targets.items()}
+    cells = sorted(cell for cell, count in remaining.items() if count > 0)
+    rng = random.Random(seed)
+
+    jobs = []
+    while cells:
+        rng.shuffle(cells)
+        for cell in cells:
+            locale, outlet, is_fake, model = cell
+            jobs.append(job_queue.make_job(locale, outlet, is_fake, model))
+            remaining[cell] -= 1
+        cells = sorted(cell for cell in cells if remaining[cell] > 0)
+    return jobs
+
+
+def plan_missing_jobs(mode: str, targets: Dict[Cell, int], seed: int = 0, pending: Iterable[Cell] = ()) -> List[dict]:
+    """
+    ### Plans the jobs still needed to reach {targets}, given what is already in the database.
+    {pending} are the cells of articles that aren't in the database yet but will be (e.g. unfinished
+    checkpointed articles that are resumed first, or unpushed journal articles). They count as existing.
+    """
+    existing = count_existing(mode, targets)
+    pending_count = 0
+    for cell in pending:
+        if cell in targets:
+            existing[cell] = existing.get(cell, 0) + 1
+            pending_count += 1
+    jobs = plan_jobs(targets, existing, seed)
+    print(
+        f'''
+        -----------------------------------
+        ->>> Quota plan
+        - Cells: {len(targets)}
+        - Target: {sum(targets.values())} articles
+        - Existing: {sum(existing.values())} articles ({pending_count} not yet in the database)
+        - Planned: {len(jobs)} jobs
+        -----------------------------------
+        '''
+    )
+    return jobs
@@ -0,0 +1,147 @@
+'''
+This is the stage scheduler module. It runs the steps of the article pipeline as a dependency graph:
+every step is a node that starts as soon as the nodes it depends on are done, on a shared worker pool.
+
+The same scheduler can hold the graphs of many articles at once (see batch_generation).
+'''
+
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+
+class StageSkippedError(Exception):
+    '''
+    Set as the error of a node that didn't run because one of its dependencies failed.
+    '''
+
+
+class StageNode:
+    '''
+    ### A single step of the graph.
+    #### Attributes:
+    - name: str - Unique name of the node
+    - fn: Callable - Called with a {dependency name: result} dict once all dependencies succeeded
+    - dependencies: List[str] - Names of the nodes this node needs
+    - limiter: threading.Semaphore - Optional limit shared between nodes (e.g. per-model concurrency), or a
+        callable returning one, resolved when the node is about to start (e.g. once its model is picked)
+    - priority: int - Lower runs first among ready nodes (defaults to insertion order)
+    '''
+    __slots__ = ("name", "fn", "dependencies", "limiter", "priority", "dependents", "pending", "held_limiter")
+
+    def __init__(self, name: str, fn: Callable, dependencies: List[str], limiter, priority: int):
+        self.name = name
+        self.fn = fn
+        self.dependencies = dependencies
+        self.limiter = limiter
+        self.priority = priority
+        self.dependents: List[str] = []
+        self.pending = len(dependencies)
+        self.held_limiter: Optional[threading.Semaphore] = None
+
+    def try_acquire(self) -> bool:
+        limiter = self.limiter() if callable(self.limiter) else self.limiter
+        if limiter is not None and not limiter.acquire(blocking=False):
+            return False
+        self.held_limiter = limiter
+        return True
+
+
+class StageScheduler:
+    """
+    ### Runs a graph of stage nodes on a bounded worker pool.
+    - A node starts as soon as all of its dependencies succeeded (and its limiter has room).
+    - If a node fails, every node depending on it is skipped with a StageSkippedError.
+    #### Args:
+    - max_workers (int): Maximum number of nodes running at the same time
+    """
+    def __init__(self, max_workers: int):
+        self.max_workers = max(1, max_workers)
+        self.nodes: Dict[str, StageNode] = {}
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, Exception] = {}
+        self._counter = itertools.count()
+
+    def add(self, name: str, fn: Callable, dependencies: Iterable[str] = (), limiter: Optional[Union[threading.Semaphore, Callable]] = None, priority: Optional[int] = None) -> str:
+        """
+        ### Adds a node. Dependencies must already have been added.
+        #### Returns:
+        - str: The node's name
+        """
+        if name in self.nodes:
+            raise ValueError(f"Stage `{name}` was already added.")
+        dependencies = list(dependencies)
+        for dependency in dependencies:
+            if dependency not in self.nodes:
+                raise ValueError(f"Stage `{name}` depends on unknown stage `{dependency}`.")
+        order = next(self._counter)
+        node = StageNode(name, fn, dependencies, limiter, priority if priority is not None else order)
+        self.nodes[name] = node
+        for dependency in dependencies:
+            self.nodes[dependency].dependents.append(name)
+        return name
+
+    def _run_node(self, node: StageNode):
+        try:
+            return node.fn({dependency: self.results[dependency] for dependency in node.dependencies})
+        finally:
+            if node.held_limiter is not None:
+                node.held_limiter.release()
+
+    def _skip_dependents(self, name: str, error: Exception):
+        stack = list(self.nodes[name].dependents)
+        while stack:
+            dependent = stack.pop()
+            if dependent in self.errors:
+                continue
+            self.errors[dependent] = StageSkippedError(f"Skipped because `{name}` failed: {error}")
+            stack.extend(self.nodes[dependent].dependents)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        ### Runs every node of the graph and waits for all of them to finish.
+        #### Returns:
+        - dict: {node name: result} of the nodes that succeeded. Failed and skipped nodes are in `errors`.
+        """
+        ready: List[tuple] = []
+        for node in self.nodes.values():
+            if node.pending == 0 and node.name not in self.results and node.name not in self.errors:
+                heapq.heappush(ready, (node.priority, next(self._counter), node.name))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while ready or running:
+                # Start as many ready nodes as the pool and their limiters allow
+                deferred = []
+                while ready and len(running) < self.max_workers:
+                    entry = heapq.heappop(ready)
+                    node = self.nodes[entry[2]]
+                    if not node.try_acquire():
+                        deferred.append(entry)
+                        continue
+                    running[executor.submit(self._run_node, node)] = node
+                for entry in deferred:
+                    heapq.heappush(ready, entry)
+                if not running:
+                    # Everything ready is waiting on a limiter held outside of this scheduler
+                    threading.Event().wait(0.05)
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        self.errors[node.name] = error
+                        self._skip_dependents(node.name, error)
+                        continue
+                    self.results[node.name] = future.result()
+                    for dependent_name in node.dependents:
+                        dependent = self.nodes[dependent_name]
+                        dependent.pending -= 1
+                        if dependent.pending == 0 and dependent_name not in self.errors:
+                            heapq.heappush(ready, (dependent.priority, next(self._counter), dependent_name))
+
+        return self.results
@@ -2,13 +2,36 @@
 This is the translations module. It is used to translate text between different languages.
 '''
 
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
 from utils.locales import locale_codes_to_names_map
+from utils import translation_memory
+
+from generation import model_calls
+
+# Serve identical translation prompts from the response cache
+CACHE_ENABLED = True
 
-import azure_client
+# Maximum number of translation requests in flight for a single article
+TRANSLATION_MAX_WORKERS = 9
 
-_client = azure_client.get_client()
+# How translate_all groups its requests:
+# - "per_field": one request per (text_type, target_locale)
+# - "per_locale": one structured (JSON) request per target locale with all text types
+# - "combined": one structured (JSON) request for all target locales and text types
+# Fields missing from a structured response fall back to "per_field" requests.
+TRANSLATION_MODE = "per_locale"
+TRANSLATION_MODES = ["per_field", "per_locale", "combined"]
 
-def translate(text, text_type, source_locale, target_locale, news_outlet_style, model):
+# Reuse sentence translations from the translation memory: sentences translated before (for the same
+# locales and outlet style) are filled in locally, only new sentences are sent to the model
+TRANSLATION_MEMORY_ENABLED = True
+# Similar past translations given to the model as examples, per target locale
+TRANSLATION_MEMORY_EXAMPLES = 8
+
+def translate(text, text_type, source_locale, target_locale, news_outlet_style, model, references=None):
     """
     ### Translate text from one language to another using the specified model.
     #### Args:
@@ -18,46 +41,52 @@ def translate(text, text_type, source_locale, target_locale, news_outlet_style,
     - target_locale (str): The target locale to translate the text to
     - news_outlet_style (str): The style to emulate of news outlets
 	- model (str): The model to use for generating the translation
+    - references (list): Optional [source, translation] pairs of similar past translations
     #### Returns
     - str: translated text.
+    #### Raises
+    - ModelCallError: If no usable translation could be generated
     """
     print(f"Translating `{text_type}` from `{source_locale}` to `{target_locale}` using {model} model. Emulating news outlet style: `{news_outlet_style}` ")
     source_locale_name = locale_codes_to_names_map[source_locale]
     target_locale_name = locale_codes_to_names_map[target_locale]
-    response = _client.complete(
+    messages = [
+        # Primary prompt
+        {"role": "system", "content":
+            '''
+            You are a journalist translating a news article from one language to another.
+            Retain the original meaning and style of the text.
+            '''
+        },
+        # Text to translate
+        {"role": "user", "content": f"The {text_type} you need to translate is: {text}."},
+        # Source locale
+        {"role": "user", "content": f"The original language of the text is: {source_locale_name}"},
+        # Target locale
+        {"role": "user", "content": f"Translate the text to: {target_locale_name}"},
+        # Style
+        {"role": "user", "content": f"When writing the text, try to emulate the style of {news_outlet_style} news outlet."},
+        # Misc
+        {"role": "user", "content": 
+            '''
+            Avoid using slang or idiomatic expressions.
+            Avoid leaving trailing white spaces.
+            Make sure to include nuances of the news outlet's style and source language.
+            '''
+        },
+    ]
+    if references:
+        messages.append(
+            {"role": "user", "content": f"Reuse these translations of similar sentences where they fit (JSON, [source, translation] pairs): {json.dumps(references, ensure_ascii=False)}"}
+        )
+    content = model_calls.call_model(
+        stage="translation",
         model=model,
-        messages=[
-            # Primary prompt
-            {"role": "system", "content":
-                '''
-                You are a journalist translating a news article from one language to another.
-                Retain the original meaning and style of the text.
-                '''
-            },
-            # Text to translate
-            {"role": "user", "content": f"The {text_type} you need to translate is: {text}."},
-            # Source locale
-            {"role": "user", "content": f"The original language of the text is: {source_locale_name}"},
-            # Target locale
-            {"role": "user", "content": f"Translate the text to: {target_locale_name}"},
-            # Style
-            {"role": "user", "content": f"When writing the text, try to emulate the style of {news_outlet_style} news outlet."},
-            # Misc
-            {"role": "user", "content": 
-                '''
-                Avoid using slang or idiomatic expressions.
-                Avoid leaving trailing white spaces.
-                Make sure to include nuances of the news outlet's style and source language.
-                '''
-            },
-        ]
+        parse=model_calls.response_text,
+        use_cache=CACHE_ENABLED,
+        locale=target_locale,
+        messages=messages
     )
-    
-    content = ""
-    try:
-        content = response.choices[0].message.content
-    except:
-        print(f"Failed to extract content from the response: {response}")
 
     print(f"""
     -----------------------------------
@@ -69,3 +98,260 @@ def translate(text, text_type, source_locale, target_locale, news_outlet_style,
     )
 
     return content
+
+
+def build_structured_translation_messages(texts, source_locale, target_locales, news_outlet_style, references=None):
+    """
+    ### Builds the chat messages for a structured (JSON) translation of several texts into several locales.
+    {references} ({locale: [[source, translation], ...]}) are similar past translations given as examples.
+    """
+    source_locale_name = locale_codes_to_names_map[source_locale]
+    target_locale_names = {lang: locale_codes_to_names_map[lang] for lang in target_locales}
+    expected_output = {lang: {text_type: "..." for text_type in texts} for lang in target_locales}
+    messages = [
+        # Primary prompt
+        {"role": "system", "content":
+            '''
+            You are a journalist translating a news article from one language to another.
+            Retain the original meaning and style of the text.
+            Respond with a single JSON object and nothing else.
+            '''
+        },
+        # Texts to translate
+        {"role": "user", "content": f"The texts you need to translate are (JSON, by text type): {json.dumps(texts, ensure_ascii=False)}"},
+        # Source locale
+        {"role": "user", "content": f"The original language of the texts is: {source_locale_name}"},
+        # Target locales
+        {"role": "user", "content": f"Translate every text to each of these languages (JSON, by locale code): {json.dumps(target_locale_names, ensure_ascii=False)}"},
+        # Style
+        {"role": "user", "content": f"When writing the texts, try to emulate the style of {news_outlet_style} news outlet."},
+        # Output format
+        {"role": "user", "content": f"Respond with JSON in exactly this shape, by locale code and text type: {json.dumps(expected_output)}"},
+        # Misc
+        {"role": "user", "content":
+            '''
+            Avoid using slang or idiomatic expressions.
+            Avoid leaving trailing white spaces.
+            Make sure to include nuances of the news outlet's style and source language.
+            '''
+        },
+    ]
+    if references:
+        messages.append(
+            {"role": "user", "content": f"Reuse these translations of similar sentences where they fit (JSON, by locale code: [source, translation] pairs): {json.dumps(references, ensure_ascii=False)}"}
+        )
+    return messages
+
+
+def parse_structured_translation(response, text_types, target_locales):
+    """
+    ### Validates a structured translation response.
+    #### Returns:
+    - dict: {target_locale: {text_type: translated text}} holding only the fields that are present and non-empty
+    """
+    parsed = model_calls.parse_json_object(model_calls.response_text(response))
+    results = {lang: {} for lang in target_locales}
+    for lang in target_locales:
+        translated = parsed.get(lang)
+        if not isinstance(translated, dict):
+            continue
+        for text_type in text_types:
+            value = translated.get(text_type)
+            if isinstance(value, str) and value.strip() != "":
+                results[lang][text_type] = value.strip()
+    if all(len(fields) == 0 for fields in results.values()):
+        raise model_calls.ModelCallError(f"Structured translation response has no usable fields: {parsed}")
+    return results
+
+
+def translate_structured(texts, source_locale, target_locales, news_outlet_style, model, references=None):
+    """
+    ### Translate several texts into several locales with a single structured (JSON) request.
+    #### Args:
+    - texts (dict): Mapping of text_type (headline, detail, content) to the text to translate
+    - source_locale (str): The original locale of the texts
+    - target_locales (list): The locales to translate the texts to
+    - news_outlet_style (str): The style to emulate of news outlets
+    - model (str): The model to use for generating the translations
+    - references (dict): Optional {locale: [[source, translation], ...]} similar past translations
+    #### Returns
+    - dict: {target_locale: {text_type: translated text}}. Fields that failed to parse are left out.
+    """
+    print(f"Translating {list(texts)} from `{source_locale}` to {target_locales} in one request using {model} model. Emulating news outlet style: `{news_outlet_style}` ")
+    try:
+        return model_calls.call_model(
+            stage="translation",
+            model=model,
+            parse=lambda response: parse_structured_translation(response, list(texts), target_locales),
+            use_cache=CACHE_ENABLED,
+            locale=",".join(target_locales),
+            messages=build_structured_translation_messages(
+                texts, source_locale, target_locales, news_outlet_style,
+                references={lang: references[lang] for lang in target_locales if references and references.get(lang)}
+            )
+        )
+    except model_calls.CircuitOpenError:
+        raise
+    except model_calls.ModelCallError as error:
+        print(f"Structured translation failed, falling back to per-field requests: {error}")
+        return {lang: {} for lang in target_locales}
+
+
+class MemoryRequest:
+    """
+    ### The part of a translate_all request that the translation memory can't fill.
+    - Texts without any remembered sentence are sent whole.
+    - Texts with remembered sentences are sent sentence by sentence (as `{text_type}#{index}`), leaving
+      out the sentences remembered for every target locale.
+    - Similar remembered sentences are collected as examples for the model.
+    Once the request is done, `assemble` puts the texts back together and stores the new sentence pairs.
+    """
+    def __init__(self, texts, source_locale, target_locales, news_outlet_style):
+        self.memory = translation_memory.get_translation_memory()
+        self.key = (source_locale, news_outlet_style)
+        self.target_locales = target_locales
+        self.texts: Dict[str, str] = {}
+        self.references: Dict[str, List[List[str]]] = {lang: [] for lang in target_locales}
+        self._segmented = {}
+        for text_type, text in texts.items():
+            segments, separators = translation_memory.split_segments(text)
+            hits = {
+                lang: {
+                    index: self._lookup(lang, segment)
+                    for index, segment in enumerate(segments)
+                }
+                for lang in target_locales
+            }
+            novel = [
+                index for index, segment in enumerate(segments)
+                if segment.strip() != "" and any(hits[lang][index] is None for lang in target_locales)
+            ]
+            self._add_references(segments, novel, hits)
+            if len(novel) == sum(1 for segment in segments if segment.strip() != ""):
+                self.texts[text_type] = text
+                self._segmented[text_type] = (segments, separators, None)
+                continue
+            for index in novel:
+                self.texts[f"{text_type}#{index}"] = segments[index]
+            self._segmented[text_type] = (segments, separators, hits)
+
+    def _lookup(self, lang, segment):
+        if segment.strip() == "":
+            return segment
+        return self.memory.lookup(self.key[0], lang, self.key[1], segment)
+
+    def _add_references(self, segments, novel, hits):
+        for lang in self.target_locales:
+            references = self.references[lang]
+            for index in novel:
+                if len(references) >= TRANSLATION_MEMORY_EXAMPLES:
+                    break
+                if hits[lang][index] is not None:
+                    continue
+                for source, target, _ in self.memory.fuzzy_matches(self.key[0], lang, self.key[1], segments[index], k=1):
+                    if [source, target] not in references:
+                        references.append([source, target])
+
+    def assemble(self, translated: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+        """
+        ### Builds the full translations from the model's {translated} texts and the remembered sentences.
+        """
+        results = {lang: {} for lang in self.target_locales}
+        for lang in self.target_locales:
+            pairs = []
+            for text_type, (segments, separators, hits) in self._segmented.items():
+                if hits is None:
+                    # Sent whole: remember its sentences if the translation splits the same way
+                    translation = translated[lang][text_type]
+                    translated_segments, _ = translation_memory.split_segments(translation)
+                    if len(translated_segments) == len(segments):
+                        pairs.extend(zip(segments, translated_segments))
+                    results[lang][text_type] = translation
+                    continue
+                parts = []
+                for index, segment in enumerate(segments):
+                    part = hits[lang][index]
+                    if part is None:
+                        part = translated[lang][f"{text_type}#{index}"]
+                        pairs.append((segment, part))
+                    parts.append(part)
+                results[lang][text_type] = translation_memory.join_segments(parts, separators)
+            self.memory.add(self.key[0], lang, self.key[1], pairs)
+        return results
+
+
+def translate_all(texts, source_locale, target_locales, news_outlet_style, model, max_workers=TRANSLATION_MAX_WORKERS, mode=None):
+    """
+    ### Translate several texts into several locales concurrently.
+    Requests are grouped according to {mode} (see TRANSLATION_MODE), with at most {max_workers}
+    requests in flight at the same time. Fields a structured request didn't return are translated
+    with per-field requests.
+    With TRANSLATION_MEMORY_ENABLED, remembered sentences are filled in locally and only the new ones
+    are sent (see MemoryRequest).
+    #### Args:
+    - texts (dict): Mapping of text_type (headline, detail, content) to the text to translate
+    - source_locale (str): The original locale of the texts
+    - target_locales (list): The locales to translate the texts to
+    - news_outlet_style (str): The style to emulate of news outlets
+    - model (str): The model to use for generating the translations
+    - max_workers (int): Maximum number of concurrent translation requests
+    - mode (str): One of TRANSLATION_MODES. Defaults to TRANSLATION_MODE.
+    #### Returns
+    - dict: {target_locale: {text_type: translated text}}
+    """
+    mode = mode or TRANSLATION_MODE
+    if mode not in TRANSLATION_MODES:
+        raise ValueError(f"Unknown translation mode `{mode}`. Expected one of {TRANSLATION_MODES}.")
+    if not target_locales or not texts:
+        return {lang: {} for lang in target_locales}
+    if not TRANSLATION_MEMORY_ENABLED:
+        return _translate_texts(texts, source_locale, target_locales, news_outlet_style, model, max_workers, mode)
+
+    memory_request = MemoryRequest(texts, source_locale, target_locales, news_outlet_style)
+    if len(memory_request.texts) < len(texts):
+        print(f"Translation memory: sending {len(memory_request.texts)} text(s)/sentence(s) of {list(texts)} to the model.")
+    translated = _translate_texts(
+        memory_request.texts, source_locale, target_locales, news_outlet_style, model, max_workers, mode,
+        references=memory_request.references
+    )
+    return memory_request.assemble(translated)
+
+
+def _translate_texts(texts, source_locale, target_locales, news_outlet_style, model, max_workers, mode, references=None):
+    results: Dict[str, Dict[str, str]] = {lang: {} for lang in target_locales}
+    if not texts:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # Structured requests first
+        if mode == "combined":
+            results.update(translate_structured(texts, source_locale, target_locales, news_outlet_style, model, references))
+        elif mode == "per_locale":
+            structured_futures = {
+                executor.submit(translate_structured, texts, source_locale, [lang], news_outlet_style, model, references): lang
+                for lang in target_locales
+            }
+            for future, lang in structured_futures.items():
+                results[lang] = future.result()[lang]
+
+        # Per-field requests for everything still missing
+        futures = {}
+        for lang in target_locales:
+            for text_type, text in texts.items():
+                if text_type in results[lang]:
+                    continue
+                future = executor.submit(
+                    translate,
+                    text=text,
+                    text_type=text_type.split("#")[0],
+                    source_locale=source_locale,
+                    target_locale=lang,
+                    news_outlet_style=news_outlet_style,
+                    model=model,
+                    references=references.get(lang) if references else None
+                )
+                futures[future] = (lang, text_type)
+        for future, (lang, text_type) in futures.items():
+            results[lang][text_type] = future.result()
+
+    return results
@@ -8,43 +8,78 @@ respective LLMs. These include GPT-4, GPT-4o, Phi-3-medium-4k-instruct, Llama-2,
 Meta-Llama-3.1, Mistral-large, etc.
 '''
 
-import json
-from utils.database import store_articles_to_db
+from utils.database import ArticleSink, push_articles_to_db, clear_push_checkpoint, close_mongo_client
+from utils.stage_checkpoints import StageCheckpoints
+from utils import journal
+from utils import metrics
 from generation import article_generation
+from generation import batch_generation
+from generation import quota_planner
+from generation.model_router import ModelRouter
 
 
-def generate_and_push_to_db(db_name, model):
-    run_count = 1
-    
-    # Generate articles
-    for i in range(run_count):
-        print(f"""
-        ================================================================================
-        ->>> Generating Article {i+1} of {run_count} now...
-        ================================================================================
-        """
-        )
-        article_generation.generate_and_store_single_article(model)
+def generate_and_push_to_db(db_name, model, run_count=1, concurrency=batch_generation.DEFAULT_CONCURRENCY, prometheus_report=False, router=None):
+    run_metrics = metrics.reset_metrics()
+
+    # Generate articles (content and translations are routed across the router's model pools). Finished
+    # articles are written to the database in the background while the rest are being generated.
+    # Finished stages are checkpointed: articles an earlier run left half done are resumed first.
+    checkpoints = StageCheckpoints()
+    with ArticleSink(db_name) as sink:
+        articles = batch_generation.generate_articles(n=run_count, models=[model], concurrency=concurrency, router=router, sink=sink, checkpoints=checkpoints)
     
-    # Retrieve articles from file and store articles in database
-    article_generation.ARTICLES_FILE_PATH
-    with open (article_generation.ARTICLES_FILE_PATH, 'r') as read_file:
-        data = json.load(read_file)
-        articles = data["articles"]
-        print(f"Retrieved {len(articles)} articles from file.")
-        read_file.close()
+    # Keep what the sink couldn't write in the journal, and retry it along with anything left from earlier runs
+    journal.append_records(article_generation.ARTICLES_JOURNAL_PATH, [article.to_dict() for article in sink.failed_articles])
+    checkpoints.finish([article.uid for article in articles])
+    checkpoints.compact()
+    push_journal_to_db(db_name)
+
+    # Write out the run report
+    run_metrics.export(prometheus=prometheus_report)
+
+
+def generate_planned_and_push_to_db(db_name, models, per_cell, seed=0, concurrency=batch_generation.DEFAULT_CONCURRENCY, prometheus_report=False, router=None):
+    run_metrics = metrics.reset_metrics()
+
+    # Plan only the articles still missing from each (locale, outlet, is_fake, model) cell. Articles that
+    # are resumed from checkpoints, or still waiting in the journal, count as already there.
+    checkpoints = StageCheckpoints()
+    pending = [quota_planner.job_cell(plan) for plan in checkpoints.unfinished()]
+    pending += [quota_planner.article_cell(record) for record in journal.read_records(article_generation.ARTICLES_JOURNAL_PATH)]
+    targets = quota_planner.uniform_targets(per_cell, models)
+    jobs = quota_planner.plan_missing_jobs(db_name, targets, seed, pending)
+    if len(jobs) > 0 or len(checkpoints.unfinished()) > 0:
+        with ArticleSink(db_name) as sink:
+            articles = batch_generation.generate_articles(n=0, models=models, concurrency=concurrency, router=router, jobs=jobs, sink=sink, checkpoints=checkpoints)
+        journal.append_records(article_generation.ARTICLES_JOURNAL_PATH, [article.to_dict() for article in sink.failed_articles])
+        checkpoints.finish([article.uid for article in articles])
+        checkpoints.compact()
+
+    push_journal_to_db(db_name)
+
+    # Write out the run report
+    run_metrics.export(prometheus=prometheus_report)
+
+
+def push_journal_to_db(db_name):
+    # Stream articles from the journal and upsert them in database (resumes from the last checkpoint)
+    articles = journal.read_records(article_generation.ARTICLES_JOURNAL_PATH)
 
     # Store in database
-    db_result = store_articles_to_db(db_name, articles)
-    if db_result:
-        print(f"Stored {len(articles)} articles in database.")
+    failed_documents = []
+    pushed_count = push_articles_to_db(db_name, articles, failed_documents=failed_documents)
+    if pushed_count:
+        print(f"Pushed {pushed_count} articles to database.")
     
-    # Empty the array in the file
-    with open(article_generation.ARTICLES_FILE_PATH, 'w') as write_file:
-        json.dump({"articles": []}, write_file)
-        write_file.close()
+    # Replace the journal with what couldn't be pushed (nothing, normally). The checkpoint is cleared
+    # first: a crash in between only re-pushes (upserts) the same articles again.
+    clear_push_checkpoint()
+    journal.rewrite(article_generation.ARTICLES_JOURNAL_PATH, failed_documents)
     
-    print(f"Emptied {article_generation.ARTICLES_FILE_PATH} file.")    
+    if failed_documents:
+        print(f"Kept {len(failed_documents)} articles that failed to push in {article_generation.ARTICLES_JOURNAL_PATH} journal.")
+    else:
+        print(f"Emptied {article_generation.ARTICLES_JOURNAL_PATH} journal.")    
 
 
 
@@ -61,13 +96,24 @@ def main():
     )  
     
     # generate_and_push_to_db(db_name="dev")
+    # generate_planned_and_push_to_db(db_name="dev", models=["Phi-3.5-mini-instruct"], per_cell=1)
 
     model_list = [
         "Phi-3.5-mini-instruct",
     ]
 
+    # Content and translation go to whichever model of the pool is currently healthiest
+    # (weights can be given as {model: weight})
+    router = ModelRouter({
+        "content": model_list,
+        "translation": model_list,
+    })
+
     for model in model_list:
-        generate_and_push_to_db(db_name="testing", model=model)
+        generate_and_push_to_db(db_name="testing", model=model, router=router)
+    
+    router.close()
+    close_mongo_client()
 
     
 if __name__ == "__main__":
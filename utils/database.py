@@ -1,106 +1,821 @@
+'''
+Database util module. Shared MongoDB client, article storage (insert, idempotent push, write-behind sink)
+and maintenance of the stored articles.
+
+Usage (repair of articles with empty localized fields):
+    python -m utils.database repair --mode testing --workers 8
+'''
+
 import os
+import sys
 import json
-from typing import List
-from pymongo import MongoClient
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Union
+from bson import ObjectId
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from classes.article import Article
+from utils.locales import supported_locales
+from utils.misc import chunked
+from utils import journal
+from utils import metrics
 
 # ------------------------------
 # Set up
 # ------------------------------
-mongo_db_connection_string = os.getenv("JUDGE_GPT_MONGODB_CONNECTION_STRING")
-if mongo_db_connection_string is None:
-    raise ValueError(
-    '''
-    [database] MongoDB connection string is not set. 
-    Please set the JUDGE_GPT_MONGODB_CONNECTION_STRING environment variable.
-    '''
-    )
-
 database_name_dev = "dev"
 database_name_prod = "prod"
 database_name_testing = "testing"
 collection_name_articles = "articles"
 
+# Connection pool size of the shared client
+MONGO_MAX_POOL_SIZE = 20
+# Number of documents sent per insert_many call
+DEFAULT_CHUNK_SIZE = 100
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# Cursor batch size used when syncing headlines
+HEADLINE_SYNC_BATCH_SIZE = 1000
+# Journal the headlines of the database are pulled into (see pull_generated_headlines_from_db)
+PULLED_HEADLINES_JOURNAL_PATH = "data/pulled_headlines.jsonl"
+# Several writers don't insert in `_id` order (ObjectIds are made by each client, from its own clock),
+# so incremental reads start this far behind their high-water mark and skip what they already have
+SYNC_OVERLAP_SECONDS = 300
+
+# Offset of the last pushed article of the pending articles journal
+PUSH_CHECKPOINT_FILE_PATH = "data/push_checkpoint.json"
+# Write errors worth retrying: Cosmos DB throttling (request rate too large)
+RETRYABLE_WRITE_ERROR_CODES = {16500}
+# Retries of the throttled upserts of a pushed chunk
+PUSH_MAX_RETRIES = 5
+PUSH_RETRY_BASE_DELAY_SECONDS = 1.0
+
+# Write-behind sink: articles waiting to be written (producers block when it is full), batch size,
+# longest time an article waits for its batch, and retries of a batch the database rejected
+SINK_MAX_QUEUE_SIZE = 500
+SINK_FLUSH_SIZE = DEFAULT_CHUNK_SIZE
+SINK_FLUSH_INTERVAL_SECONDS = 5.0
+SINK_MAX_RETRIES = 5
+SINK_RETRY_BASE_DELAY_SECONDS = 1.0
+
+# The 12 localized_{headline,detail,content}_{locale} fields of an article document
+LOCALIZED_TEXT_FIELDS = ["headline", "detail", "content"]
+LOCALIZED_FIELD_NAMES = [f"localized_{field}_{locale}" for locale in supported_locales for field in LOCALIZED_TEXT_FIELDS]
+# Number of articles repaired at the same time
+REPAIR_MAX_WORKERS = 8
+
+# The client is created on first use (not on import), so importing this module doesn't need a
+# connection string. The provider can be swapped out (e.g. for mongomock or a local mongod).
+_mongo_client: Optional[MongoClient] = None
+_mongo_client_provider: Optional[Callable[[], MongoClient]] = None
+_mongo_client_lock = threading.Lock()
+
+
+def create_mongo_client() -> MongoClient:
+    """
+    ### Default provider: a pooled MongoClient for JUDGE_GPT_MONGODB_CONNECTION_STRING.
+    """
+    mongo_db_connection_string = os.getenv("JUDGE_GPT_MONGODB_CONNECTION_STRING")
+    if mongo_db_connection_string is None:
+        raise ValueError(
+        '''
+        [database] MongoDB connection string is not set. 
+        Please set the JUDGE_GPT_MONGODB_CONNECTION_STRING environment variable.
+        '''
+        )
+    return MongoClient(mongo_db_connection_string, maxPoolSize=MONGO_MAX_POOL_SIZE)
+
+
+def get_mongo_client() -> MongoClient:
+    """
+    ### Returns the shared (pooled) MongoClient, created by the client provider on first use.
+    """
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is None:
+            _mongo_client = (_mongo_client_provider or create_mongo_client)()
+        return _mongo_client
+
+
+def set_mongo_client_provider(provider: Optional[Callable[[], MongoClient]]):
+    """
+    ### Sets the function used to create the shared MongoClient on first use (None restores the default).
+    The current client is closed, so the next call creates a new one.
+    """
+    global _mongo_client, _mongo_client_provider
+    with _mongo_client_lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+        _mongo_client_provider = provider
+        _mongo_client = None
+
+
+def set_mongo_client(client):
+    """
+    ### Replaces the shared MongoClient (e.g. with a mongomock client or one pointing at a local mongod).
+    """
+    global _mongo_client
+    with _mongo_client_lock:
+        _mongo_client = client
+
+
+def close_mongo_client():
+    """
+    ### Closes the shared MongoClient and its connection pool.
+    """
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+
+
+def get_database_name(mode: str) -> str:
+    database_name = ""
+    if(mode == "dev"):
+        database_name = database_name_dev
+    elif(mode == "prod"):
+        database_name = database_name_prod
+    elif(mode == "testing"):
+        database_name = database_name_testing
+    return database_name
+
+
+def get_collection(mode: str, collection_name: str = collection_name_articles):
+    """
+    ### Returns a collection of the database for {mode} (dev, prod, testing) from the shared client.
+    """
+    return get_mongo_client()[get_database_name(mode)][collection_name]
+
+
+def _sync_state_file_path(storage_file_path: str) -> str:
+    return f"{storage_file_path}.sync.json"
+
 
-def pull_generated_headlines_from_db(mode:str, storage_file_path: str) -> List[str]:
+def since_id_query(last_id: Optional[ObjectId], overlap_seconds: float = SYNC_OVERLAP_SECONDS) -> dict:
     """
-    ### Pull generated headlines from the database and store them in a file if they are not already present.
+    ### Matches the documents created after {last_id}, starting {overlap_seconds} earlier (everything if None).
+    Documents from other writers can land behind a high-water mark, so callers re-read the overlap and skip
+    what they already have.
+    """
+    if last_id is None:
+        return {}
+    start = ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=overlap_seconds))
+    return {"_id": {"$gte": start}}
+
+
+def read_legacy_headlines(file_path: str) -> List[str]:
+    """
+    ### Reads a legacy `{"headlines": [...]}` headlines file (empty if it doesn't exist).
+    """
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, "r") as file:
+        return json.load(file).get("headlines", [])
+
+
+def pull_generated_headlines_from_db(
+    mode:str,
+    storage_file_path: str = PULLED_HEADLINES_JOURNAL_PATH,
+    known_headlines: Optional[Iterable[str]] = None,
+    batch_size: int = HEADLINE_SYNC_BATCH_SIZE
+    ) -> List[str]:
+    """
+    ### Incrementally pull generated headlines from the database into a headline journal.
     - Headlines are pulled in 'en' (English) locale only.
+    - Only documents past the stored high-water mark (`_id`, minus SYNC_OVERLAP_SECONDS) are read.
+    - Headlines already stored (or in {known_headlines}) are skipped, and only the new ones are appended.
+    - A legacy `.json` file (`{"headlines": [...]}`) is still accepted as {storage_file_path}: it is
+      rewritten with the new headlines added, as before. To migrate, pull once into the journal with the
+      legacy headlines as {known_headlines}; `load_used_headlines` reads both.
     #### Args:
     - mode (str): The mode to run the database in (dev, prod, testing).
-    - storage_file_path (str): The path to store the pulled headlines.
+    - storage_file_path (str): The path of the JSONL journal (or legacy JSON file) to store the pulled headlines in.
+    - known_headlines (Iterable[str]): Other headlines to de-duplicate against (e.g. a legacy headlines file).
+    - batch_size (int): Cursor batch size.
     #### Returns:
-    - List[str]: List of headlines pulled from the database.
+    - List[str]: List of new headlines pulled from the database.
     """
     
     print(f"Pulling headlines from the database in `{mode}` mode.")
     
     # Fetch currently stored headlines
-    current_headlines = []
-    with open(storage_file_path, "r") as file:
-        data = json.load(file)
-        current_headlines = data["headlines"]
-        print(f"Retrieved {len(current_headlines)} headlines from file.")
-        file.close()
+    legacy_file = storage_file_path.endswith(".json")
+    if legacy_file:
+        stored_headlines = read_legacy_headlines(storage_file_path)
+    else:
+        stored_headlines = [record["headline"] for record in journal.read_records(storage_file_path)]
+    current_headlines = set(known_headlines or [])
+    current_headlines.update(stored_headlines)
+    print(f"Retrieved {len(current_headlines)} known headlines.")
     
-    client = MongoClient(mongo_db_connection_string)
-    database_name = ""
-    if(mode == "dev"):
-        database_name = database_name_dev
-    elif(mode == "prod"):
-        database_name = database_name_prod
-    elif(mode == "testing"):
-        database_name = database_name_testing
-        
-    db = client[database_name]
-    collection = db[collection_name_articles]
+    # Read the high-water mark of the last sync
+    state_file_path = _sync_state_file_path(storage_file_path)
+    last_id = None
+    if os.path.exists(state_file_path):
+        with open(state_file_path, "r") as file:
+            stored_last_id = json.load(file).get("last_id")
+        if stored_last_id is not None:
+            last_id = ObjectId(stored_last_id)
+    
+    collection = get_collection(mode)
     
-    # Pull headlines from the database
-    headlines = collection.find({}, {"localized_headline_en": 1, "_id": 0})
-    for headline in headlines:
-        current_headlines.append(headline["localized_headline_en"])
+    # Pull headlines newer than the high-water mark (and the overlap before it) from the database
+    new_headlines = []
+    cursor = collection.find(since_id_query(last_id), {"localized_headline_en": 1}).sort("_id", ASCENDING).batch_size(batch_size)
+    for document in cursor:
+        if last_id is None or document["_id"] > last_id:
+            last_id = document["_id"]
+        headline = document.get("localized_headline_en")
+        if not headline or headline in current_headlines:
+            continue
+        current_headlines.add(headline)
+        new_headlines.append(headline)
     
-    # Store the headlines in the file
-    with open(storage_file_path, "w") as file:
-        json.dump({"headlines": current_headlines}, file)
-        file.close()
+    # Store the new headlines, then move the high-water mark
+    if legacy_file:
+        temp_path = f"{storage_file_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"headlines": stored_headlines + new_headlines}, file)
+        os.replace(temp_path, storage_file_path)
+    else:
+        journal.append_records(storage_file_path, [{"headline": headline} for headline in new_headlines])
+    if last_id is not None:
+        temp_path = f"{state_file_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"last_id": str(last_id)}, file)
+        os.replace(temp_path, state_file_path)
 
-    print(f"Stored {len(current_headlines)} headlines in the file.")
+    print(f"Stored {len(new_headlines)} new headlines in {storage_file_path}.")
+    
+    return new_headlines
 
 
-def store_articles_to_db(mode:str, articles: List[Article]) -> bool:
+def _to_document(article: Union[Article, dict]) -> dict:
+    if isinstance(article, Article):
+        return article.to_dict()
+    return article
+
+
+def store_articles_to_db(mode:str, articles: Iterable[Union[Article, dict]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
     """
     ### Store articles in the database.
+    - Articles are streamed and inserted in chunks of {chunk_size} (unordered), so one bad document doesn't
+      stop the rest of its chunk.
+    - Documents that fail to insert (e.g. duplicate uids) are reported one by one.
     #### Args:
     - mode (str): The mode to run the database in (dev, prod, testing).
-    - articles (List[Article]): List of articles to store in the database.
+    - articles (Iterable[Article | dict]): Articles to store in the database. Can be a generator.
+    - chunk_size (int): Number of documents per insert_many call.
     #### Returns:
-    - bool: True if successful, False otherwise.
+    - int: Number of stored articles.
     """
-    print("Starting to store {len(articles)} articles in the database.")
+    print("Starting to store articles in the database.")
     
-    client = MongoClient(mongo_db_connection_string)
-    database_name = ""
-    if(mode == "dev"):
-        database_name = database_name_dev
-    elif(mode == "prod"):
-        database_name = database_name_prod
-    elif(mode == "testing"):
-        database_name = database_name_testing
-
-    db = client[database_name]
-    collection = db[collection_name_articles]    
+    collection = get_collection(mode)
     
-    collection.insert_many(articles)
-        
-    client.close()
+    stored_count = 0
+    failed_count = 0
+    for chunk in chunked((_to_document(article) for article in articles), chunk_size):
+        started_at = time.perf_counter()
+        outcome = "success"
+        try:
+            result = collection.insert_many(chunk, ordered=False)
+            stored_count += len(result.inserted_ids)
+        except BulkWriteError as error:
+            outcome = "partial"
+            stored_count += error.details.get("nInserted", 0)
+            for write_error in error.details.get("writeErrors", []):
+                failed_count += 1
+                document = chunk[write_error["index"]]
+                reason = "duplicate uid" if write_error.get("code") == DUPLICATE_KEY_ERROR_CODE else write_error.get("errmsg")
+                print(f"[database] Failed to store article `{document.get('uid')}`: {reason}")
+        metrics.get_metrics().record_call(model="mongodb", stage="db", latency_seconds=time.perf_counter() - started_at, outcome=outcome)
     
     print(f"""
     -----------------------------------
     ->>> Database storage
-    - Successfully stored {len(articles)} articles in the database.
+    - Successfully stored {stored_count} articles in the database.
+    - Failed to store {failed_count} articles.
+    -----------------------------------
+    """
+    )
+    
+    return stored_count
+
+
+def ensure_article_indexes(mode: str):
+    """
+    ### Creates the unique index on `uid` in the articles collection (no-op if it already exists).
+    """
+    get_collection(mode).create_index("uid", unique=True, name="uid_unique")
+
+
+def read_push_checkpoint(checkpoint_file_path: str = PUSH_CHECKPOINT_FILE_PATH) -> int:
+    """
+    ### Returns the number of articles already pushed from the current source (0 if there is no checkpoint).
+    """
+    if not os.path.exists(checkpoint_file_path):
+        return 0
+    with open(checkpoint_file_path, "r") as file:
+        return json.load(file).get("offset", 0)
+
+
+def write_push_checkpoint(offset: int, checkpoint_file_path: str = PUSH_CHECKPOINT_FILE_PATH):
+    temp_path = f"{checkpoint_file_path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump({"offset": offset}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, checkpoint_file_path)
+
+
+def clear_push_checkpoint(checkpoint_file_path: str = PUSH_CHECKPOINT_FILE_PATH):
+    if os.path.exists(checkpoint_file_path):
+        os.remove(checkpoint_file_path)
+
+
+def _upsert_chunk(collection, chunk: List[dict]) -> Dict[int, int]:
+    """
+    ### Upserts a chunk of article documents by `uid` in one unordered bulk_write.
+    #### Returns:
+    - Dict[int, int]: {position in {chunk}: write error code} of the documents that failed to upsert
+    """
+    operations = []
+    for document in chunk:
+        fields = {name: value for name, value in document.items() if name != "_id"}
+        operations.append(UpdateOne({"uid": document["uid"]}, {"$set": fields}, upsert=True))
+    started_at = time.perf_counter()
+    outcome = "success"
+    failed_indexes = {}
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as error:
+        outcome = "partial"
+        for write_error in error.details.get("writeErrors", []):
+            failed_indexes[write_error["index"]] = write_error.get("code")
+            document = chunk[write_error["index"]]
+            print(f"[database] Failed to push article `{document.get('uid')}`: {write_error.get('errmsg')}")
+    metrics.get_metrics().record_call(model="mongodb", stage="db", latency_seconds=time.perf_counter() - started_at, outcome=outcome)
+    return failed_indexes
+
+
+def _upsert_chunk_with_retries(collection, chunk: List[dict], max_retries: int = PUSH_MAX_RETRIES) -> List[dict]:
+    """
+    ### Upserts a chunk, retrying the throttled documents with exponential backoff.
+    #### Returns:
+    - List[dict]: Documents that still failed (throttled after every retry, or with another write error)
+    """
+    failed = []
+    pending = chunk
+    for attempt in range(max_retries + 1):
+        failed_indexes = _upsert_chunk(collection, pending)
+        retryable = [pending[index] for index, code in failed_indexes.items() if code in RETRYABLE_WRITE_ERROR_CODES]
+        failed.extend(pending[index] for index, code in failed_indexes.items() if code not in RETRYABLE_WRITE_ERROR_CODES)
+        if len(retryable) == 0:
+            return failed
+        if attempt == max_retries:
+            break
+        delay = PUSH_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)
+        print(f"[database] {len(retryable)} upserts throttled. Retrying in {delay:.1f}s.")
+        time.sleep(delay)
+        pending = retryable
+    return failed + retryable
+
+
+def upsert_articles(
+    mode: str,
+    articles: Iterable[Union[Article, dict]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    failed_documents: Optional[List[dict]] = None
+    ) -> int:
+    """
+    ### Idempotently upserts articles by `uid`, without a checkpoint (e.g. a queue worker writing its results).
+    Throttled upserts are retried with backoff. Documents that still fail are added to {failed_documents}.
+    #### Returns:
+    - int: Number of articles upserted
+    """
+    collection = get_collection(mode)
+    upserted_count = 0
+    for chunk in chunked((_to_document(article) for article in articles), chunk_size):
+        failed = _upsert_chunk_with_retries(collection, chunk)
+        upserted_count += len(chunk) - len(failed)
+        if failed_documents is not None:
+            failed_documents.extend(failed)
+    return upserted_count
+
+
+def push_articles_to_db(
+    mode: str,
+    articles: Iterable[Union[Article, dict]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    checkpoint_file_path: str = PUSH_CHECKPOINT_FILE_PATH,
+    failed_documents: Optional[List[dict]] = None
+    ) -> int:
+    """
+    ### Idempotently push articles to the database.
+    - Every article is upserted by `uid` (backed by a unique index), so pushing the same article twice
+      never creates a duplicate.
+    - Throttled upserts are retried with backoff. Documents that still fail are not counted as pushed and
+      are added to {failed_documents}, for the caller to keep (e.g. write back to the journal).
+    - The offset of the last pushed chunk is checkpointed, so an interrupted push resumes where it stopped.
+      The checkpoint stops moving at the first chunk with a failed document, so a crash before the caller
+      kept the failures pushes them again. Call `clear_push_checkpoint` once the source of {articles} has
+      been emptied (or replaced by the failed documents). Compacting the journal also removes it.
+    #### Args:
+    - mode (str): The mode to run the database in (dev, prod, testing).
+    - articles (Iterable[Article | dict]): Articles to push, in a stable order (e.g. a journal). Can be a generator.
+    - chunk_size (int): Number of upserts per bulk_write call.
+    - checkpoint_file_path (str): Path of the checkpoint file.
+    - failed_documents (list): Optional list the documents that failed to upsert are appended to.
+    #### Returns:
+    - int: Number of articles pushed in this call.
+    """
+    ensure_article_indexes(mode)
+    collection = get_collection(mode)
+    
+    offset = read_push_checkpoint(checkpoint_file_path)
+    if offset > 0:
+        print(f"Resuming push from checkpoint: skipping {offset} already pushed articles.")
+    
+    pushed_count = 0
+    failed_count = 0
+    documents = (_to_document(article) for article in islice(articles, offset, None))
+    for chunk in chunked(documents, chunk_size):
+        failed = _upsert_chunk_with_retries(collection, chunk)
+        pushed_count += len(chunk) - len(failed)
+        if failed_documents is not None:
+            failed_documents.extend(failed)
+        if failed_count == 0 and len(failed) == 0:
+            offset += len(chunk)
+            write_push_checkpoint(offset, checkpoint_file_path)
+        failed_count += len(failed)
+    
+    print(f"""
+    -----------------------------------
+    ->>> Database push
+    - Pushed {pushed_count} articles to the database (checkpoint at {offset}).
+    - Failed to push {failed_count} articles.
     -----------------------------------
     """
     )
     
-    return True
\ No newline at end of file
+    return pushed_count
+
+
+_SINK_CLOSE = object()
+
+
+class ArticleSink:
+    """
+    ### Write-behind sink: upserts finished articles in the background while generation goes on.
+    - `put` queues an article. The queue is bounded: when the database falls behind, `put` blocks
+      until there is room again (backpressure).
+    - A background thread upserts the queued articles (by `uid`) in batches of {flush_size}, or whatever
+      has been queued after {flush_interval_seconds}.
+    - A batch that fails (e.g. the database is unreachable) is retried with exponential backoff. Articles
+      that still couldn't be written end up in `failed_articles`.
+    - `close` (or leaving the `with` block) writes everything still queued and stops the thread.
+    #### Args:
+    - mode (str): The mode to run the database in (dev, prod, testing).
+    - max_queue_size (int): Maximum number of articles waiting to be written
+    - flush_size (int): Number of articles per batch
+    - flush_interval_seconds (float): Longest time an article waits for its batch to fill up
+    """
+    def __init__(
+        self,
+        mode: str,
+        max_queue_size: int = SINK_MAX_QUEUE_SIZE,
+        flush_size: int = SINK_FLUSH_SIZE,
+        flush_interval_seconds: float = SINK_FLUSH_INTERVAL_SECONDS
+        ):
+        self.mode = mode
+        self.flush_size = max(1, flush_size)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.written_count = 0
+        self.failed_articles: List[Union[Article, dict]] = []
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_queue_size))
+        self._thread = threading.Thread(target=self._run, name="article-sink", daemon=True)
+        self._closed = False
+
+    def start(self) -> "ArticleSink":
+        ensure_article_indexes(self.mode)
+        self._thread.start()
+        return self
+
+    def put(self, article: Union[Article, dict]):
+        """
+        ### Queues an article to be written. Blocks while the queue is full.
+        """
+        if self._closed:
+            raise RuntimeError("The article sink is closed.")
+        self._queue.put(article)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_seconds
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _SINK_CLOSE:
+                break
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.flush_size or time.monotonic() >= deadline:
+                if batch:
+                    self._flush(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval_seconds
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch: List[Union[Article, dict]]):
+        documents = [_to_document(article) for article in batch]
+        for attempt in range(SINK_MAX_RETRIES + 1):
+            try:
+                failed_indexes = _upsert_chunk(get_collection(self.mode), documents)
+            except Exception as error:
+                if not isinstance(error, PyMongoError) or attempt == SINK_MAX_RETRIES:
+                    print(f"[database] Failed to write {len(batch)} articles: {error}")
+                    self.failed_articles.extend(batch)
+                    return
+                delay = SINK_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)
+                print(f"[database] Failed to write {len(batch)} articles ({error}). Retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+            self.written_count += len(batch) - len(failed_indexes)
+            self.failed_articles.extend(batch[index] for index in failed_indexes)
+            return
+
+    def close(self):
+        """
+        ### Writes every queued article, then stops the background thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(_SINK_CLOSE)
+            self._thread.join()
+        print(f"[database] Article sink closed: wrote {self.written_count} articles, {len(self.failed_articles)} failed.")
+
+    def __enter__(self) -> "ArticleSink":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# ------------------------------
+# Repair
+# ------------------------------
+def ensure_repair_indexes(mode: str):
+    """
+    ### Creates one partial index per localized field, holding only the articles where the field is empty
+    (no-op if they exist). They stay tiny, and let `empty_localized_query` run as indexed scans.
+    """
+    collection = get_collection(mode)
+    for name in LOCALIZED_FIELD_NAMES:
+        collection.create_index(name, name=f"{name}_empty", partialFilterExpression={name: ""})
+
+
+def empty_localized_query() -> dict:
+    """
+    ### Matches the articles with at least one empty localized field.
+    """
+    return {"$or": [{name: ""} for name in LOCALIZED_FIELD_NAMES]}
+
+
+def regenerate_missing_fields(document: dict, model: Optional[str] = None) -> Dict[str, str]:
+    """
+    ### Regenerates the empty localized fields of an article document.
+    - Empty origin locale fields are restored from the top level fields. Empty content is generated again.
+    - Every other empty field is translated from the origin locale, in one request per group of locales
+      missing the same fields.
+    #### Args:
+    - document (dict): Article document (see Article.to_dict)
+    - model (str): Model to use instead of the article's own content and translation models
+    #### Returns:
+    - dict: {field name: new value} of the fields that could be regenerated
+    """
+    # Imported here: the generation modules need the inference client, the rest of this module doesn't
+    from generation import content_generation
+    from generation import translations
+
+    origin_locale = document["origin_locale"]
+    style = document.get("style_or_source")
+    updates: Dict[str, str] = {}
+
+    # Source texts, in the origin locale
+    source = {}
+    for field in LOCALIZED_TEXT_FIELDS:
+        name = f"localized_{field}_{origin_locale}"
+        source[field] = document.get(name) or document.get(field) or ""
+        if document.get(name) == "" and source[field] != "":
+            updates[name] = source[field]
+    if source["content"] == "" and source["headline"] != "":
+        content = content_generation.generate_content(
+            origin_locale=origin_locale,
+            style=style,
+            headline=source["headline"],
+            detail=source["detail"],
+            is_fake=document.get("is_fake"),
+            fake_detail=source["detail"],
+            model=model or document.get("content_model_used")
+        )
+        if content != "":
+            source["content"] = content
+            updates["content"] = content
+            updates[f"localized_content_{origin_locale}"] = content
+
+    # Group the target locales by the fields they are missing
+    missing_by_fields: Dict[tuple, List[str]] = {}
+    for locale in supported_locales:
+        if locale == origin_locale:
+            continue
+        fields = tuple(
+            field for field in LOCALIZED_TEXT_FIELDS
+            if document.get(f"localized_{field}_{locale}") == "" and source[field] != ""
+        )
+        if fields:
+            missing_by_fields.setdefault(fields, []).append(locale)
+
+    for fields, locales in missing_by_fields.items():
+        translated = translations.translate_all(
+            texts={field: source[field] for field in fields},
+            source_locale=origin_locale,
+            target_locales=locales,
+            news_outlet_style=style,
+            model=model or document.get("translation_model_used")
+        )
+        for locale, texts in translated.items():
+            for field, text in texts.items():
+                if text:
+                    updates[f"localized_{field}_{locale}"] = text
+    return updates
+
+
+def _write_repairs(collection, operations: List[UpdateOne], documents: List[dict], max_retries: int = PUSH_MAX_RETRIES) -> set:
+    """
+    ### Writes the repaired fields of a page ({operations}, one per document of {documents}) in one unordered
+    bulk_write, retrying throttled updates with backoff.
+    #### Returns:
+    - set: Positions (in {operations}) of the updates that failed
+    """
+    failed_indexes = set()
+    pending = list(range(len(operations)))
+    for attempt in range(max_retries + 1):
+        if len(pending) == 0:
+            break
+        started_at = time.perf_counter()
+        outcome = "success"
+        retryable = []
+        try:
+            collection.bulk_write([operations[index] for index in pending], ordered=False)
+        except BulkWriteError as error:
+            outcome = "partial"
+            for write_error in error.details.get("writeErrors", []):
+                index = pending[write_error["index"]]
+                if write_error.get("code") in RETRYABLE_WRITE_ERROR_CODES and attempt < max_retries:
+                    retryable.append(index)
+                else:
+                    failed_indexes.add(index)
+                    print(f"[database] Failed to write the repair of article `{documents[index].get('uid')}`: {write_error.get('errmsg')}")
+        except PyMongoError as error:
+            outcome = "error"
+            print(f"[database] Failed to write {len(pending)} repairs: {error}")
+            failed_indexes.update(pending)
+        metrics.get_metrics().record_call(model="mongodb", stage="db", latency_seconds=time.perf_counter() - started_at, outcome=outcome)
+        pending = retryable
+        if pending:
+            delay = PUSH_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)
+            print(f"[database] {len(pending)} repair writes throttled. Retrying in {delay:.1f}s.")
+            time.sleep(delay)
+    return failed_indexes
+
+
+def repair_empty_localized_fields(
+    mode: str,
+    model: Optional[str] = None,
+    max_workers: int = REPAIR_MAX_WORKERS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    limit: Optional[int] = None
+    ) -> Dict[str, int]:
+    """
+    ### Finds the articles with empty localized fields and fills in only those fields.
+    - The broken articles are found with a single query (see `empty_localized_query`), backed by the
+      partial indexes of `ensure_repair_indexes`.
+    - Articles are read in pages of {chunk_size} (by `_id`), so no cursor stays open during model calls.
+    - Articles are repaired {max_workers} at a time, and the regenerated fields of every page are written
+      with one bulk_write (`$set` of just those fields). Throttled writes are retried, and articles whose
+      write still fails are counted as failed.
+    - Progress and throughput are printed after every chunk.
+    #### Args:
+    - mode (str): The mode to run the database in (dev, prod, testing).
+    - model (str): Model to use instead of each article's own content and translation models
+    - max_workers (int): Number of articles repaired at the same time
+    - chunk_size (int): Number of articles per bulk_write call
+    - limit (int): Repair at most this many articles
+    #### Returns:
+    - dict: Counts of articles found, repaired (every field), partially repaired, failed, and of fields filled
+    """
+    ensure_repair_indexes(mode)
+    collection = get_collection(mode)
+
+    counts = {"found": 0, "repaired": 0, "partial": 0, "failed": 0, "fields": 0}
+    started_at = time.perf_counter()
+    last_id = None
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while limit is None or counts["found"] < limit:
+            # Each chunk is read in full before its model calls, so no cursor stays open while they run
+            page_size = chunk_size if limit is None else min(chunk_size, limit - counts["found"])
+            query = empty_localized_query()
+            if last_id is not None:
+                query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+            chunk = list(collection.find(query).sort("_id", ASCENDING).limit(page_size))
+            if len(chunk) == 0:
+                break
+            last_id = chunk[-1]["_id"]
+
+            futures = [executor.submit(regenerate_missing_fields, document, model) for document in chunk]
+            operations = []
+            repaired_documents = []
+            outcomes = []
+            for document, future in zip(chunk, futures):
+                counts["found"] += 1
+                try:
+                    updates = future.result()
+                except Exception as error:
+                    print(f"[database] Failed to repair article `{document.get('uid')}`: {type(error).__name__}: {error}")
+                    counts["failed"] += 1
+                    continue
+                empty_count = sum(1 for name in LOCALIZED_FIELD_NAMES if document.get(name) == "")
+                filled_count = sum(1 for name in LOCALIZED_FIELD_NAMES if name in updates)
+                if filled_count == 0:
+                    counts["failed"] += 1
+                    continue
+                operations.append(UpdateOne({"_id": document["_id"]}, {"$set": updates}))
+                repaired_documents.append(document)
+                outcomes.append(("repaired" if filled_count >= empty_count else "partial", filled_count))
+
+            failed_indexes = _write_repairs(collection, operations, repaired_documents)
+            for index, (outcome, filled_count) in enumerate(outcomes):
+                if index in failed_indexes:
+                    counts["failed"] += 1
+                    continue
+                counts[outcome] += 1
+                counts["fields"] += filled_count
+
+            elapsed = max(time.perf_counter() - started_at, 1e-9)
+            print(
+                f"[database] Repair: {counts['found']} articles checked, {counts['repaired']} repaired, "
+                f"{counts['partial']} partially, {counts['failed']} failed, {counts['fields']} fields filled "
+                f"({counts['found'] / elapsed:.2f} articles/s, {counts['fields'] / elapsed:.2f} fields/s)."
+            )
+
+    elapsed = time.perf_counter() - started_at
+    print(f"""
+    -----------------------------------
+    ->>> Database repair
+    - Checked {counts["found"]} articles with empty localized fields in {elapsed:.1f}s.
+    - Repaired {counts["repaired"]} articles, {counts["partial"]} partially, {counts["failed"]} failed.
+    - Filled {counts["fields"]} fields.
+    -----------------------------------
+    """
+    )
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    repair_parser = subparsers.add_parser("repair", help="Regenerate the empty localized fields of stored articles")
+    repair_parser.add_argument("--mode", default="testing", choices=["dev", "prod", "testing"])
+    repair_parser.add_argument("--model", default=None, help="Model to use instead of each article's own models")
+    repair_parser.add_argument("--workers", type=int, default=REPAIR_MAX_WORKERS)
+    repair_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    repair_parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "repair":
+            run_metrics = metrics.reset_metrics()
+            repair_empty_localized_fields(args.mode, args.model, args.workers, args.chunk_size, args.limit)
+            run_metrics.export()
+    finally:
+        close_mongo_client()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,134 @@
+'''
+Headline index util module. A local similarity index over previously generated headlines, used to
+find near-duplicates and to pick a small, relevant sample of past headlines for prompts.
+
+Candidates are found through an inverted word index (IDF weighted), and near-duplicates are confirmed
+with the Jaccard similarity of character n-grams.
+'''
+
+import re
+import math
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+# Character n-gram size used for near-duplicate checks
+SHINGLE_SIZE = 4
+# Jaccard similarity (of character n-grams) above which two headlines are near-duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.6
+# Number of best word-index candidates checked for near-duplicates
+MAX_CANDIDATES = 50
+# Words shorter than this aren't indexed
+MIN_WORD_LENGTH = 3
+# Words present in more than this share of headlines are too common to find candidates with
+MAX_DOCUMENT_FREQUENCY_RATIO = 0.1
+
+_word_pattern = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """
+    ### Lowercases, strips accents and punctuation and collapses whitespace.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    return " ".join(_word_pattern.findall(text))
+
+
+def words(normalized_text: str) -> Set[str]:
+    return {word for word in normalized_text.split(" ") if len(word) >= MIN_WORD_LENGTH}
+
+
+def shingles(normalized_text: str) -> Set[str]:
+    if len(normalized_text) <= SHINGLE_SIZE:
+        return {normalized_text}
+    return {normalized_text[i:i + SHINGLE_SIZE] for i in range(len(normalized_text) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class HeadlineIndex:
+    """
+    ### Thread-safe similarity index over headlines.
+    #### Args:
+    - headlines (Iterable[str]): Headlines to index up front
+    """
+    def __init__(self, headlines: Optional[Iterable[str]] = None):
+        self._headlines: List[str] = []
+        self._normalized: List[str] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._seen: Set[str] = set()
+        self._lock = threading.Lock()
+        for headline in headlines or []:
+            self.add(headline)
+
+    def __len__(self):
+        return len(self._headlines)
+
+    def add(self, headline: str) -> bool:
+        """
+        ### Adds a headline to the index. Exact (normalized) repeats are ignored.
+        #### Returns:
+        - bool: True if the headline was added
+        """
+        normalized = normalize(headline or "")
+        if normalized == "":
+            return False
+        with self._lock:
+            if normalized in self._seen:
+                return False
+            self._seen.add(normalized)
+            headline_id = len(self._headlines)
+            self._headlines.append(headline.strip())
+            self._normalized.append(normalized)
+            for word in words(normalized):
+                self._postings[word].append(headline_id)
+        return True
+
+    def _ranked_candidates(self, normalized_query: str, limit: int) -> List[int]:
+        total = len(self._headlines)
+        max_document_frequency = max(50, int(total * MAX_DOCUMENT_FREQUENCY_RATIO))
+        scores: Dict[int, float] = defaultdict(float)
+        for word in words(normalized_query):
+            posting = self._postings.get(word)
+            if not posting or len(posting) > max_document_frequency:
+                continue
+            idf = math.log(1 + total / len(posting))
+            for headline_id in posting:
+                scores[headline_id] += idf
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    def find_near_duplicate(self, headline: str, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> Optional[str]:
+        """
+        ### Returns an indexed headline that is a near-duplicate of {headline}, or None.
+        """
+        normalized = normalize(headline or "")
+        if normalized == "":
+            return None
+        with self._lock:
+            if normalized in self._seen:
+                return headline
+            query_shingles = shingles(normalized)
+            for headline_id in self._ranked_candidates(normalized, MAX_CANDIDATES):
+                if jaccard(query_shingles, shingles(self._normalized[headline_id])) >= threshold:
+                    return self._headlines[headline_id]
+        return None
+
+    def most_similar(self, query: str, k: int) -> List[str]:
+        """
+        ### Returns (up to) the {k} indexed headlines most related to {query}, best match first.
+        """
+        with self._lock:
+            return [self._headlines[headline_id] for headline_id in self._ranked_candidates(normalize(query), k)]
+
+    def recent(self, k: int) -> List[str]:
+        """
+        ### Returns the {k} most recently indexed headlines.
+        """
+        with self._lock:
+            return self._headlines[-k:] if k > 0 else []
@@ -0,0 +1,308 @@
+'''
+Job queue util module. A MongoDB backed queue of planned article jobs, shared by any number of generator
+processes on any number of machines (see generation/queue_worker).
+
+- Jobs are claimed atomically (find_one_and_update) with a lease, which the worker keeps renewing while
+  the job runs. The job of a worker that died is claimed again by another worker once its lease expired.
+- Every job carries the uid of its article, and articles are upserted by uid, so a job that ends up running
+  twice still produces a single article.
+- Accepted headlines are registered in a shared collection (unique on the normalized headline), so workers
+  don't repeat each other's headlines. Workers re-read a window of recent registrations on every sync,
+  since registrations from other machines don't arrive in `_id` order.
+'''
+
+import os
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from utils import database
+from utils.headline_index import HeadlineIndex, NEAR_DUPLICATE_THRESHOLD, normalize
+from utils.misc import chunked, generate_unique_id
+
+collection_name_jobs = "article_jobs"
+collection_name_headlines = "headline_registry"
+
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+# A claimed job goes back to the queue if its lease isn't renewed for this long
+DEFAULT_LEASE_SECONDS = 300
+# How often a worker renews the leases of its running jobs
+HEARTBEAT_INTERVAL_SECONDS = 60
+# Attempts (claims) after which a job is marked as failed
+MAX_JOB_ATTEMPTS = 3
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def get_jobs_collection(mode: str):
+    return database.get_collection(mode, collection_name_jobs)
+
+
+def ensure_job_indexes(mode: str):
+    """
+    ### Creates the indexes used to claim jobs and the unique index of the headline registry (no-op if they exist).
+    """
+    jobs = get_jobs_collection(mode)
+    jobs.create_index([("status", ASCENDING), ("priority", ASCENDING)], name="status_priority")
+    jobs.create_index([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease")
+    jobs.create_index([("plan_id", ASCENDING), ("status", ASCENDING)], name="plan_status")
+    database.get_collection(mode, collection_name_headlines).create_index("normalized", unique=True, name="normalized_unique")
+
+
+def make_job(locale: str, style: str, is_fake: bool, model: str) -> dict:
+    """
+    ### A single article job: which locale, outlet style, fake/real and headline model to generate it with.
+    """
+    return {"locale": locale, "style": style, "is_fake": is_fake, "model": model}
+
+
+def enqueue_jobs(mode: str, plan_id: str, jobs: Iterable[dict], chunk_size: int = database.DEFAULT_CHUNK_SIZE) -> int:
+    """
+    ### Adds the jobs of a plan to the queue.
+    Job ids are `{plan_id}:{position}`, so enqueueing the same plan again doesn't add anything.
+    #### Args:
+    - mode (str): The mode to run the database in (dev, prod, testing).
+    - plan_id (str): Id of the plan the jobs belong to
+    - jobs (Iterable[dict]): Jobs (see make_job), in the order they should run
+    - chunk_size (int): Number of upserts per bulk_write call
+    #### Returns:
+    - int: Number of newly added jobs
+    """
+    ensure_job_indexes(mode)
+    collection = get_jobs_collection(mode)
+    created_at = _now()
+    added_count = 0
+    for chunk in chunked(enumerate(jobs), chunk_size):
+        operations = []
+        for position, job in chunk:
+            document = dict(job)
+            document.update({
+                "plan_id": plan_id,
+                "priority": position,
+                "uid": generate_unique_id(),
+                "status": JOB_STATUS_PENDING,
+                "attempts": 0,
+                "worker_id": None,
+                "lease_expires_at": None,
+                "created_at": created_at,
+            })
+            operations.append(UpdateOne({"_id": f"{plan_id}:{position}"}, {"$setOnInsert": document}, upsert=True))
+        added_count += collection.bulk_write(operations, ordered=False).upserted_count
+    return added_count
+
+
+def claim_job(
+    mode: str,
+    worker_id: str,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    plan_id: Optional[str] = None,
+    max_attempts: int = MAX_JOB_ATTEMPTS
+    ) -> Optional[dict]:
+    """
+    ### Atomically claims the next pending job (or a running job whose lease expired).
+    Jobs that were already claimed {max_attempts} times are marked as failed instead of being run again.
+    #### Returns:
+    - dict: The claimed job, or None if the queue is empty
+    """
+    collection = get_jobs_collection(mode)
+    while True:
+        now = _now()
+        query = {"$or": [
+            {"status": JOB_STATUS_PENDING},
+            {"status": JOB_STATUS_RUNNING, "lease_expires_at": {"$lt": now}},
+        ]}
+        if plan_id is not None:
+            query["plan_id"] = plan_id
+        job = collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": JOB_STATUS_RUNNING,
+                    "worker_id": worker_id,
+                    "claimed_at": now,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None or job["attempts"] <= max_attempts:
+            return job
+        fail_job(mode, job, worker_id, "Lease expired too many times.", max_attempts)
+
+
+def renew_leases(mode: str, worker_id: str, job_ids: List[str], lease_seconds: float = DEFAULT_LEASE_SECONDS) -> int:
+    """
+    ### Extends the leases of the given running jobs, if they are still held by {worker_id}.
+    #### Returns:
+    - int: Number of renewed leases
+    """
+    if len(job_ids) == 0:
+        return 0
+    result = get_jobs_collection(mode).update_many(
+        {"_id": {"$in": job_ids}, "worker_id": worker_id, "status": JOB_STATUS_RUNNING},
+        {"$set": {"lease_expires_at": _now() + timedelta(seconds=lease_seconds)}},
+    )
+    return result.matched_count
+
+
+def complete_job(mode: str, job: dict, worker_id: str) -> bool:
+    """
+    ### Marks a job as done (even if its lease was lost in the meantime: its article is already stored).
+    #### Returns:
+    - bool: False if the job was already done
+    """
+    result = get_jobs_collection(mode).update_one(
+        {"_id": job["_id"], "status": {"$ne": JOB_STATUS_DONE}},
+        {"$set": {"status": JOB_STATUS_DONE, "worker_id": worker_id, "completed_at": _now(), "lease_expires_at": None}},
+    )
+    return result.matched_count == 1
+
+
+def fail_job(mode: str, job: dict, worker_id: str, error: str, max_attempts: int = MAX_JOB_ATTEMPTS) -> str:
+    """
+    ### Puts a failed job back in the queue, or marks it as failed once it ran out of attempts.
+    Does nothing if the job is no longer held by {worker_id}.
+    #### Returns:
+    - str: The new status of the job
+    """
+    status = JOB_STATUS_FAILED if job["attempts"] >= max_attempts else JOB_STATUS_PENDING
+    get_jobs_collection(mode).update_one(
+        {"_id": job["_id"], "worker_id": worker_id, "status": JOB_STATUS_RUNNING},
+        {"$set": {"status": status, "error": error, "lease_expires_at": None}},
+    )
+    return status
+
+
+def queue_stats(mode: str, plan_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    ### Number of jobs by status (of a single plan, if given).
+    """
+    pipeline = []
+    if plan_id is not None:
+        pipeline.append({"$match": {"plan_id": plan_id}})
+    pipeline.append({"$group": {"_id": "$status", "count": {"$sum": 1}}})
+    stats = {status: 0 for status in (JOB_STATUS_PENDING, JOB_STATUS_RUNNING, JOB_STATUS_DONE, JOB_STATUS_FAILED)}
+    for row in get_jobs_collection(mode).aggregate(pipeline):
+        stats[row["_id"]] = row["count"]
+    return stats
+
+
+class LeaseKeeper:
+    """
+    ### Background heartbeat renewing the leases of the jobs a worker is running, in one update per beat.
+    #### Args:
+    - mode (str): The mode to run the database in (dev, prod, testing).
+    - worker_id (str): Id of the worker holding the jobs
+    - lease_seconds (float): Lease duration set on every renewal
+    - interval_seconds (float): Time between renewals (must be well below {lease_seconds})
+    """
+    def __init__(self, mode: str, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS, interval_seconds: float = HEARTBEAT_INTERVAL_SECONDS):
+        self.mode = mode
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.interval_seconds = interval_seconds
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def hold(self, job_id: str):
+        with self._lock:
+            self._held.add(job_id)
+
+    def release(self, job_id: str):
+        with self._lock:
+            self._held.discard(job_id)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            with self._lock:
+                job_ids = list(self._held)
+            try:
+                renewed = renew_leases(self.mode, self.worker_id, job_ids, self.lease_seconds)
+            except Exception as error:
+                print(f"[job_queue] Failed to renew leases: {error}")
+                continue
+            if renewed < len(job_ids):
+                print(f"[job_queue] Lost the lease of {len(job_ids) - renewed} job(s).")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+class SharedHeadlineIndex(HeadlineIndex):
+    """
+    ### Headline index shared between workers through the headline registry collection.
+    - Near-duplicate checks first pull the headlines other workers registered since the last check.
+    - Adding a headline registers it. If another worker registered the same (normalized) headline first,
+      it isn't added and the caller has to come up with another one.
+    #### Args:
+    - mode (str): The mode to run the database in (dev, prod, testing).
+    - headlines (Iterable[str]): Past headlines to index locally (they aren't registered)
+    """
+    def __init__(self, mode: str, headlines: Optional[Iterable[str]] = None):
+        super().__init__()
+        self.mode = mode
+        self._last_id = None
+        self._sync_lock = threading.Lock()
+        for headline in headlines or []:
+            super().add(headline)
+        self.sync()
+
+    def _registry(self):
+        return database.get_collection(self.mode, collection_name_headlines)
+
+    def sync(self) -> int:
+        """
+        ### Indexes the headlines registered since the last sync.
+        ObjectIds are made by each worker, so a registration can land behind the newest `_id` already
+        seen. Every sync re-reads the last database.SYNC_OVERLAP_SECONDS before it (headlines already
+        indexed are skipped by the index).
+        #### Returns:
+        - int: Number of registry entries read
+        """
+        with self._sync_lock:
+            count = 0
+            for document in self._registry().find(database.since_id_query(self._last_id), {"headline": 1}).sort("_id", ASCENDING):
+                super().add(document["headline"])
+                if self._last_id is None or document["_id"] > self._last_id:
+                    self._last_id = document["_id"]
+                count += 1
+            return count
+
+    def find_near_duplicate(self, headline: str, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> Optional[str]:
+        self.sync()
+        return super().find_near_duplicate(headline, threshold)
+
+    def add(self, headline: str) -> bool:
+        normalized = normalize(headline or "")
+        if normalized == "":
+            return False
+        try:
+            self._registry().insert_one({"normalized": normalized, "headline": headline.strip(), "created_at": _now()})
+        except DuplicateKeyError:
+            super().add(headline)
+            return False
+        return super().add(headline)
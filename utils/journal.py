@@ -0,0 +1,147 @@
+'''
+Journal util module. Append-only JSONL files used to store generated data: every record is one line,
+appends are fsync'd, and a compaction step rewrites the file atomically.
+
+Usage (compaction):
+    python -m utils.journal compact data/generated_articles.jsonl --key uid
+'''
+
+import os
+import sys
+import argparse
+import threading
+from typing import Callable, Iterable, Iterator, Optional
+
+from utils import serialization
+
+_append_lock = threading.Lock()
+
+
+def append_records(path: str, records: Iterable[dict]) -> int:
+    """
+    ### Appends records to a journal (one JSON object per line) and fsyncs the file.
+    #### Args:
+    - path (str): Path of the journal file. Created if it doesn't exist.
+    - records (Iterable[dict]): Records to append
+    #### Returns:
+    - int: Number of records appended
+    """
+    lines = [serialization.dumps(record) + "\n" for record in records]
+    record_count = len(lines)
+    if record_count == 0:
+        return 0
+    with _append_lock:
+        with open(path, "a+b") as file:
+            # Start on a fresh line if the last write was cut short
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    lines.insert(0, "\n")
+            file.write("".join(lines).encode("utf-8"))
+            file.flush()
+            os.fsync(file.fileno())
+    return record_count
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    ### Streams the records of a journal.
+    - A missing journal is treated as empty.
+    - Lines that can't be parsed (e.g. a write cut short by a crash) are skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                yield serialization.loads(line)
+            except ValueError:
+                print(f"[journal] Skipping unreadable line {line_number} in {path}.")
+
+
+def count_records(path: str) -> int:
+    return sum(1 for _ in read_records(path))
+
+
+def _write_atomically(path: str, records: Iterable[dict]) -> int:
+    temp_path = f"{path}.tmp"
+    count = 0
+    with open(temp_path, "w", encoding="utf-8") as file:
+        for record in records:
+            file.write(serialization.dumps(record) + "\n")
+            count += 1
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return count
+
+
+def compact(path: str, key: Optional[Callable[[dict], object]] = None, offset_checkpoint_path: Optional[str] = None) -> int:
+    """
+    ### Rewrites a journal without unreadable lines (and duplicates, if {key} is given).
+    The new file is written next to the old one and swapped in atomically. Dropping lines shifts the
+    position of every later record, so a checkpoint holding an offset into the journal (e.g. the push
+    checkpoint of utils/database) no longer points at the right record: it is removed, and whatever
+    reads from it starts over from the first record.
+    #### Args:
+    - path (str): Path of the journal file
+    - key (callable): Returns the identity of a record. The last record with a given identity wins.
+    - offset_checkpoint_path (str): Path of a checkpoint file holding an offset into the journal
+    #### Returns:
+    - int: Number of records left in the journal
+    """
+    with _append_lock:
+        if key is None:
+            records = list(read_records(path))
+        else:
+            by_key = {}
+            for record in read_records(path):
+                by_key.pop(key(record), None)
+                by_key[key(record)] = record
+            records = list(by_key.values())
+        count = _write_atomically(path, records)
+        if offset_checkpoint_path is not None and os.path.exists(offset_checkpoint_path):
+            os.remove(offset_checkpoint_path)
+            print(f"[journal] Removed {offset_checkpoint_path}: its offset into {path} is no longer valid.")
+    print(f"[journal] Compacted {path} to {count} records.")
+    return count
+
+
+def rewrite(path: str, records: Iterable[dict]) -> int:
+    """
+    ### Atomically replaces the content of a journal with {records}.
+    #### Returns:
+    - int: Number of records written
+    """
+    with _append_lock:
+        return _write_atomically(path, records)
+
+
+def truncate(path: str):
+    """
+    ### Empties a journal.
+    """
+    rewrite(path, [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Journal utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Rewrite a journal without unreadable lines and duplicates")
+    compact_parser.add_argument("path")
+    compact_parser.add_argument("--key", default=None, help="Record field used to de-duplicate records")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        # Imported here: utils.database imports this module
+        from utils.database import PUSH_CHECKPOINT_FILE_PATH
+        key = (lambda record: record.get(args.key)) if args.key else None
+        # An interrupted push resumes from an offset into the articles journal. Re-pushing is safe (upserts by uid).
+        compact(args.path, key=key, offset_checkpoint_path=PUSH_CHECKPOINT_FILE_PATH)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,220 @@
+'''
+Metrics util module. Records every model and database call (model, stage, locale, tokens, latency, outcome)
+and exports a per-run summary as JSON and, optionally, in Prometheus text format.
+'''
+
+import os
+import json
+import math
+import time
+import threading
+from datetime import datetime
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+RUN_REPORTS_DIRECTORY = "data/run_reports"
+
+# Estimated price per 1M tokens: {model: (prompt, completion)} in USD
+MODEL_PRICES_PER_MILLION_TOKENS = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "Phi-3.5-mini-instruct": (0.13, 0.52),
+    "Phi-3-medium-4k-instruct": (0.17, 0.68),
+    "Mistral-large": (4.00, 12.00),
+    "Mistral-large-2407": (2.00, 6.00),
+    "Meta-Llama-3.1-405B-Instruct": (5.33, 16.00),
+    "Meta-Llama-3.1-70B-Instruct": (2.68, 3.54),
+    "Meta-Llama-3.1-8B-Instruct": (0.30, 0.61),
+}
+DEFAULT_PRICE_PER_MILLION_TOKENS = (1.00, 3.00)
+
+
+@dataclass
+class CallMetric:
+    '''
+    ### A single recorded call.
+    #### Attributes:
+    - model: str - Model (or backend, e.g. mongodb) that was called
+    - stage: str - Pipeline stage (headline, content, translation, db)
+    - locale: str - Locale the call worked on (if any)
+    - prompt_tokens: int - Prompt tokens reported by the endpoint
+    - completion_tokens: int - Completion tokens reported by the endpoint
+    - latency_seconds: float - Wall clock time of the call
+    - outcome: str - success, error, cache_hit, circuit_open, ...
+    - time_to_first_token_seconds: float - Time until the first streamed token (streamed calls only)
+    '''
+    model: str
+    stage: str
+    locale: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_seconds: float = 0.0
+    outcome: str = "success"
+    time_to_first_token_seconds: Optional[float] = None
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    ### Nearest-rank percentile of {values} (0 for an empty list).
+    """
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES_PER_MILLION_TOKENS.get(model, DEFAULT_PRICE_PER_MILLION_TOKENS)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class MetricsRecorder:
+    """
+    ### Thread-safe recorder for the calls of a run.
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self.calls: List[CallMetric] = []
+        self.article_count = 0
+        self._lock = threading.Lock()
+
+    def record_call(self, model: str, stage: str, locale: str = "", prompt_tokens: int = 0, completion_tokens: int = 0,
+                    latency_seconds: float = 0.0, outcome: str = "success", time_to_first_token_seconds: Optional[float] = None):
+        metric = CallMetric(
+            model=model,
+            stage=stage,
+            locale=locale or "",
+            prompt_tokens=prompt_tokens or 0,
+            completion_tokens=completion_tokens or 0,
+            latency_seconds=latency_seconds,
+            outcome=outcome,
+            time_to_first_token_seconds=time_to_first_token_seconds,
+        )
+        with self._lock:
+            self.calls.append(metric)
+
+    def record_article(self, count: int = 1):
+        with self._lock:
+            self.article_count += count
+
+    def summary(self) -> dict:
+        """
+        ### Per (model, stage) latency percentiles, token counts and estimated cost, plus run totals.
+        """
+        with self._lock:
+            calls = list(self.calls)
+            article_count = self.article_count
+
+        groups: Dict[tuple, List[CallMetric]] = defaultdict(list)
+        for call in calls:
+            groups[(call.model, call.stage)].append(call)
+
+        by_model_and_stage = []
+        total_prompt_tokens = 0
+        total_completion_tokens = 0
+        total_cost = 0.0
+        for (model, stage), group in sorted(groups.items()):
+            latencies = [call.latency_seconds for call in group if call.outcome != "cache_hit"]
+            first_token_latencies = [call.time_to_first_token_seconds for call in group if call.time_to_first_token_seconds is not None]
+            outcomes: Dict[str, int] = defaultdict(int)
+            for call in group:
+                outcomes[call.outcome] += 1
+            prompt_tokens = sum(call.prompt_tokens for call in group)
+            completion_tokens = sum(call.completion_tokens for call in group)
+            cost = estimate_cost(model, prompt_tokens, completion_tokens) if stage != "db" else 0.0
+            total_prompt_tokens += prompt_tokens
+            total_completion_tokens += completion_tokens
+            total_cost += cost
+            entry = {
+                "model": model,
+                "stage": stage,
+                "calls": len(group),
+                "outcomes": dict(outcomes),
+                "latency_p50_seconds": percentile(latencies, 50),
+                "latency_p95_seconds": percentile(latencies, 95),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "estimated_cost_usd": cost,
+            }
+            if len(first_token_latencies) > 0:
+                entry["time_to_first_token_p50_seconds"] = percentile(first_token_latencies, 50)
+                entry["time_to_first_token_p95_seconds"] = percentile(first_token_latencies, 95)
+            by_model_and_stage.append(entry)
+
+        per_article = max(article_count, 1)
+        model_calls = [call for call in calls if call.stage != "db" and call.outcome != "cache_hit"]
+        return {
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "duration_seconds": time.time() - self.started_at,
+            "articles": article_count,
+            "model_calls": len(model_calls),
+            "model_calls_per_article": len(model_calls) / per_article,
+            "prompt_tokens": total_prompt_tokens,
+            "completion_tokens": total_completion_tokens,
+            "tokens_per_article": (total_prompt_tokens + total_completion_tokens) / per_article,
+            "estimated_cost_usd": total_cost,
+            "estimated_cost_per_article_usd": total_cost / per_article,
+            "by_model_and_stage": by_model_and_stage,
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        ### Renders the summary in Prometheus text exposition format.
+        """
+        summary = self.summary()
+        lines = [
+            "# TYPE judge_gpt_articles_total counter",
+            f"judge_gpt_articles_total {summary['articles']}",
+            "# TYPE judge_gpt_estimated_cost_usd gauge",
+            f"judge_gpt_estimated_cost_usd {summary['estimated_cost_usd']}",
+        ]
+        metric_types = [
+            ("judge_gpt_calls_total", "counter", "calls"),
+            ("judge_gpt_prompt_tokens_total", "counter", "prompt_tokens"),
+            ("judge_gpt_completion_tokens_total", "counter", "completion_tokens"),
+            ("judge_gpt_latency_p50_seconds", "gauge", "latency_p50_seconds"),
+            ("judge_gpt_latency_p95_seconds", "gauge", "latency_p95_seconds"),
+        ]
+        for name, metric_type, key in metric_types:
+            lines.append(f"# TYPE {name} {metric_type}")
+            for entry in summary["by_model_and_stage"]:
+                labels = f'model="{entry["model"]}",stage="{entry["stage"]}"'
+                lines.append(f"{name}{{{labels}}} {entry[key]}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory: str = RUN_REPORTS_DIRECTORY, prometheus: bool = False) -> str:
+        """
+        ### Writes the run summary (and raw calls) to {directory} as JSON, and optionally as a Prometheus .prom file.
+        #### Returns:
+        - str: Path of the JSON report
+        """
+        os.makedirs(directory, exist_ok=True)
+        run_name = datetime.fromtimestamp(self.started_at).strftime("run_%Y%m%d_%H%M%S")
+        report_path = os.path.join(directory, f"{run_name}.json")
+        with self._lock:
+            calls = [asdict(call) for call in self.calls]
+        with open(report_path, "w") as file:
+            json.dump({"summary": self.summary(), "calls": calls}, file, indent=4)
+        if prometheus:
+            with open(os.path.join(directory, f"{run_name}.prom"), "w") as file:
+                file.write(self.to_prometheus())
+        print(f"Run report written to {report_path}.")
+        return report_path
+
+
+_metrics = MetricsRecorder()
+
+
+def get_metrics() -> MetricsRecorder:
+    return _metrics
+
+
+def reset_metrics() -> MetricsRecorder:
+    """
+    ### Starts a new run: replaces the shared recorder with an empty one.
+    """
+    global _metrics
+    _metrics = MetricsRecorder()
+    return _metrics
@@ -1,5 +1,6 @@
 import random
 import string
+from itertools import islice
 
 def generate_unique_id():
     """
@@ -10,3 +11,17 @@ def generate_unique_id():
     characters = string.ascii_letters + string.digits  # a-z, A-Z, 0-9
     unique_id = ''.join(random.choices(characters, k=12))
     return unique_id
+
+
+def chunked(iterable, size):
+    """
+    ### Split an iterable (or generator) into lists of at most {size} items.
+    #### Returns:
+    - Iterator[list]: Chunks of items
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
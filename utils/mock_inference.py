@@ -0,0 +1,239 @@
+'''
+Mock inference util module. A local stand-in for the ChatCompletionsClient endpoint, used to run the
+pipeline (and the benchmarks) without network access or credentials.
+
+It recognises the prompts of the headline, content and translation modules and answers them with
+templated responses, with configurable latency and 429 (rate limit) injection.
+
+Usage:
+    import azure_client
+    from utils.mock_inference import MockChatCompletionsClient, MockAsyncChatCompletionsClient
+    azure_client.set_client(MockChatCompletionsClient(latency_mean_seconds=0.2, rate_limit_probability=0.05))
+    azure_client.set_async_client(MockAsyncChatCompletionsClient(MockChatCompletionsClient(latency_mean_seconds=0.2)))
+'''
+
+import re
+import json
+import time
+import asyncio
+import random
+import threading
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+from azure.core.exceptions import HttpResponseError
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+# Words used to build unique headlines, details and content
+VOCABULARY = (
+    "global markets climate summit researchers discover ancient ocean satellite launch vaccine trial record "
+    "heatwave election reform startup funding orbit telescope species forest energy grid battery solar wind "
+    "festival museum archive painting orchestra novel fashion week cuisine harvest tourism railway airport "
+    "ministers treaty talks league final champion stadium athletes olympic marathon policy inflation currency "
+    "exports factory robots artificial intelligence chip quantum laboratory glacier drought river coral reef "
+    "volcano earthquake migration wildlife rescue scientists students universities history manuscript "
+    "discovery bridge tunnel city council budget housing prices wages workers union strike agreement deal"
+).split()
+
+
+class MockHttpResponse:
+    '''
+    Minimal HTTP response handed to HttpResponseError for injected 429s.
+    '''
+    def __init__(self, status_code: int, headers: dict):
+        self.status_code = status_code
+        self.reason = "Too Many Requests"
+        self.headers = headers
+
+    def text(self):
+        return json.dumps({"error": {"code": "RateLimitReached", "message": "Rate limit is exceeded."}})
+
+
+class MockStream:
+    '''
+    Iterable of streamed chat completion updates (one per word), like `StreamingChatCompletions`.
+    The last update carries the usage. `close` stops the stream early.
+    '''
+    def __init__(self, content: str, model: str, prompt_tokens: int, token_latency_seconds: float = 0.0):
+        self.content = content
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.token_latency_seconds = token_latency_seconds
+        self.streamed_characters = 0
+        self.closed = False
+
+    def __iter__(self):
+        chunks = re.findall(r"\s*\S+", self.content)
+        for chunk in chunks:
+            if self.closed:
+                return
+            if self.token_latency_seconds > 0:
+                time.sleep(self.token_latency_seconds)
+            self.streamed_characters += len(chunk)
+            yield SimpleNamespace(
+                model=self.model,
+                choices=[SimpleNamespace(index=0, finish_reason=None, delta=SimpleNamespace(role="assistant", content=chunk))],
+                usage=None,
+            )
+        completion_tokens = max(1, len(self.content) // 4)
+        yield SimpleNamespace(
+            model=self.model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop", delta=SimpleNamespace(role="assistant", content=None))],
+            usage=SimpleNamespace(prompt_tokens=self.prompt_tokens, completion_tokens=completion_tokens, total_tokens=self.prompt_tokens + completion_tokens),
+        )
+
+    def close(self):
+        self.closed = True
+
+
+def make_response(content: str, model: str, prompt_tokens: int):
+    completion_tokens = max(1, len(content) // 4)
+    return SimpleNamespace(
+        id=f"mock-{random.getrandbits(32):08x}",
+        model=model,
+        choices=[SimpleNamespace(index=0, finish_reason="stop", message=SimpleNamespace(role="assistant", content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens),
+    )
+
+
+class MockChatCompletionsClient:
+    """
+    ### Local stand-in for `ChatCompletionsClient`.
+    #### Args:
+    - latency_mean_seconds (float): Mean latency of a call
+    - latency_distribution (str): fixed, uniform (0 - 2x mean) or lognormal (long tail)
+    - rate_limit_probability (float): Probability that a call fails with a 429
+    - retry_after_seconds (float): Retry-After sent with injected 429s
+    - responder (callable): Optional (model, messages) -> str override for the response text
+    - seed (int): Seed for latencies, failures and generated text
+    - token_latency_seconds (float): Delay between the words of a streamed (`stream=True`) response
+    """
+    def __init__(
+        self,
+        latency_mean_seconds: float = 0.0,
+        latency_distribution: str = "lognormal",
+        rate_limit_probability: float = 0.0,
+        retry_after_seconds: float = 1.0,
+        responder: Optional[Callable] = None,
+        seed: Optional[int] = None,
+        token_latency_seconds: float = 0.0
+        ):
+        self.latency_mean_seconds = latency_mean_seconds
+        self.latency_distribution = latency_distribution
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after_seconds = retry_after_seconds
+        self.responder = responder
+        self.token_latency_seconds = token_latency_seconds
+        self.call_count = 0
+        self.rate_limited_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _latency(self) -> float:
+        if self.latency_mean_seconds <= 0:
+            return 0.0
+        with self._lock:
+            if self.latency_distribution == "fixed":
+                return self.latency_mean_seconds
+            if self.latency_distribution == "uniform":
+                return self._random.uniform(0, 2 * self.latency_mean_seconds)
+            # lognormal with sigma 0.5, scaled so that its mean is latency_mean_seconds
+            return self._random.lognormvariate(0, 0.5) * self.latency_mean_seconds / 1.1331
+
+    def _words(self, count: int) -> List[str]:
+        with self._lock:
+            return [self._random.choice(VOCABULARY) for _ in range(count)]
+
+    def _should_rate_limit(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.rate_limit_probability
+
+    def complete(self, model: str, messages, **kwargs):
+        with self._lock:
+            self.call_count += 1
+        time.sleep(self._latency())
+        if self._should_rate_limit():
+            with self._lock:
+                self.rate_limited_count += 1
+            error = HttpResponseError(
+                message="Rate limit is exceeded.",
+                response=MockHttpResponse(429, {"retry-after": str(self.retry_after_seconds)})
+            )
+            error.status_code = 429
+            raise error
+
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        prompt_tokens = max(1, len(prompt) // 4)
+        if self.responder is not None:
+            content = self.responder(model, messages)
+        else:
+            content = self.respond(prompt)
+        if kwargs.get("stream"):
+            return MockStream(content, model, prompt_tokens, self.token_latency_seconds)
+        return make_response(content, model, prompt_tokens)
+
+    def respond(self, prompt: str) -> str:
+        """
+        ### Templated response for a prompt of the headline, content or translation modules.
+        """
+        # Structured translation: fill in the requested JSON shape
+        shape_match = re.search(r"Respond with JSON in exactly this shape, by locale code and text type: (\{.*\})", prompt)
+        if shape_match is not None:
+            shape = json.loads(shape_match.group(1))
+            texts_match = re.search(r"The texts you need to translate are \(JSON, by text type\): (\{.*\})", prompt)
+            texts = json.loads(texts_match.group(1)) if texts_match is not None else {}
+            return json.dumps({
+                locale: {text_type: f"[{locale}] {texts.get(text_type, '')}".strip() for text_type in fields}
+                for locale, fields in shape.items()
+            }, ensure_ascii=False)
+        # Single translation
+        translate_match = re.search(r"The \w+ you need to translate is: (.*)\.\n", prompt, re.DOTALL)
+        if translate_match is not None:
+            target_match = re.search(r"Translate the text to: (\w+)", prompt)
+            target = target_match.group(1) if target_match is not None else "target"
+            return f"[{target}] {translate_match.group(1)}"
+        # Structured headline: JSON candidates
+        candidates_match = re.search(r'\{"candidates": .*\} with (\d+) candidates', prompt)
+        if "news article's headline" in prompt and candidates_match is not None:
+            return json.dumps({"candidates": [
+                {"headline": " ".join(self._words(10)).capitalize(), "detail": " ".join(self._words(12)).capitalize() + "."}
+                for _ in range(int(candidates_match.group(1)))
+            ]})
+        # Headline
+        if "news article's headline" in prompt:
+            headline = " ".join(self._words(10)).capitalize()
+            detail = " ".join(self._words(12)).capitalize() + "."
+            return f"{headline}\n{detail}"
+        # Content
+        sentences = [" ".join(self._words(12)).capitalize() + "." for _ in range(5)]
+        return " ".join(sentences)
+
+
+class MockAsyncChatCompletionsClient:
+    """
+    ### Local stand-in for the async `ChatCompletionsClient`, answering through a sync mock client.
+    Calls run in a worker thread, so their simulated latency doesn't block the event loop.
+    """
+    def __init__(self, client: Optional[MockChatCompletionsClient] = None):
+        self.client = client or MockChatCompletionsClient()
+
+    async def complete(self, model: str, messages, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.client.complete(model=model, messages=messages, **kwargs))
+
+    async def close(self):
+        pass
+
+
+def make_mock_mongo_client():
+    """
+    ### Returns a mongomock client (`pip install mongomock`) to stand in for MongoDB.
+    For a real local server, use `MongoClient("mongodb://localhost:27017")` instead.
+    """
+    if mongomock is None:
+        raise ImportError("mongomock is not installed. Install it with `pip install mongomock`, or point the database at a local mongod.")
+    return mongomock.MongoClient()
+
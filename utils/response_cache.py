@@ -0,0 +1,149 @@
+'''
+Response cache util module. A persistent, content-addressed cache for model call results, keyed by a
+hash of (stage, model, messages, parameters), with a TTL and size-based LRU eviction.
+'''
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Optional
+
+CACHE_FILE_PATH = "data/response_cache.sqlite"
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_MAX_SIZE_BYTES = 256 * 1024 * 1024
+# Expired entries are swept at most this often (a get never returns one in the meantime)
+TTL_SWEEP_INTERVAL_SECONDS = 60 * 60
+# Eviction frees space down to this share of the size limit, so it doesn't run again on the next set
+EVICTION_TARGET_RATIO = 0.9
+
+# Call parameters that don't change the response and are left out of the key
+IGNORED_PARAMS = {"connection_timeout", "read_timeout"}
+
+
+def make_key(stage: str, model: str, messages, params: dict) -> str:
+    """
+    ### Content hash of a model call.
+    """
+    payload = {
+        "stage": stage,
+        "model": model,
+        "messages": messages,
+        "params": {name: value for name, value in params.items() if name not in IGNORED_PARAMS},
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    ### SQLite backed response cache.
+    - Entries older than {ttl_seconds} are treated as misses and removed.
+    - When the stored values grow past {max_size_bytes}, the least recently used entries are evicted.
+    The total size is kept as a running count (read once when the cache is opened), so a set doesn't scan
+    the table. Expired entries are swept every TTL_SWEEP_INTERVAL_SECONDS.
+    """
+    def __init__(self, path: str = CACHE_FILE_PATH, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            '''
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._connection.commit()
+        self._total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._last_sweep_at = 0.0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._delete(key)
+                self._connection.commit()
+                return default
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+        return json.loads(value)
+
+    def set(self, key: str, value: Any):
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._connection.execute(
+                "INSERT INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, size, now, now)
+            )
+            self._total_size += size
+            if now - self._last_sweep_at >= TTL_SWEEP_INTERVAL_SECONDS:
+                self._sweep_expired(now)
+            if self._total_size > self.max_size_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def _delete(self, key: str):
+        # Callers hold the lock
+        row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_size -= row[0]
+
+    def _sweep_expired(self, now: float):
+        expired_before = now - self.ttl_seconds
+        expired_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses WHERE created_at < ?", (expired_before,)).fetchone()[0]
+        self._connection.execute("DELETE FROM responses WHERE created_at < ?", (expired_before,))
+        self._total_size -= expired_size
+        self._last_sweep_at = now
+
+    def _evict(self):
+        # Least recently used first, read through the accessed_at index until enough space is freed
+        target_size = self.max_size_bytes * EVICTION_TARGET_RATIO
+        evicted_keys = []
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            if self._total_size <= target_size:
+                break
+            evicted_keys.append((key,))
+            self._total_size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+            self._total_size = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    ### Returns the shared response cache (created on first use).
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,36 @@
+'''
+Serialization util module. Fast JSON encoding/decoding for articles and journals: uses orjson when it is
+installed and falls back to the standard json module otherwise. Both produce the same (UTF-8, compact) output.
+'''
+
+import json
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value) -> str:
+    """
+    ### Encodes {value} as a compact JSON string. Datetimes are encoded as isoformat strings.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def loads(text):
+    """
+    ### Decodes a JSON string (or bytes).
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
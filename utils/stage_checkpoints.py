@@ -0,0 +1,127 @@
+'''
+Stage checkpoints util module. Keeps the output of every finished pipeline stage (headline and detail,
+content, translations) in a local journal, keyed by article uid, until the article itself is stored.
+
+After a crash (or a failed stage), the partially generated articles are found again and only their
+missing stages are run (see article_generation.add_article_stages). An article is given up on (and its
+checkpoints dropped) after MAX_RESUME_ATTEMPTS resumes that didn't finish it.
+'''
+
+import threading
+from typing import Dict, List, Optional
+
+from utils import journal
+
+STAGE_CHECKPOINT_JOURNAL_PATH = "data/stage_checkpoints.jsonl"
+
+# Stage name of the marker appended once an article is stored
+DONE_STAGE = "done"
+# Stage name whose checkpoint carries the article's plan (locale, style, is_fake)
+PLAN_STAGE = "headline"
+# Stage name of the records counting the resumes of an article
+ATTEMPT_STAGE = "attempt"
+# Number of times an unfinished article is resumed before it is given up on
+MAX_RESUME_ATTEMPTS = 3
+
+
+class StageCheckpoints:
+    """
+    ### Journal of finished stage outputs, by article uid.
+    Records are `{"uid", "stage", "result", "model", "plan"}`, plus `{"uid", "stage": "attempt", "attempts"}`
+    for every resume. An article's records are dropped (on the next compaction) once it is marked as
+    finished, or given up on.
+    #### Args:
+    - path (str): Path of the checkpoint journal
+    - max_resume_attempts (int): Number of resumes after which an unfinished article is given up on
+    """
+    def __init__(self, path: str = STAGE_CHECKPOINT_JOURNAL_PATH, max_resume_attempts: int = MAX_RESUME_ATTEMPTS):
+        self.path = path
+        self.max_resume_attempts = max_resume_attempts
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, dict]] = {}
+        self._attempts: Dict[str, int] = {}
+        for record in journal.read_records(path):
+            if record.get("stage") == DONE_STAGE:
+                self._stages.pop(record["uid"], None)
+                self._attempts.pop(record["uid"], None)
+            elif record.get("stage") == ATTEMPT_STAGE:
+                self._attempts[record["uid"]] = record.get("attempts", 0)
+            else:
+                self._stages.setdefault(record["uid"], {})[record["stage"]] = record
+
+    def get(self, uid: str) -> Dict[str, dict]:
+        """
+        ### The checkpointed stages of an article: {stage: record}.
+        """
+        with self._lock:
+            return dict(self._stages.get(uid, {}))
+
+    def save(self, uid: str, stage: str, result, model: Optional[str] = None, plan: Optional[dict] = None):
+        """
+        ### Checkpoints the (JSON serializable) result of a finished stage.
+        """
+        record = {"uid": uid, "stage": stage, "result": result, "model": model}
+        if plan is not None:
+            record["plan"] = plan
+        journal.append_records(self.path, [record])
+        with self._lock:
+            self._stages.setdefault(uid, {})[stage] = record
+
+    def finish(self, uids: List[str]):
+        """
+        ### Marks articles as stored: their checkpoints are no longer needed.
+        """
+        with self._lock:
+            uids = [uid for uid in uids if uid in self._stages]
+            for uid in uids:
+                del self._stages[uid]
+                self._attempts.pop(uid, None)
+        journal.append_records(self.path, [{"uid": uid, "stage": DONE_STAGE} for uid in uids])
+
+    def unfinished(self) -> List[dict]:
+        """
+        ### Plans of the partially generated articles that can be resumed (not out of resume attempts yet).
+        #### Returns:
+        - List[dict]: {"uid", "locale", "style", "is_fake", "model"} per article, in checkpoint order
+        """
+        with self._lock:
+            plans = []
+            for uid, stages in self._stages.items():
+                record = stages.get(PLAN_STAGE)
+                if record is None or "plan" not in record or self._attempts.get(uid, 0) >= self.max_resume_attempts:
+                    continue
+                plans.append(dict(record["plan"], uid=uid, model=record["model"]))
+            return plans
+
+    def resume(self) -> List[dict]:
+        """
+        ### Plans of the articles to resume now (see `unfinished`), each with one more resume attempt recorded.
+        Articles that ran out of resume attempts are given up on: they are marked as finished.
+        """
+        plans = self.unfinished()
+        with self._lock:
+            given_up = [uid for uid, count in self._attempts.items() if count >= self.max_resume_attempts and uid in self._stages]
+            records = []
+            for plan in plans:
+                self._attempts[plan["uid"]] = self._attempts.get(plan["uid"], 0) + 1
+                records.append({"uid": plan["uid"], "stage": ATTEMPT_STAGE, "attempts": self._attempts[plan["uid"]]})
+        if records:
+            journal.append_records(self.path, records)
+        if given_up:
+            print(f"Giving up on {len(given_up)} unfinished articles after {self.max_resume_attempts} resume attempts.")
+            self.finish(given_up)
+        return plans
+
+    def compact(self) -> int:
+        """
+        ### Rewrites the journal with the records of the unfinished articles only.
+        #### Returns:
+        - int: Number of records kept
+        """
+        with self._lock:
+            records = [record for stages in self._stages.values() for record in stages.values()]
+            records += [
+                {"uid": uid, "stage": ATTEMPT_STAGE, "attempts": count}
+                for uid, count in self._attempts.items() if uid in self._stages
+            ]
+            return journal.rewrite(self.path, records)
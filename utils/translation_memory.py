@@ -0,0 +1,238 @@
+'''
+Translation memory util module. A persistent store of sentence-level translation pairs, keyed by
+(source locale, target locale, news outlet style), with exact and fuzzy segment lookups.
+
+Exact matches (the same segment, up to whitespace) are reused as they are. Fuzzy matches (found through
+an inverted word index and confirmed with the Jaccard similarity of character n-grams, see headline_index)
+are given to the model as examples.
+'''
+
+import re
+import time
+import math
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from utils.headline_index import jaccard, normalize, shingles, words
+
+TRANSLATION_MEMORY_FILE_PATH = "data/translation_memory.sqlite"
+# Jaccard similarity (of character n-grams) above which a stored segment is a fuzzy match
+FUZZY_MATCH_THRESHOLD = 0.5
+# Number of best word-index candidates checked for fuzzy matches
+MAX_CANDIDATES = 50
+
+# Splits after sentence-ending punctuation and on line breaks. The separators are kept (odd positions).
+_segment_pattern = re.compile(r"((?<=[.!?…])\s+|\s*\n\s*)")
+
+
+def split_segments(text: str) -> Tuple[List[str], List[str]]:
+    """
+    ### Splits a text into sentence segments.
+    #### Returns:
+    - (segments, separators): `join_segments(segments, separators)` gives back the text
+    """
+    parts = _segment_pattern.split(text)
+    return parts[0::2], parts[1::2]
+
+
+def segment_key(segment: str) -> str:
+    """
+    ### Key of a segment for exact matches: the segment with its whitespace collapsed.
+    Case, accents and punctuation are kept, since they can change the meaning (e.g. "." and "?").
+    """
+    return " ".join(segment.split())
+
+
+def join_segments(segments: List[str], separators: List[str]) -> str:
+    text = segments[0] if segments else ""
+    for separator, segment in zip(separators, segments[1:]):
+        text += separator + segment
+    return text
+
+
+class SegmentIndex:
+    '''
+    ### In-memory exact and fuzzy index over the segment pairs of one (source, target, style) key.
+    '''
+    def __init__(self):
+        self.exact: Dict[str, str] = {}
+        self._pairs: List[Tuple[str, str, str]] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+
+    def add(self, source: str, target: str):
+        key = segment_key(source)
+        normalized = normalize(source)
+        if normalized == "" or key in self.exact:
+            return
+        self.exact[key] = target
+        pair_id = len(self._pairs)
+        self._pairs.append((normalized, source, target))
+        for word in words(normalized):
+            self._postings[word].append(pair_id)
+
+    def fuzzy(self, segment: str, k: int, threshold: float) -> List[Tuple[str, str, float]]:
+        normalized = normalize(segment)
+        total = len(self._pairs)
+        scores: Dict[int, float] = defaultdict(float)
+        for word in words(normalized):
+            posting = self._postings.get(word)
+            if not posting:
+                continue
+            idf = math.log(1 + total / len(posting))
+            for pair_id in posting:
+                scores[pair_id] += idf
+        query_shingles = shingles(normalized)
+        matches = []
+        for pair_id in sorted(scores, key=scores.get, reverse=True)[:MAX_CANDIDATES]:
+            pair_normalized, source, target = self._pairs[pair_id]
+            similarity = jaccard(query_shingles, shingles(pair_normalized))
+            if similarity >= threshold:
+                matches.append((source, target, similarity))
+        matches.sort(key=lambda match: match[2], reverse=True)
+        return matches[:k]
+
+
+class TranslationMemory:
+    """
+    ### SQLite backed translation memory.
+    Segment pairs are persisted in SQLite and indexed in memory, one index per (source, target, style)
+    key, loaded on first use of the key. Pairs are stored by `segment_key`, so segments that only
+    normalize to the same text (see headline_index.normalize) are kept apart.
+    """
+    def __init__(self, path: str = TRANSLATION_MEMORY_FILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._indexes: Dict[Tuple[str, str, str], SegmentIndex] = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS segment_pairs (
+                source_locale TEXT NOT NULL,
+                target_locale TEXT NOT NULL,
+                style TEXT NOT NULL,
+                source_key TEXT NOT NULL,
+                source_text TEXT NOT NULL,
+                target_text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (source_locale, target_locale, style, source_key)
+            )
+            '''
+        )
+        self._migrate_segments_table()
+        self._connection.commit()
+
+    def _migrate_segments_table(self):
+        # Older memories keyed their pairs by normalized text (table `segments`): re-key them, then drop it
+        if self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'segments'").fetchone() is None:
+            return
+        rows = self._connection.execute(
+            "SELECT source_locale, target_locale, style, source_text, target_text, created_at FROM segments"
+        ).fetchall()
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO segment_pairs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(source_locale, target_locale, style, segment_key(source), source, target, created_at) for source_locale, target_locale, style, source, target, created_at in rows]
+        )
+        self._connection.execute("DROP TABLE segments")
+
+    def _index(self, key: Tuple[str, str, str]) -> SegmentIndex:
+        # Callers hold the lock
+        index = self._indexes.get(key)
+        if index is None:
+            index = SegmentIndex()
+            rows = self._connection.execute(
+                "SELECT source_text, target_text FROM segment_pairs WHERE source_locale = ? AND target_locale = ? AND style = ? ORDER BY created_at",
+                key
+            )
+            for source, target in rows:
+                index.add(source, target)
+            self._indexes[key] = index
+        return index
+
+    def lookup(self, source_locale: str, target_locale: str, style: str, segment: str) -> Optional[str]:
+        """
+        ### Stored translation of {segment} (compared up to whitespace, see `segment_key`), or None.
+        """
+        with self._lock:
+            return self._index((source_locale, target_locale, style)).exact.get(segment_key(segment))
+
+    def fuzzy_matches(
+        self,
+        source_locale: str,
+        target_locale: str,
+        style: str,
+        segment: str,
+        k: int = 3,
+        threshold: float = FUZZY_MATCH_THRESHOLD
+        ) -> List[Tuple[str, str, float]]:
+        """
+        ### Up to {k} stored (source, target, similarity) pairs similar to {segment}, best match first.
+        """
+        with self._lock:
+            return self._index((source_locale, target_locale, style)).fuzzy(segment, k, threshold)
+
+    def add(self, source_locale: str, target_locale: str, style: str, pairs: List[Tuple[str, str]]):
+        """
+        ### Stores (source segment, translated segment) pairs. Blank segments are ignored.
+        """
+        now = time.time()
+        rows = [
+            (source_locale, target_locale, style, segment_key(source), source.strip(), target.strip(), now)
+            for source, target in pairs
+            if normalize(source) != "" and target.strip() != ""
+        ]
+        if len(rows) == 0:
+            return
+        with self._lock:
+            self._connection.executemany("INSERT OR IGNORE INTO segment_pairs VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+            index = self._indexes.get((source_locale, target_locale, style))
+            if index is not None:
+                for _, _, _, _, source, target, _ in rows:
+                    index.add(source, target)
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM segment_pairs")
+            self._connection.commit()
+            self._indexes.clear()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_memory: Optional[TranslationMemory] = None
+_memory_lock = threading.Lock()
+
+
+def get_translation_memory() -> TranslationMemory:
+    """
+    ### Returns the shared translation memory (created on first use, at TRANSLATION_MEMORY_FILE_PATH
+    relative to the current directory).
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TranslationMemory()
+        return _memory
+
+
+def set_translation_memory(memory: Optional[TranslationMemory]):
+    """
+    ### Replaces the shared translation memory (e.g. with one at another path). The current one is closed.
+    With None, the next call to `get_translation_memory` opens a new one.
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is not None and _memory is not memory:
+            _memory.close()
+        _memory = memory
+
+
+def close_translation_memory():
+    """
+    ### Closes the shared translation memory. The next call to `get_translation_memory` opens it again.
+    """
+    set_translation_memory(None)